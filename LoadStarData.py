@@ -0,0 +1,309 @@
+"""
+Data structures for holding load cell samples in memory. These are free of
+any Qt or matplotlib dependencies so the acquisition side can use them too.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+HANDOFF_POLICIES = ("block", "drop-oldest", "spill")
+
+
+class BlockRing(object):
+    '''
+    A bounded hand-off of sample blocks from one producer thread (a load 
+    cell reader) to one consumer (the GUI), so a stalled consumer can not
+    make memory grow without limit.
+
+    Blocks are (name, times, values, filtered values or None) tuples.
+    Putting a block that fits takes no lock. What happens when the ring is full depends on the policy:
+        block        the producer waits for room. The samples back up into
+                     the serial driver, which may lose them when it fills.
+        drop-oldest  the oldest waiting blocks are discarded to make room.
+        spill        the new block is not queued. The reader has already
+                     handed it to the recorder, so it is only missing from
+                     the display.
+    Dropped and spilled samples are counted. The consumer takes everything
+    that is waiting with one call to drain().
+    '''
+    def __init__(self, capacity=1024, policy="drop-oldest"):
+        if policy not in HANDOFF_POLICIES:
+            raise ValueError("Unknown hand-off policy {}".format(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.slots = [None] * capacity
+        # Only the producer moves tail. head is moved by the consumer, and by
+        # the producer when it drops blocks, both with the lock held.
+        self.head = 0
+        self.tail = 0
+        self.lock = threading.Lock()
+        self.space = threading.Event()
+        self.closed = False
+        self.dropped_blocks = 0
+        self.dropped_samples = 0
+        self.spilled_samples = 0
+        self.blocked_seconds = 0.0
+        # What take_losses() has reported so far. Only the consumer uses these.
+        self.reported = (0, 0, 0.0)
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def qsize(self):
+        return self.tail - self.head
+
+    def put(self, block):
+        ''' Hand over a block. Returns False if it was not queued. '''
+        if self.tail - self.head < self.capacity:
+            self.slots[self.tail % self.capacity] = block
+            self.tail += 1
+            return True
+        return self.put_full(block)
+
+    def put_full(self, block):
+        if self.policy == "spill":
+            self.spilled_samples += len(block[1])
+            return False
+        if self.policy == "block":
+            start = time.monotonic()
+            while self.tail - self.head >= self.capacity and not self.closed:
+                self.space.clear()
+                if self.tail - self.head >= self.capacity:
+                    self.space.wait(0.1)
+            self.blocked_seconds += time.monotonic() - start
+            if self.closed:
+                return False
+            return self.put(block)
+        with self.lock:
+            while self.tail - self.head >= self.capacity:
+                index = self.head % self.capacity
+                self.dropped_blocks += 1
+                self.dropped_samples += len(self.slots[index][1])
+                self.slots[index] = None
+                self.head += 1
+            self.slots[self.tail % self.capacity] = block
+            self.tail += 1
+        return True
+
+    def drain(self):
+        ''' Take all waiting blocks, oldest first. '''
+        with self.lock:
+            head, tail = self.head, self.tail
+            blocks = []
+            for position in range(head, tail):
+                index = position % self.capacity
+                blocks.append(self.slots[index])
+                self.slots[index] = None
+            self.head = tail
+        self.space.set()
+        return blocks
+
+    def take_losses(self):
+        '''
+        The samples dropped and spilled and the seconds the producer spent
+        waiting since the last call. Called by the consumer.
+        '''
+        totals = (self.dropped_samples, self.spilled_samples, self.blocked_seconds)
+        losses = tuple(total - reported for total, reported in zip(totals, self.reported))
+        self.reported = totals
+        return losses
+
+    def close(self):
+        ''' Release a producer waiting for room; nothing more is queued after that. '''
+        self.closed = True
+        self.space.set()
+
+
+class SampleBuffer(object):
+    '''
+    A growable columnar store of (timestamp, value) samples.
+
+    The timestamps and values live in two preallocated float64 arrays that
+    double in size when they fill up, so appending a chunk is amortized O(1)
+    per sample. The times and values properties are views into the arrays
+    (no copies) that cover only the filled part.
+    '''
+    def __init__(self, capacity=4096):
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self.length = 0
+        # Incremented by clear() so readers holding an index know to start over
+        self.generation = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def capacity(self):
+        return len(self._times)
+
+    @property
+    def times(self):
+        return self._times[:self.length]
+
+    @property
+    def values(self):
+        return self._values[:self.length]
+
+    def reserve(self, capacity):
+        ''' Make sure at least capacity samples fit without reallocating. '''
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(self.capacity, 1)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        for name in ("_times", "_values"):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=np.float64)
+            new[:self.length] = old[:self.length]
+            setattr(self, name, new)
+
+    def append(self, times, values):
+        ''' Append a chunk of samples. times and values are array-likes of equal length. '''
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if times.shape != values.shape:
+            raise ValueError("times and values must have the same length.")
+        count = len(times)
+        if count == 0:
+            return
+        self.reserve(self.length + count)
+        self._times[self.length:self.length + count] = times
+        self._values[self.length:self.length + count] = values
+        self.length += count
+
+    def since(self, index):
+        ''' Views of the samples appended after index. '''
+        return self._times[index:self.length], self._values[index:self.length]
+
+    def clear(self):
+        ''' Forget all samples but keep the allocated memory. '''
+        self.length = 0
+        self.generation += 1
+
+
+def visible_range(x, x0, x1):
+    '''
+    The index range of the sorted array x that covers [x0, x1], including
+    one neighbouring sample on each side so lines run off the edges of the
+    view instead of stopping short.
+    '''
+    i0 = max(int(np.searchsorted(x, x0, 'left')) - 1, 0)
+    i1 = min(int(np.searchsorted(x, x1, 'right')) + 1, len(x))
+    return i0, i1
+
+
+def minmax_indices(x, y, x0, x1, buckets):
+    '''
+    Reduce the samples to at most four per bucket: the first, the last, the
+    minimum and the maximum, so spikes survive no matter how many samples
+    share a pixel column. The buckets split [x0, x1] evenly and x must be
+    sorted. Returns the sorted indices of the kept samples and the index of
+    the first sample of the last bucket.
+    '''
+    n = len(x)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), 0
+    bucket = np.floor((x - x0) * (buckets / (x1 - x0))).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    group = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    hits = np.flatnonzero(y == np.minimum.reduceat(y, starts)[group])
+    imin = hits[np.unique(group[hits], return_index=True)[1]]
+    hits = np.flatnonzero(y == np.maximum.reduceat(y, starts)[group])
+    imax = hits[np.unique(group[hits], return_index=True)[1]]
+    return np.unique(np.concatenate((starts, ends, imin, imax))), starts[-1]
+
+
+def lttb_indices(x, y, threshold):
+    '''
+    Largest-Triangle-Three-Buckets downsampling to threshold points.
+    Returns the indices of the kept samples.
+    '''
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # The first and last points are always kept; the rest are split evenly
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(np.r_[edges, n])
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:stop] - y[a]) -
+                      (x[a] - x[start:stop]) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+class Decimator(object):
+    '''
+    Reduces one series to what can be seen in the current view, so the cost
+    of rendering depends on the width of the plot instead of on the number of
+    samples.
+
+    The result is cached for the last view. For the min/max method the bucket
+    edges stay fixed as long as the view does not change, so new samples only
+    cause the last bucket to be recomputed.
+    '''
+    METHODS = ("minmax", "lttb", "none")
+
+    def __init__(self, method="minmax"):
+        self.method = method
+        self.reset()
+
+    def reset(self):
+        self.key = None
+        self.length = 0
+        self.result = None
+        self.kept = None
+        self.tail = 0
+
+    def decimate(self, x, y, x0, x1, pixels):
+        ''' Returns the x and y arrays to plot for the view [x0, x1]. '''
+        n = len(x)
+        key = (x0, x1, pixels)
+        if key == self.key and n == self.length and self.result is not None:
+            return self.result
+        if self.method == "none" or n == 0 or x1 <= x0:
+            self.result = (x, y)
+        else:
+            i0, i1 = visible_range(x, x0, x1)
+            if i1 - i0 <= 4 * pixels:
+                # Few enough samples to plot them all, and views are free
+                self.kept = None
+                self.result = (x[i0:i1], y[i0:i1])
+            elif self.method == "lttb":
+                kept = i0 + lttb_indices(x[i0:i1], y[i0:i1], 2 * pixels)
+                self.result = (x[kept], y[kept])
+            else:
+                if key == self.key and n > self.length and self.kept is not None:
+                    # Only redo the buckets from the last one onwards
+                    start = self.tail
+                    previous = self.kept[self.kept < start]
+                else:
+                    start = i0
+                    previous = np.empty(0, dtype=np.int64)
+                kept, tail = minmax_indices(x[start:i1], y[start:i1], x0, x1, pixels)
+                self.kept = np.concatenate((previous, start + kept))
+                self.tail = start + tail
+                self.result = (x[self.kept], y[self.kept])
+        self.key = key
+        self.length = n
+        return self.result
@@ -27,134 +27,148 @@ default license is as follows:
 
 from PyQt5.QtWidgets import (QMainWindow,
                              QWidget,
-                             QTreeView,
                              QMessageBox,
                              QFileDialog,
                              QLabel,
-                             QSlider,
-                             QCheckBox,
-                             QLineEdit,
                              QVBoxLayout,
                              QApplication,
-                             QPushButton,
                              QTableWidget,
-                             QTableView,
                              QTableWidgetItem,
                              QScrollArea,
                              QAbstractScrollArea,
-                             QAbstractItemView,
                              QSizePolicy,
                              QGridLayout,
-                             QGroupBox,
                              QComboBox,
                              QAction,
-                             QDockWidget,
                              QDialog,
                              QFrame,
                              QDialogButtonBox,
-                             QInputDialog,
-                             QProgressDialog,
+                             QDoubleSpinBox,
+                             QSpinBox,
+                             QLineEdit,
+                             QPushButton,
+                             QCheckBox,
+                             QHBoxLayout,
+                             QFormLayout,
                              QTabWidget)
-from PyQt5.QtCore import Qt, QTimer, QAbstractTableModel, QCoreApplication, QSize
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon
 import queue
 import time
 import os
 import sys
 import serial
-import serial.tools.list_ports
 import threading
-
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-#import matplotlib.pyplot as plt
-import matplotlib.figure as mpl
-import matplotlib.dates as md
-import datetime as dt
-import csv
 import traceback
 
-import logging
-logger = logging.getLogger(__name__)
-
-from matplotlib import rcParams
-rcParams.update({'figure.autolayout': True}) #Depends on matplotlib from graphing
-markers = [ "D", "o", "v", "*", "^", "<", ">", "1", "2", "3", "4", "8", "s", "p", "P", "h", "H", "+", "x", "X", "d", "|"]
-
+from LoadStarData import SampleBuffer, BlockRing
+from LoadStarSerial import loadcellThread, open_load_cell
+from LoadStarSimulator import SIMULATOR_URL, is_simulator_url
+from LoadStarMetrics import PipelineMetrics
+from LoadStarStats import RollingStats
+from LoadStarRedraw import RedrawScheduler
+from LoadStarSession import SessionRecorder, SESSION_EXTENSION
+from LoadStarLog import start_logging, log_file
+# Filters, triggers, publishing, shared memory, replays and opening files
+# are imported where they are first set up, so they do not slow the start.
 
 import logging
-import logging.config
-
-logging_dictionary = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "csv_format": {
-            "class": "logging.Formatter",
-            "datefmt": "%Y-%m-%d %H:%M:%S",
-            "format": "{\"%(asctime)s,%(message)s\"},"
-        },
-        "simple": {
-            "format": "%(message)s"
-        }
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "level": "DEBUG",
-            "formatter": "simple",
-            "stream": "ext://sys.stdout"
-        },
-        "file_handler": {
-            "class": "logging.FileHandler",
-            "level": "DEBUG",
-            "formatter": "csv_format",
-            "filename": "LoadStar_Log.json",
-            "mode": "w",
-            "encoding": "utf8"
-        }
-    },
-    "loggers": {
-        "": {
-            "handlers": [
-                "console",
-                "file_handler"
-            ],
-            "level": "DEBUG",
-            "propagate": True
-        }
-    }
-}
-logging.config.dictConfig(logging_dictionary)
 logger = logging.getLogger(__name__)
 
+# Blocks each reader can hand over before the policy applies (see BlockRing)
+HANDOFF_CAPACITY = 1024
+HANDOFF_POLICY = "drop-oldest"
+# Lengths in seconds of the rolling statistics windows in the status panel
+STATS_WINDOWS = (1.0, 10.0, 60.0)
+# Event tabs kept open; the oldest is closed when another event comes in
+EVENT_TAB_LIMIT = 20
+METRICS_FILE_NAME = "LoadStar_Metrics"
+METRICS_INTERVAL = 10000 #milliseconds
+
 class LoadStarLogger(QMainWindow):
-    def __init__(self):
+    def __init__(self, setup_dialog=True):
         super(LoadStarLogger,self).__init__()
         
-        self.logfile = logging_dictionary["handlers"]["file_handler"]["filename"]
-        logger.info("Session log file is {}".format(self.logfile))
+        # Logging is started when the program starts (see the bottom of this
+        # file), so that importing this module leaves it alone.
+        self.logfile = log_file()
+        if self.logfile is not None:
+            logger.info("Session log file is {}".format(self.logfile))
 
         self.title = "LoadStar Logger"
         self.setWindowTitle("LoadStar Sensor Logger at TU")
 
+        # Each reader thread hands its samples over through its own bounded 
+        # BlockRing. They share one clock anchor, so the load cells are 
+        # plotted on a common time base.
+        self.loadcell_threads = {}
+        # Readers that were replaced, until their last samples are taken
+        self.retired_threads = []
+        # Events captured by the triggers of the readers (see LoadStarTrigger)
+        self.event_queue = queue.Queue()
+        self.trigger_settings = None
+        self.event_tab_list = []
+        # Filter stages of the readers (see LoadStarFilter), None for none
+        self.filter_settings = None
+        # Serves the samples to other programs (see LoadStarPublish)
+        self.publish_settings = None
+        self.publisher = None
+        # Rings of the newest samples in shared memory (see LoadStarShared),
+        # by device name, while sharing is on
+        self.sharing = False
+        self.shared_rings = {}
+        # The last replay that was set up (see LoadStarReplay)
+        self.replay_settings = None
+        self.recorders = {}
+        self.clock_anchor = (time.time(), time.monotonic())
+        self.rate_update_time = time.time()
+        self.voltage_graph = None
+
+        # Counters and timings of each stage, shown in the status area and
+        # written to the metrics files every METRICS_INTERVAL milliseconds
+        self.metrics = PipelineMetrics()
+        # (perf_counter time, interval in ms) of when the display timer was
+        # last started, which sets when its next tick is due
+        self.tick_scheduled = None
+        # Decides when the graph is redrawn (see LoadStarRedraw). In acquire
+        # only mode the samples are taken and recorded but never drawn.
+        self.redraw = RedrawScheduler()
+        self.acquire_only = False
+        # The oldest sample that is not on screen yet, for the sample age
+        self.oldest_undrawn = None
+
         logger.info("Initializing a New Document")
         self.create_new(False)
         
         self.init_ui()
 
+        # Finding the load cells can take seconds per device, so it runs on a
+        # worker thread and this timer picks up the result.
         logger.info("Setting up the Load cell  Serial System")
         self.loadcell = SerialDialog()
-        if self.loadcell.connect_load_cell:
-            self.setup_loadcell(dialog = False)
+        self.search_timer = QTimer(self)
+        self.search_timer.timeout.connect(self.check_loadcell_search)
+        self.setup_loadcell(dialog = setup_dialog)
         
         #progress_label.setText("Loading the PDF Report Generator")
         #self.pdf_engine = FLAReportTemplate(self)
 
-        read_timer = QTimer(self)
-        read_timer.timeout.connect(self.update_plot)
-        read_timer.start(250) #milliseconds
-        self.voltage_graph.show()
+        supervise_timer = QTimer(self)
+        supervise_timer.timeout.connect(self.supervise_loadcells)
+        supervise_timer.start(2000) #milliseconds
+
+        # The interval is set again on every tick (see update_plot)
+        self.read_timer = QTimer(self)
+        self.read_timer.timeout.connect(self.update_plot)
+        self.schedule_tick(self.redraw.next_tick(False))
+
+        metrics_timer = QTimer(self)
+        metrics_timer.timeout.connect(self.write_metrics)
+        metrics_timer.start(METRICS_INTERVAL)
+
+        # The main window is already on screen. The graph brings in 
+        # matplotlib, which is slow to import, so it follows right after.
+        QTimer.singleShot(0, self.init_graph)
 
     def init_ui(self):
         # Builds GUI
@@ -180,18 +194,25 @@ class LoadStarLogger(QMainWindow):
         open_file.triggered.connect(self.open_file)
         file_menu.addAction(open_file)
 
-        save_file = QAction(QIcon(r'icons/icons8_Save_48px.png'), '&Save', self)
-        save_file.setShortcut('Ctrl+S')
-        save_file.setStatusTip('Save the current data file.')
-        save_file.triggered.connect(self.save_file)
-        file_menu.addAction(save_file)
+        # The sessions are saved as they are recorded, so there is no Save;
+        # the samples can be written out as CSV instead.
+        export_file = QAction(QIcon(r'icons/icons8_Save_as_48px.png'), '&Export Data...', self)
+        export_file.setShortcut('Ctrl+E')
+        export_file.setStatusTip('Write the series in the graph to a CSV file.')
+        export_file.triggered.connect(self.export_file)
+        file_menu.addAction(export_file)
 
-        save_file_as = QAction(QIcon(r'icons/icons8_Save_as_48px.png'), 'Save &As...', self)
-        save_file_as.setShortcut('Ctrl+Shift+S')
-        save_file.setStatusTip('Save current data file with a new name.')
-        save_file_as.triggered.connect(self.save_file_as)
-        file_menu.addAction(save_file_as)
+        file_menu.addSeparator()
+        setup_replay = QAction('&Replay...', self)
+        setup_replay.setShortcut('Ctrl+R')
+        setup_replay.setStatusTip('Feed a recorded session back through the live display.')
+        setup_replay.triggered.connect(self.setup_replay)
+        file_menu.addAction(setup_replay)
 
+        stop_replay = QAction('Stop Re&play', self)
+        stop_replay.setStatusTip('Stop all replays.')
+        stop_replay.triggered.connect(self.stop_replay)
+        file_menu.addAction(stop_replay)
 
         exit_action = QAction(QIcon(r'icons/icons8_Close_Window_48px.png'), '&Quit', self)
         exit_action.setShortcut('Ctrl+Q')
@@ -199,13 +220,73 @@ class LoadStarLogger(QMainWindow):
         exit_action.triggered.connect(self.confirm_quit)
         file_menu.addSeparator()
         file_menu.addAction(exit_action)
+
+        # Trigger Menu Items
+        trigger_menu = menubar.addMenu('&Triggers')
+        setup_trigger = QAction(QIcon(r'icons/icons8_Settings_48px.png'), 'Set Up &Trigger...', self)
+        setup_trigger.setShortcut('Ctrl+T')
+        setup_trigger.setStatusTip('Capture the samples around short load events.')
+        setup_trigger.triggered.connect(self.setup_trigger)
+        trigger_menu.addAction(setup_trigger)
+
+        disable_trigger = QAction('&Disable Trigger', self)
+        disable_trigger.setStatusTip('Stop capturing events.')
+        disable_trigger.triggered.connect(self.disable_trigger)
+        trigger_menu.addAction(disable_trigger)
+
+        # Filter Menu Items
+        filter_menu = menubar.addMenu('Fi&lters')
+        setup_filter = QAction('Set Up &Filter...', self)
+        setup_filter.setShortcut('Ctrl+L')
+        setup_filter.setStatusTip('Smooth the loads before they are plotted.')
+        setup_filter.triggered.connect(self.setup_filter)
+        filter_menu.addAction(setup_filter)
+
+        disable_filter = QAction('&Disable Filter', self)
+        disable_filter.setStatusTip('Stop filtering the loads.')
+        disable_filter.triggered.connect(self.disable_filter)
+        filter_menu.addAction(disable_filter)
+
+        # Network Menu Items
+        network_menu = menubar.addMenu('&Network')
+        setup_publisher = QAction('&Publish Samples...', self)
+        setup_publisher.setStatusTip('Serve the live samples to other programs over TCP or UDP.')
+        setup_publisher.triggered.connect(self.setup_publisher)
+        network_menu.addAction(setup_publisher)
+
+        stop_publisher = QAction('&Stop Publishing', self)
+        stop_publisher.setStatusTip('Stop serving the live samples.')
+        stop_publisher.triggered.connect(self.stop_publisher)
+        network_menu.addAction(stop_publisher)
+
+        network_menu.addSeparator()
+        self.share_action = QAction('Share Samples in &Memory', self)
+        self.share_action.setCheckable(True)
+        self.share_action.setStatusTip('Let other processes on this computer read the newest samples.')
+        self.share_action.toggled.connect(self.set_sharing)
+        # Shared memory needs Python 3.8 or newer (see LoadStarShared)
+        self.share_action.setEnabled(sys.version_info >= (3, 8))
+        network_menu.addAction(self.share_action)
+
+        # View Menu Items
+        view_menu = menubar.addMenu('&View')
+        show_graph = QAction('Show &Graph', self)
+        show_graph.setShortcut('Ctrl+G')
+        show_graph.setStatusTip('Show the graph of the loads.')
+        show_graph.triggered.connect(self.show_graphs)
+        view_menu.addAction(show_graph)
+
+        self.acquire_action = QAction('&Acquire Only', self)
+        self.acquire_action.setCheckable(True)
+        self.acquire_action.setStatusTip('Keep taking and recording samples without drawing them.')
+        self.acquire_action.toggled.connect(self.set_acquire_only)
+        view_menu.addAction(self.acquire_action)
         
         #build the entries in the dockable tool bar
         file_toolbar = self.addToolBar("File")
         file_toolbar.addAction(new_file)
         file_toolbar.addAction(open_file)
-        file_toolbar.addAction(save_file)
-        file_toolbar.addAction(save_file_as)
+        file_toolbar.addAction(export_file)
         file_toolbar.addSeparator()
         file_toolbar.addAction(exit_action)
         
@@ -239,27 +320,51 @@ class LoadStarLogger(QMainWindow):
         #self.message_duration = 0
         self.loadcell_value_label = QLabel("Value:\nSearching...")
         self.loadcell_value_label.setAlignment(Qt.AlignCenter)
+
+        self.loadcell_rate_label = QLabel("Throughput:\nSearching...")
+        self.loadcell_rate_label.setAlignment(Qt.AlignCenter)
+
+        self.loadcell_metrics_label = QLabel("Pipeline:\nWaiting...")
+        self.loadcell_metrics_label.setAlignment(Qt.AlignCenter)
           
         loadcell_layout.addWidget(QLabel("<html><h3>loadcell Status</h3></html>"))
         loadcell_layout.addWidget(self.loadcell_icon)
         loadcell_layout.addWidget(self.loadcell_time_label)
         loadcell_layout.addWidget(self.loadcell_value_label)
+        loadcell_layout.addWidget(self.loadcell_rate_label)
+        loadcell_layout.addWidget(self.loadcell_metrics_label)
         #loadcell_layout.addWidget(loadcell_setup_button)
 
-        
-        self.voltage_graph = GraphDialog(self, title="Load Cell Output")
-        #self.voltage_graph.set_yrange(9, 15)
-        self.voltage_graph.set_xlabel("Time")
-        self.voltage_graph.set_ylabel("Load (lb)")
-        self.voltage_graph.set_title("Loadstar Loadcell Time History")
-        
         self.grid_layout.addWidget(loadcell_box_area,0,0,1,1)
+
+        # Captured events, one tab each. Hidden until there is one.
+        self.event_tabs = QTabWidget()
+        self.event_tabs.setTabsClosable(True)
+        self.event_tabs.tabCloseRequested.connect(self.close_event_tab)
+        self.event_tabs.hide()
+        self.grid_layout.addWidget(self.event_tabs,0,1,1,1)
         
         main_widget = QWidget()
         main_widget.setLayout(self.grid_layout)
         self.setCentralWidget(main_widget)
         
         self.show()
+
+    def init_graph(self):
+        '''
+        Create the graph window the first time it is needed. This is the only
+        place the plotting module (and so matplotlib) is imported.
+        '''
+        if self.voltage_graph is not None:
+            return self.voltage_graph
+        from LoadStarGraph import GraphDialog
+        self.voltage_graph = GraphDialog(self, title="Load Cell Output")
+        #self.voltage_graph.set_yrange(9, 15)
+        self.voltage_graph.set_xlabel("Time")
+        self.voltage_graph.set_ylabel("Load (lb)")
+        self.voltage_graph.set_title("Loadstar Loadcell Time History")
+        self.voltage_graph.show()
+        return self.voltage_graph
     
     # def get_plot_bytes(self, fig):
     #     img = BytesIO()
@@ -270,8 +375,6 @@ class LoadStarLogger(QMainWindow):
 
     def create_new(self, new_file=True):
 
-        self.load_history = []
-
         try:
             self.export_path = os.path.join(os.path.expanduser('~'),"Documents","{}".format(self.title))
             if not os.path.exists(self.export_path):
@@ -281,12 +384,12 @@ class LoadStarLogger(QMainWindow):
             self.export_path = os.path.expanduser('~')
 
         self.filename = os.path.join(self.export_path,
-            "{} {}.log".format(self.title, time.strftime("%Y-%m-%d %H%M%S", time.localtime())))
+            "{} {}{}".format(self.title, time.strftime("%Y-%m-%d %H%M%S", time.localtime()), SESSION_EXTENSION))
         if new_file:
             fname = QFileDialog.getSaveFileName(self,
                                              "Create New {} Data File".format(self.title),
                                              os.path.join(self.export_path, self.filename),
-                                             "",
+                                             "{} Session Files (*{})".format(self.title, SESSION_EXTENSION),
                                              "")
             if not fname[0]:
                 #the user pressed cancel
@@ -298,12 +401,45 @@ class LoadStarLogger(QMainWindow):
             self.export_path, self.filename = os.path.split(fname[0])
         logger.info("Current Data Directory is set to {}".format(self.export_path))
         logger.info("Current Data Package file is set to {}".format(self.filename))
+        # One sample store and one set of running statistics per load cell,
+        # by device name, and a store of the filtered loads next to the raw.
+        # Retired readers may still have blocks waiting, so they get one too.
+        self.load_histories = {}
+        self.filtered_histories = {}
+        self.load_stats = {}
+        for thread in list(self.loadcell_threads.values()) + self.retired_threads:
+            self.load_histories[thread.name] = SampleBuffer()
+            self.filtered_histories[thread.name] = SampleBuffer()
+            self.load_stats[thread.name] = RollingStats(STATS_WINDOWS)
+            thread.stats = self.load_stats[thread.name]
+        for name, thread in self.loadcell_threads.items():
+            if not thread.replay:
+                thread.recorder = self.start_recorder(name, thread.ser)
+
+    def start_recorder(self, name, ser):
+        ''' 
+        Stream all new samples from the load cell called name to its own 
+        session file, named after the current data file and the device. The 
+        file is only created once the first samples arrive.
+        '''
+        if name in self.recorders:
+            self.recorders[name].close()
+        base_name = os.path.splitext(self.filename)[0]
+        recorder = SessionRecorder(os.path.join(self.export_path, 
+                                                "{} {}{}".format(base_name, name, SESSION_EXTENSION)),
+                                   metadata={"Title": self.title,
+                                             "Name": name,
+                                             "Port": ser.port,
+                                             "Baud": ser.baudrate})
+        recorder.start()
+        self.recorders[name] = recorder
+        return recorder
 
         
         
 
     def show_graphs(self):
-        self.voltage_graph.show()
+        self.init_graph().show()
 
     def new_file(self):
         logger.debug("New File Selected.")
@@ -311,163 +447,62 @@ class LoadStarLogger(QMainWindow):
 
     def open_file(self):  
         """
+        Show a recorded session file or an exported CSV file in the graph. 
+        Session files are memory-mapped, so only the pages needed for what is
+        on screen are ever read.
 
-        Returns: a tuple as (filename, data_dictionary)
+        Returns: the name of the opened file 
                 or 
                 None if something went wrong.
         """  
-        filters = "{} Data Files (*.csv);;All Files (*.*)".format(self.title)
-        selected_filter = "{} Data Files (*.cpt)".format(self.title)
+        filters = "{0} Session Files (*{1});;{0} Data Files (*.csv);;All Files (*.*)".format(
+            self.title, SESSION_EXTENSION)
+        selected_filter = "{} Session Files (*{})".format(self.title, SESSION_EXTENSION)
         fname = QFileDialog.getOpenFileName(self, 
                                             'Open File',
                                             self.export_path,
                                             filters,
                                             selected_filter)
         if fname[0]:
+            from LoadStarSession import SessionReader, SessionFormatError, import_csv
+            base_name = os.path.basename(fname[0])
+            self.init_graph()
             try:
-                pgp_file_contents = pgpy.PGPMessage.from_file(fname[0])
-                logger.info("User opened signed file {}".format(fname[0]))
-            except:
-                err_msg = "File {} was not a properly formatted {} file.".format(self.filename, self.title)
+                if fname[0].lower().endswith(".csv"):
+                    for label, times, values in import_csv(fname[0]):
+                        samples = SampleBuffer(len(times))
+                        samples.append(times, values)
+                        self.voltage_graph.add_data(samples, 
+                                                    marker = '.', 
+                                                    label = "{} {}".format(base_name, label))
+                else:
+                    session = SessionReader(fname[0])
+                    self.voltage_graph.add_session(session, 
+                                                   marker = '.', 
+                                                   label = base_name)
+            except (SessionFormatError, ValueError, IndexError):
+                err_msg = "File {} was not a properly formatted {} file.".format(fname[0], self.title)
                 QMessageBox.warning(self, "File Format Error", err_msg)
                 logger.info(err_msg)
                 logger.debug(traceback.format_exc())
                 return
-
-            try:
-                new_data_package = json.loads(pgp_file_contents.message)
-                logger.info("Loaded data package from pgp file contents.")
-            except KeyError:
-                err_msg = "File {} was missing critical information.".format(fname[0])
-                QMessageBox.warning(self, "File Format Error", err_msg)
-                logger.debug(traceback.format_exc())
-                logger.info(err_msg)
-                return
-            except:
-                err_msg = "Failed to load data_package."
+            except OSError:
+                err_msg = "Failed to load {}.".format(fname[0])
                 QMessageBox.warning(self, "File Loading Error", err_msg)
                 logger.debug(traceback.format_exc())
                 logger.info(err_msg)
                 return
 
-            try:
-                if pgp_file_contents.is_signed:
-                    logger.debug("File is signed.")
-                    verification = self.verify_stream(pgp_file_contents, self.user_data.private_key)
-                else:
-                    verification = False
-                    logger.debug("File is not signed.")
-            except:
-                logger.debug(traceback.format_exc())
-                verification = False
-
-            if verification:
-                logger.info("The file was verified with a PGP signature")
-            else:
-                new_data_package["Warnings"].append("File signature not verified.")
-                err_msg = "File {} was not verified. It may have been altered or the verification key is invalid.".format(fname[0])
-                warn = QMessageBox.warning(self, "File Format Error",
-                                           err_msg + "\nWould you like to proceed anyways?",
-                                           QMessageBox.Yes | QMessageBox.No,
-                                           QMessageBox.No)
-                logger.info(err_msg)
-                if warn == QMessageBox.No:
-                    return
-            #if reload:    
-            self.data_package = new_data_package
-            self.export_path, self.filename = os.path.split(fname[0])
-            self.setWindowTitle('{} {}.{} - {}'.format(self.title,
-                                                       TU_RP1210_version["major"],
-                                                       TU_RP1210_version["minor"],
-                                                       self.filename))
-            self.data_package["File Name"] = self.filename 
-            self.reload_data()
-            logger.info("Opened File: {}".format(self.filename))
-            logger.info("Export Path: {}".format(self.export_path))
-            return (fname[0], new_data_package)   
+            self.setWindowTitle('{} - {}'.format(self.title, base_name))
+            self.voltage_graph.show_all()
+            self.voltage_graph.show()
+            logger.info("Opened File: {}".format(fname[0]))
+            return fname[0]
         
     
-    def save_file(self, backup=False):
-        """
-        Save the file as a CPT (short for TruckCRYPT) file to the
-        current path. 
-        """
-
-        if backup:
-            temp_name = os.path.basename(self.filename)
-            temp_name.strip("Backup_")
-            backup_name = "Backup_{}".format(temp_name)
-            filename = os.path.normpath(os.path.join(self.export_path, backup_name))
-        else:
-            filename = os.path.normpath(os.path.join(self.export_path, self.filename))
-            self.data_package["File Name"] = self.filename
-
-        progress_label = QLabel("Saving and signing {} file to {}".format(self.title,filename))
-        progress.setLabel(progress_label)
-
-        saved_pgp_message = self.user_data.make_pgp_message(self.data_package)
-        with open(filename,'w') as file_out:
-            file_out.write(str(saved_pgp_message))
-
-        if not backup:
-            with open(filename[:-3] + 'json', 'w') as outfile:
-                outfile.write(saved_pgp_message.message)
-            msg = "Saved signed file to {}".format(filename)
-            logger.info(msg)
-            self.filename = os.path.basename(self.filename)
-            self.setWindowTitle('{} {}.{} - {}'.format(self.title,
-                                                       TU_RP1210_version["major"],
-                                                       TU_RP1210_version["minor"],
-                                                       self.filename))
-            self.statusBar().showMessage(msg)
-        progress.setValue(1)
-        
-        #CAN Logs
-        progress_label.setText("Saving and signing CAN logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["can_handler"]["filename"],
-                                             " CAN Log", 
-                                             "CAN Log File")
-        progress.setValue(2)
-        
-        progress_label.setText("Saving and signing J1708 logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["j1708_handler"]["filename"],
-                                             " J1708 Log", 
-                                             "J1708 Log File")
-        progress.setValue(3)
-        
-        
-        # Session Logs
-        progress_label.setText("Saving and signing session debug logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["file_handler"]["filename"],
-                                         " Session Log", 
-                                         "Session Log File")
-        progress.setValue(4)
-        progress_label.setText("Done with saving and signing all the user files.")
-        QCoreApplication.processEvents()
-        
-        self.Components.rebuild_trees()
-        return saved_pgp_message
-    
-    
-    def save_file_as(self):
-        filters = "{} Data Files (*.cpt);;All Files (*.*)".format(self.title)
-        selected_filter = "{} Data Files (*.cpt)".format(self.title)
-        fname = QFileDialog.getSaveFileName(self, 
-                                            'Save File As',
-                                            os.path.join(self.export_path,self.filename),
-                                            filters,
-                                            selected_filter)
-        if fname[0]:
-            if fname[0][-4:] ==".cpt":
-                self.filename = fname[0]
-            else:
-                self.filename = fname[0]+".cpt"
-            self.export_path, self.filename = os.path.split(fname[0])
-            return self.save_file()
-    
+    def export_file(self):
+        ''' Export the series in the graph to a CSV file (see GraphDialog.export_data). '''
+        self.init_graph().export_data()
     
     def confirm_quit(self):
         self.close()
@@ -479,106 +514,597 @@ class LoadStarLogger(QMainWindow):
             QMessageBox.Yes)
         if result == QMessageBox.Yes:
             logger.debug("Quitting.")
+            self.write_metrics()
+            if self.publisher is not None:
+                self.publisher.stop()
+            for thread in self.loadcell_threads.values():
+                thread.shared = None
+            self.close_shared_rings()
+            for recorder in self.recorders.values():
+                recorder.close(timeout=5)
             event.accept()
         else:
             event.ignore()
    
     def setup_loadcell(self, dialog=True):
-        
+        '''
+        Reconnect the load cells in the settings file in the background. If 
+        none of them answers and dialog is set, the port selection dialog is 
+        shown once the search is over.
+        '''
         logger.debug("Setup loadcell with file.")
-        success = self.loadcell.try_loadcell()
-        if not success:
+        self.search_dialog = dialog
+        self.loadcell_icon.setText("<html><img src='/icons/icons8_loadcell_Disconnected_48px.png'><br>Searching...</html>")
+        self.loadcell.start_search()
+        self.search_timer.start(100) #milliseconds
+
+    def check_loadcell_search(self):
+        if self.loadcell.searching:
+            return
+        self.search_timer.stop()
+        self.loadcell.finish_search()
+        if self.loadcell.connected:
+            self.loadcell.save_settings()
+        elif self.search_dialog:
             logger.debug("Setup loadcell with dialog box.")
-            self.loadcell.run()
+            self.loadcell.run(self.loadcell.ports)
+        for name, ser in self.loadcell.take_removed():
+            self.stop_loadcell_thread(name)
+            try:
+                ser.close()
+            except Exception:
+                logger.debug(traceback.format_exc())
         
         if self.loadcell.connected:
-
-
-            self.loadcell_icon.setText("<html><img src='/icons/icons8_loadcell_Signal_48px.png'><br>Connected on {}</html>".format(self.loadcell.ser.port))
-             
-            self.loadcell_queue = queue.Queue()
-            self.loadcell_thread = loadcellThread(self.loadcell_queue,self.loadcell.ser)
-            self.loadcell_thread.setDaemon(True) #needed to close the thread when the application closes.
-            self.loadcell_thread.start()
-            logger.debug("Started loadcell Thread.")
-
+            for name, ser in self.loadcell.connections.items():
+                thread = self.loadcell_threads.get(name)
+                if thread is None or not thread.is_alive() or thread.ser is not ser:
+                    self.start_loadcell_thread(name, ser)
         else:
             logger.debug("Setup loadcell Failed.")
+        self.update_loadcell_icon()
+
+    def start_loadcell_thread(self, name, ser):
+        old_thread = self.loadcell_threads.get(name)
+        if old_thread is not None:
+            old_thread.runSignal = False
+            old_thread.rx_queue.close()
+            self.retired_threads.append(old_thread)
+        if name not in self.load_histories:
+            self.load_histories[name] = SampleBuffer()
+            self.filtered_histories[name] = SampleBuffer()
+            self.load_stats[name] = RollingStats(STATS_WINDOWS)
+        recorder = self.recorders.get(name)
+        if recorder is None or not recorder.is_alive():
+            recorder = self.start_recorder(name, ser)
+        ring = BlockRing(HANDOFF_CAPACITY, HANDOFF_POLICY)
+        thread = loadcellThread(ring, ser, recorder, name, self.clock_anchor,
+                                self.make_trigger_engine(name), self.event_queue,
+                                self.make_filter(), self.publisher, 
+                                self.shared_ring(name), self.load_stats[name])
+        thread.setDaemon(True) #needed to close the thread when the application closes.
+        thread.start()
+        self.loadcell_threads[name] = thread
+        logger.debug("Started loadcell Thread for {}.".format(name))
+
+    def setup_replay(self):
+        dialog = ReplayDialog(self.replay_settings, self.export_path)
+        if dialog.exec_():
+            self.replay_settings = dialog.settings()
+            self.start_replay()
+
+    def start_replay(self):
+        '''
+        Replay every load cell in the file of the replay settings, each under
+        its own name with " Replay" added, so they are never mistaken for (or
+        reconnected as) live load cells.
+        '''
+        from LoadStarReplay import read_recordings, replay_speed
+        from LoadStarSession import SessionFormatError
+        settings = self.replay_settings
+        path = settings["File"]
+        try:
+            recordings = read_recordings(path)
+        except (SessionFormatError, ValueError, IndexError):
+            err_msg = "File {} was not a properly formatted {} file.".format(path, self.title)
+            QMessageBox.warning(self, "File Format Error", err_msg)
+            logger.info(err_msg)
+            logger.debug(traceback.format_exc())
+            return
+        except OSError:
+            err_msg = "Failed to load {}.".format(path)
+            QMessageBox.warning(self, "File Loading Error", err_msg)
+            logger.debug(traceback.format_exc())
+            logger.info(err_msg)
+            return
+        for recording in recordings:
+            self.start_replay_thread("{} Replay".format(recording.name), recording,
+                                     replay_speed(settings["Mode"], settings["Speed"]), 
+                                     settings["Loop"])
+        self.update_loadcell_icon()
+        self.show_graphs()
+        self.statusBar().showMessage("Replaying {}".format(os.path.basename(path)))
+
+    def start_replay_thread(self, name, recording, speed, loop):
+        from LoadStarReplay import ReplayThread, REPLAY_FASTEST
+        old_thread = self.loadcell_threads.get(name)
+        if old_thread is not None:
+            # Replaying again starts the series over
+            old_thread.runSignal = False
+            old_thread.rx_queue.close()
+        self.load_histories[name] = SampleBuffer()
+        self.filtered_histories[name] = SampleBuffer()
+        self.load_stats[name] = RollingStats(STATS_WINDOWS)
+        # As fast as possible, the replay waits for the display rather than
+        # losing blocks, so it runs at the rate the display keeps up with.
+        policy = "block" if speed == REPLAY_FASTEST else HANDOFF_POLICY
+        ring = BlockRing(HANDOFF_CAPACITY, policy)
+        thread = ReplayThread(ring, recording, None, name, self.clock_anchor,
+                              self.make_trigger_engine(name), self.event_queue,
+                              self.make_filter(), self.publisher,
+                              self.shared_ring(name), self.load_stats[name],
+                              speed=speed, loop=loop)
+        thread.setDaemon(True)
+        thread.start()
+        self.loadcell_threads[name] = thread
+        logger.debug("Started replay Thread for {}.".format(name))
+
+    def stop_loadcell_thread(self, name):
+        '''
+        Stop the reader of the load cell called name and close its session
+        file. Blocks it already handed over are still taken.
+        '''
+        thread = self.loadcell_threads.pop(name, None)
+        if thread is not None:
+            thread.runSignal = False
+            thread.rx_queue.close()
+            self.retired_threads.append(thread)
+            logger.debug("Stopped the reader of {}.".format(name))
+        recorder = self.recorders.pop(name, None)
+        if recorder is not None:
+            recorder.close(timeout=5)
+
+    def stop_replay(self):
+        for name, thread in list(self.loadcell_threads.items()):
+            if thread.replay:
+                self.stop_loadcell_thread(name)
+        self.update_loadcell_icon()
+        self.statusBar().showMessage("Stopped replaying.")
+
+    def supervise_loadcells(self):
+        '''
+        Restart the reader of any load cell whose thread died, for example
+        because the cable was pulled. Called periodically from a timer.
+        '''
+        for name, thread in list(self.loadcell_threads.items()):
+            if thread.is_alive() or not thread.runSignal:
+                continue
+            device = self.loadcell.devices.get(name)
+            if device is None:
+                continue
+            logger.debug("Trying to reconnect {}.".format(name))
+            try:
+                thread.ser.close()
+            except Exception:
+                logger.debug(traceback.format_exc())
+            ser = self.loadcell.connect_load_cell(device["Port"], device["Baud"], quiet=True)
+            if ser is not None:
+                self.loadcell.connections[name] = ser
+                self.start_loadcell_thread(name, ser)
+            else:
+                self.loadcell.connections.pop(name, None)
+        self.update_loadcell_icon()
+
+    def update_loadcell_icon(self):
+        running = [name for name, thread in self.loadcell_threads.items() if thread.is_alive()]
+        if running:
+            self.loadcell_icon.setText("<html><img src='/icons/icons8_loadcell_Signal_48px.png'><br>Connected on {}</html>".format(
+                "<br>".join(self.loadcell_threads[name].ser.port for name in running)))
+        else:
             self.loadcell_icon.setText("<html><img src='/icons/icons8_loadcell_Disconnected_48px.png'><br>Disconnected</html>")
-
         
     def update_plot(self):
-        while self.loadcell_queue.qsize() > 0:
-            self.load_history.append(self.loadcell_queue.get())
+        '''
+        Take the new samples from the readers on every tick, and redraw the
+        graph when the RedrawScheduler says it is due. Nothing is converted or
+        drawn while the graph is hidden, minimized or not updating, or in
+        acquire only mode; the series that got samples meanwhile are drawn
+        once it is shown again.
+        '''
+        tick_start = time.perf_counter()
+        metrics = self.metrics
+        if self.tick_scheduled is not None:
+            # The timer drops ticks while the previous one is still running.
+            # Measured with the interval this tick was scheduled with, since
+            # every tick sets a new one.
+            scheduled, interval = self.tick_scheduled
+            late = int(round((tick_start - scheduled) * 1000 / interval)) - 1
+            if late > 0:
+                metrics.count("frames_skipped", late)
+
+        # Each reader thread puts one (name, times, values, filtered) block
+        # per serial read into its ring; all of them are taken at once.
+        received = False
+        oldest = None
+        depth = 0
+        for thread in list(self.loadcell_threads.values()) + self.retired_threads:
+            ring = thread.rx_queue
+            blocks = ring.drain()
+            depth += len(blocks)
+            for name, times, values, filtered in blocks:
+                self.load_histories[name].append(times, values)
+                self.redraw.add(name)
+                if filtered is not None:
+                    self.filtered_histories[name].append(times, filtered)
+                    self.redraw.add(name, True)
+                metrics.count("samples_received", len(values), name)
+                if oldest is None or times[0] < oldest:
+                    oldest = times[0]
+                received = True
+            dropped, spilled, blocked = ring.take_losses()
+            if dropped:
+                metrics.count("samples_dropped", dropped, thread.name)
+            if spilled:
+                metrics.count("samples_spilled", spilled, thread.name)
+            if blocked:
+                metrics.count("reader_blocked_seconds", blocked, thread.name)
+        self.retired_threads = [thread for thread in self.retired_threads if thread.is_alive()]
+        metrics.set_gauge("queue_depth", depth)
+        if received:
+            self.update_value_label()
+        while not self.event_queue.empty():
+            self.add_event_tab(self.event_queue.get())
         
-        self.voltage_graph.add_data(self.load_history, 
-                    marker = '.', 
-                    label = "Load")
+        now = time.time()
+        if now - self.rate_update_time >= 1:
+            self.rate_update_time = now
+            self.update_status()
+
+        drawing = self.drawing()
+        if not drawing:
+            if self.voltage_graph is None and received:
+                # Still starting up; the samples are plotted once the graph exists
+                metrics.count("frames_skipped")
+            self.oldest_undrawn = None
+        elif oldest is not None and (self.oldest_undrawn is None or oldest < self.oldest_undrawn):
+            self.oldest_undrawn = oldest
+        # Samples that came in on this tick or still wait to be drawn mean
+        # more are probably coming, so tick again when the redraw is due.
+        waiting = received or bool(self.redraw.pending)
+        if drawing and self.redraw.due():
+            self.draw_graph()
+        self.schedule_tick(self.redraw.next_tick(drawing and waiting))
+        metrics.observe("tick_seconds", time.perf_counter() - tick_start)
+
+    def schedule_tick(self, interval):
+        ''' (Re)start the display timer, so it ticks next after interval milliseconds. '''
+        self.read_timer.start(interval)
+        self.tick_scheduled = (time.perf_counter(), interval)
+
+    def drawing(self):
+        ''' Whether the graph is on screen and its samples should be drawn. '''
+        graph = self.voltage_graph
+        return (not self.acquire_only and graph is not None and graph.isVisible() and 
+                not graph.isMinimized() and graph.update_button.isChecked())
+
+    def draw_graph(self):
+        ''' Convert the samples that are waiting (only the series that got any) and redraw. '''
+        metrics = self.metrics
+        start = time.perf_counter()
+        for name, filtered in self.redraw.take():
+            if filtered:
+                self.voltage_graph.add_data(self.filtered_histories[name], 
+                            marker = '-', 
+                            label = "{} Filtered".format(name),
+                            filtered = True)
+            else:
+                self.voltage_graph.add_data(self.load_histories[name], 
+                            marker = '.', 
+                            label = name)
         self.voltage_graph.plot()  
+        self.redraw.observe(time.perf_counter() - start)
+        metrics.set_gauge("redraw_interval_seconds", self.redraw.interval)
 
-class loadcellThread(threading.Thread):
-    '''This thread is designed to receive messages from a load_cell,
-       using the MicroPyload_cell https://github.com/inmcm/micropyload_cell
-    '''
-
-    def __init__(self, rx_queue, serial_port):
-        threading.Thread.__init__(self)
-        self.rx_queue = rx_queue
-        self.ser = serial_port
-        self.runSignal = True
-        self.message = None
-        
-        logger.debug("Started load_cellThread on {}".format(self.ser.port))
-
-    def run(self):
-        while self.runSignal:
-            time.sleep(0.001)
+        draw = self.voltage_graph.last_draw
+        if draw is None:
+            metrics.count("frames_skipped")
+        else:
+            seconds, full = draw
+            metrics.observe("draw_seconds", seconds)
+            metrics.count("full_draws" if full else "blits")
+            if self.oldest_undrawn is not None:
+                # How old the oldest new sample is when it reaches the screen,
+                # on the clock the readers stamp samples with
+                wall = self.clock_anchor[0] + (time.monotonic() - self.clock_anchor[1])
+                metrics.observe("sample_age_seconds", wall - self.oldest_undrawn)
+        self.oldest_undrawn = None
+
+    def set_acquire_only(self, acquire_only):
+        self.acquire_only = acquire_only
+        if acquire_only:
+            self.statusBar().showMessage("Acquiring only. The graph is not updated.")
+        else:
+            self.statusBar().showMessage("Drawing the graph again.")
+
+    def make_trigger_engine(self, name):
+        ''' A TriggerEngine for the load cell called name, or None if no trigger is set. '''
+        settings = self.trigger_settings
+        if settings is None:
+            return None
+        from LoadStarTrigger import Trigger, TriggerEngine
+        trigger = Trigger(settings["Kind"], settings["Level"], settings["Direction"],
+                          settings["Hysteresis"], settings["Window"])
+        return TriggerEngine(trigger, settings["Pre"], settings["Post"], name)
+
+    def setup_trigger(self):
+        dialog = TriggerDialog(self.trigger_settings)
+        if dialog.exec_():
+            self.trigger_settings = dialog.settings()
+            self.apply_trigger()
+
+    def disable_trigger(self):
+        self.trigger_settings = None
+        self.apply_trigger()
+
+    def apply_trigger(self):
+        ''' Give every reader a fresh engine for the current trigger settings. '''
+        for name, thread in self.loadcell_threads.items():
+            thread.trigger = self.make_trigger_engine(name)
+        if self.trigger_settings is None:
+            logger.info("Triggers are disabled.")
+            self.statusBar().showMessage("Triggers are disabled.")
+        else:
+            description = self.make_trigger_engine("").trigger.describe()
+            logger.info("Trigger set to {}".format(description))
+            self.statusBar().showMessage("Capturing events on {}".format(description))
+
+    def make_filter(self):
+        ''' A FilterChain for the current filter settings, or None. '''
+        if self.filter_settings is None:
+            return None
+        from LoadStarFilter import FilterChain
+        return FilterChain.from_settings(self.filter_settings)
+
+    def setup_filter(self):
+        dialog = FilterDialog(self.filter_settings)
+        if dialog.exec_():
+            self.filter_settings = dialog.settings()
+            self.apply_filter()
+
+    def disable_filter(self):
+        self.filter_settings = None
+        self.apply_filter()
+
+    def apply_filter(self):
+        '''
+        Give every reader a fresh filter for the current settings. The
+        filtered loads start over in new stores, so they are not a mix of two
+        filters and an export of the old ones is not disturbed.
+        '''
+        for name, thread in self.loadcell_threads.items():
+            thread.filter = self.make_filter()
+        for name in list(self.filtered_histories):
+            self.filtered_histories[name] = SampleBuffer()
+        chain = self.make_filter()
+        if chain is None:
+            logger.info("Filters are disabled.")
+            self.statusBar().showMessage("Filters are disabled.")
+        else:
+            logger.info("Filtering the loads with a {}".format(chain.describe()))
+            self.statusBar().showMessage("Filter: {}".format(chain.describe()))
+
+    def setup_publisher(self):
+        dialog = PublishDialog(self.publish_settings)
+        if dialog.exec_():
+            self.publish_settings = dialog.settings()
+            self.apply_publisher()
+
+    def stop_publisher(self):
+        self.publish_settings = None
+        self.apply_publisher()
+
+    def apply_publisher(self):
+        ''' Replace the publisher with one for the current settings and give it to every reader. '''
+        if self.publisher is not None:
+            for thread in self.loadcell_threads.values():
+                thread.publisher = None
+            self.publisher.stop()
+            self.publisher = None
+        settings = self.publish_settings
+        if settings is None:
+            self.statusBar().showMessage("Not publishing samples.")
+            return
+        from LoadStarPublish import Publisher
+        try:
+            self.publisher = Publisher(settings["Address"], settings["Port"], 
+                                       settings["Protocol"], settings["Mode"])
+        except OSError as e:
+            logger.debug(traceback.format_exc())
+            QMessageBox.warning(self, "Publish Samples", 
+                "Can not publish on {}:{}\n{}".format(settings["Address"], settings["Port"], e))
+            self.publish_settings = None
+            return
+        self.publisher.start()
+        for thread in self.loadcell_threads.values():
+            thread.publisher = self.publisher
+        self.statusBar().showMessage("Publishing samples on {}".format(self.publisher.url))
+
+    def shared_ring(self, name):
+        ''' The SharedRing of the load cell called name while sharing is on, or None. '''
+        if not self.sharing:
+            return None
+        ring = self.shared_rings.get(name)
+        if ring is None:
+            from LoadStarShared import SharedRing, shared_name
             try:
-                new_load = float(self.ser.readline()[1:].decode('ascii','ignore').strip())/1000
-                #logger.debug(new_load)
-                self.rx_queue.put((time.time(),new_load))
-            except ValueError:
-                pass
-            except:
-                logger.debug("Error within load_cell Read Thread.")
+                ring = self.shared_rings[name] = SharedRing.create(shared_name(name))
+            except (OSError, RuntimeError):
                 logger.debug(traceback.format_exc())
-                break
-            
-        logger.debug("load_cell Receive Thread is finished.")
-
+                return None
+        return ring
+
+    def set_sharing(self, sharing):
+        ''' Start or stop sharing the samples of every load cell in memory. '''
+        self.sharing = sharing
+        for name, thread in self.loadcell_threads.items():
+            thread.shared = self.shared_ring(name)
+        if sharing:
+            self.statusBar().showMessage("Sharing samples in memory as {}".format(
+                ", ".join(ring.name for ring in self.shared_rings.values()) or "soon as they arrive"))
+        else:
+            self.close_shared_rings()
+            self.statusBar().showMessage("Stopped sharing samples in memory.")
+
+    def close_shared_rings(self):
+        rings = self.shared_rings
+        self.shared_rings = {}
+        for ring in rings.values():
+            ring.close()
+
+    def add_event_tab(self, event):
+        ''' Show a captured EventRecord in a new tab. '''
+        from LoadStarGraph import GraphTab
+        tab = GraphTab(self, self.event_tabs, event.title)
+        tab.show_event(event)
+        self.event_tab_list.append(tab)
+        while len(self.event_tab_list) > EVENT_TAB_LIMIT:
+            oldest = self.event_tab_list.pop(0)
+            self.event_tabs.removeTab(self.event_tabs.indexOf(oldest.graph_tab))
+        self.event_tabs.setCurrentWidget(tab.graph_tab)
+        self.event_tabs.show()
+        self.metrics.count("events_captured", 1, event.name)
+        self.statusBar().showMessage("Captured {}".format(event.title))
+
+    def close_event_tab(self, index):
+        widget = self.event_tabs.widget(index)
+        self.event_tabs.removeTab(index)
+        self.event_tab_list = [tab for tab in self.event_tab_list if tab.graph_tab is not widget]
+        if not self.event_tab_list:
+            self.event_tabs.hide()
+
+    def update_value_label(self):
+        ''' Show the latest load and the running statistics of each load cell. '''
+        lines = ["Value:"]
+        for name, stats in sorted(self.load_stats.items()):
+            # The reader thread updates them meanwhile
+            with stats.lock:
+                if stats.current is None:
+                    continue
+                lines.append("{}: {:.3f} lb".format(name, stats.current))
+                for window in stats.windows:
+                    if window.count == 0:
+                        continue
+                    lines.append("{:g} s: {:.3f} \u00b1 {:.3f}\n({:.3f} to {:.3f})".format(
+                        window.seconds, window.mean, window.std or 0.0, window.min, window.max))
+                if stats.rate is not None:
+                    lines.append("Rate: {:.3f} lb/s".format(stats.rate))
+                lines.append("Peak: {:.3f} at {}".format(
+                    stats.peak, time.strftime("%H:%M:%S", time.localtime(stats.peak_time))))
+                lines.append("Low: {:.3f} at {}".format(
+                    stats.valley, time.strftime("%H:%M:%S", time.localtime(stats.valley_time))))
+        if len(lines) > 1:
+            self.loadcell_value_label.setText("\n".join(lines))
+
+    def update_status(self):
+        ''' Refresh the throughput and pipeline figures in the status area. '''
+        metrics = self.metrics
+        if self.loadcell_threads:
+            bytes_per_second = 0
+            lines_per_second = 0
+            for name, thread in self.loadcell_threads.items():
+                rates = thread.throughput()
+                bytes_per_second += rates[0]
+                lines_per_second += rates[1]
+                metrics.set_counter("bytes_read", thread.bytes_read, name)
+                metrics.set_counter("lines_read", thread.lines_read, name)
+                metrics.set_counter("parse_failures", thread.parse_failures, name)
+            self.loadcell_rate_label.setText("Throughput:\n{:.0f} bytes/s\n{:.0f} lines/s".format(
+                bytes_per_second, lines_per_second))
+        publisher = self.publisher
+        if publisher is not None:
+            metrics.set_counter("publish_frames_sent", publisher.frames_sent)
+            metrics.set_counter("publish_bytes_sent", publisher.bytes_sent)
+            metrics.set_counter("publish_frames_dropped", publisher.frames_dropped)
+            metrics.set_gauge("publish_subscribers", publisher.client_count)
+
+        def milliseconds(name):
+            histogram = metrics.histogram(name)
+            if histogram.count == 0:
+                return "-"
+            return "{:.0f} ms (p95 {:.0f})".format(1000 * histogram.last, 1000 * histogram.quantile(0.95))
+
+        if self.acquire_only:
+            redraw_interval = "never (acquire only)"
+        elif not self.drawing():
+            redraw_interval = "paused"
+        else:
+            redraw_interval = "{:.0f} ms".format(1000 * self.redraw.interval)
+
+        self.loadcell_metrics_label.setText(
+            "Pipeline:\n"
+            "Queue depth: {}\n"
+            "Sample age: {}\n"
+            "Update: {}\n"
+            "Draw: {}\n"
+            "Redraw every: {}\n"
+            "Skipped frames: {}\n"
+            "Dropped samples: {}\n"
+            "Parse failures: {}".format(metrics.gauges.get(("queue_depth", None), 0),
+                                        milliseconds("sample_age_seconds"),
+                                        milliseconds("tick_seconds"),
+                                        milliseconds("draw_seconds"),
+                                        redraw_interval,
+                                        metrics.counter("frames_skipped"),
+                                        metrics.counter("samples_dropped") + 
+                                        metrics.counter("samples_spilled"),
+                                        metrics.counter("parse_failures")))
+
+    def write_metrics(self):
+        '''
+        Append the metrics to the JSON lines file and rewrite the Prometheus
+        text file, both kept in the data directory.
+        '''
+        base = os.path.join(self.export_path, METRICS_FILE_NAME)
+        self.metrics.write(base + ".jsonl", base + ".prom")
 
 class SerialDialog(QDialog):
+    '''
+    Selects and connects any number of load cells. The devices that 
+    connected are saved to the settings file, one "port,baud,name" line each,
+    and reconnected from there on the next start.
+    '''
     def __init__(self):
         super(SerialDialog,self).__init__()
         #self.root = parent
-        self.baudrate = 4800
-        self.comport = "COM1"
+        self.baud_list = ["{}".format(b) for b in [4800, 9600, 115200, 1200, 1800, 2400, 19200, 38400, 57600, 115200, 
+                          230400, 460800, 500000, 576000, 921600, 1000000, 1152000, 1500000, 
+                          2000000, 2500000, 3000000, 3500000, 4000000]]
         self.setup_dialog()
-        self.setWindowTitle("Select Load Cell COM Port")
+        self.setWindowTitle("Select Load Cell COM Ports")
         self.setWindowModality(Qt.ApplicationModal)
-        self.connected = False
-        self.ser = None
+        # Configured devices and open serial ports, both by device name
+        self.devices = {}
+        self.connections = {}
+        # (name, serial port) of the connections that are no longer selected,
+        # until the main window has stopped their readers
+        self.removed = []
         self.load_cell_settings_file = "load_cell_setting.txt"
+        # Serial ports found and ports connected by the last search, by
+        # device name. finish_search takes them over on the GUI thread.
+        self.ports = []
+        self.found = {}
+        self.search_thread = None
 
+    @property
+    def connected(self):
+        return len(self.connections) > 0
 
     def setup_dialog(self):
 
-        load_cell_port_label = QLabel("load_cell Communications Port")
-        self.load_cell_port_combo_box = QComboBox()
-        self.load_cell_port_combo_box.setInsertPolicy(QComboBox.NoInsert)
-        for device in sorted(serial.tools.list_ports.comports(), reverse = True):
-            self.load_cell_port_combo_box.addItem("{} - {}".format(device.device, device.description))
-        self.load_cell_port_combo_box.setSizeAdjustPolicy(QComboBox.AdjustToContents)
-        
-        baud_list = ["{}".format(b) for b in [4800, 9600, 115200, 1200, 1800, 2400, 19200, 38400, 57600, 115200, 
-                     230400, 460800, 500000, 576000, 921600, 1000000, 1152000, 1500000, 
-                     2000000, 2500000, 3000000, 3500000, 4000000]]
-
-        baud_label = QLabel("load_cell Baud Rate")
-        self.baud_combo_box = QComboBox()
-        self.baud_combo_box.setInsertPolicy(QComboBox.NoInsert)
-        self.baud_combo_box.setSizeAdjustPolicy(QComboBox.AdjustToContents)
-        self.baud_combo_box.addItems(baud_list)
+        load_cell_port_label = QLabel("Check the communications port of each load cell to use")
+        self.port_table = QTableWidget(0, 4)
+        self.port_table.setHorizontalHeaderLabels(["Port", "Description", "Baud Rate", "Name"])
+        self.port_table.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
 
         self.buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
@@ -591,368 +1117,422 @@ class SerialDialog(QDialog):
 
         self.v_layout = QVBoxLayout()
         self.v_layout.addWidget(load_cell_port_label)
-        self.v_layout.addWidget(self.load_cell_port_combo_box)
-        self.v_layout.addWidget(baud_label)
-        self.v_layout.addWidget(self.baud_combo_box)
+        self.v_layout.addWidget(self.port_table)
         self.v_layout.addWidget(self.buttons)
 
         self.setLayout(self.v_layout)
     
-    def run(self):
-        self.load_cell_port_combo_box.clear()
-        for device in sorted(serial.tools.list_ports.comports(), reverse = True):
-            self.load_cell_port_combo_box.addItem("{} - {}".format(device.device, device.description))
-        self.load_cell_port_combo_box.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+    def run(self, ports=None):
+        ''' Show the dialog, listing the given ports or else all current ones. '''
+        configured = {device["Port"]: (name, device) for name, device in self.devices.items()}
+        if ports is None:
+            ports = self.list_ports()
+        rows = [(device.device, device.description) for device in ports]
+        # Simulated load cells can be picked like real ones. The URL can be 
+        # edited to set the rate, waveform and so on.
+        simulators = [port for port in configured if is_simulator_url(port)] or [SIMULATOR_URL]
+        rows += [(port, "Simulated iLoad Pro") for port in simulators]
+        self.port_table.setRowCount(len(rows))
+        for row, (port, description) in enumerate(rows):
+            name, settings = configured.get(port, ("Load {}".format(port), None))
+            port_item = QTableWidgetItem(port)
+            if is_simulator_url(port):
+                port_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsEditable)
+            else:
+                port_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
+            port_item.setCheckState(Qt.Checked if settings is not None else Qt.Unchecked)
+            self.port_table.setItem(row, 0, port_item)
+            description_item = QTableWidgetItem(description)
+            description_item.setFlags(Qt.ItemIsEnabled)
+            self.port_table.setItem(row, 1, description_item)
+            baud_combo_box = QComboBox()
+            baud_combo_box.addItems(self.baud_list)
+            if settings is not None:
+                baud_combo_box.setCurrentText(str(settings["Baud"]))
+            self.port_table.setCellWidget(row, 2, baud_combo_box)
+            self.port_table.setItem(row, 3, QTableWidgetItem(name))
+        self.port_table.resizeColumnsToContents()
         self.exec_()
 
     def set_load_cell(self): 
-        self.comport = self.load_cell_port_combo_box.currentText().split('-')[0].strip()
-        self.baud = int(self.baud_combo_box.currentText())
-        return self.connect_load_cell()
-
-    def connect_load_cell(self): 
-        logger.debug("Trying to connect load_cell.")
+        self.devices = {}
+        for row in range(self.port_table.rowCount()):
+            if self.port_table.item(row, 0).checkState() != Qt.Checked:
+                continue
+            port = self.port_table.item(row, 0).text()
+            name = self.port_table.item(row, 3).text().strip() or "Load {}".format(port)
+            self.devices[name] = {"Port": port, 
+                                  "Baud": int(self.port_table.cellWidget(row, 2).currentText())}
+        # Devices that were unchecked or moved to another port or baud rate
+        for name, ser in list(self.connections.items()):
+            device = self.devices.get(name)
+            if device is None or device["Port"] != ser.port or device["Baud"] != ser.baudrate:
+                self.removed.append((name, self.connections.pop(name)))
+        return self.connect_all()
+
+    def take_removed(self):
+        ''' The connections that are no longer selected, which are forgotten afterwards. '''
+        removed = self.removed
+        self.removed = []
+        return removed
+
+    def connect_all(self):
+        ''' Connect every configured device that is not connected yet. '''
+        for name, device in self.devices.items():
+            if name in self.connections:
+                continue
+            ser = self.connect_load_cell(device["Port"], device["Baud"])
+            if ser is not None:
+                self.connections[name] = ser
+        self.save_settings()
+        return self.connected
+
+    def save_settings(self):
+        if not self.connections:
+            return
+        with open(self.load_cell_settings_file,"w") as out_file:
+            for name in self.connections:
+                out_file.write("{},{},{}\n".format(self.devices[name]["Port"], 
+                                                   self.devices[name]["Baud"], 
+                                                   name))
+
+    def connect_load_cell(self, comport, baud, quiet=False): 
+        '''
+        Open a port and start the load cell streaming. Returns the open 
+        serial port, or None if there is no load cell on it. With quiet set 
+        no message boxes are shown.
+        '''
         try:
-            self.ser.close()
-            del self.ser
-        except AttributeError:
-            pass
-
-        try:
-            self.ser = serial.Serial(self.comport, baudrate=self.baud, timeout=2)
+            ser = open_load_cell(comport, baud)
         except serial.serialutil.SerialException:
             logger.debug(traceback.format_exc())
-            if "PermissionError" in repr(traceback.format_exc()):
-                QMessageBox.information(self,"load_cell Status","The port {} is already in use. Please unplug and replug the load cell unit.".format(self.comport))
-            else:
-                self.connected = False
-                return False
-        try:
-            self.ser.write("CT0\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-            self.ser.readline()
-            time.sleep(.1)
-            self.ser.write("SS1\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-            test_sentence = self.ser.readline().decode('ascii','ignore').strip()
-            logger.info("Connected to {}".format(test_sentence))
-            
-
-            if len(test_sentence) > 0:
-                logger.info("Successful load cell connection on {}".format(self.comport))
-                with open(self.load_cell_settings_file,"w") as out_file:
-                    out_file.write("{},{}\n".format(self.comport, self.baud))
-                self.connected = True
-                #self.ser.write("CPS 32\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-                #self.ser.readline()
-                self.ser.write("CSS 5\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-                self.ser.readline()
-                self.ser.write("CLA 1\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-                self.ser.readline()
-                self.ser.write("O0W0\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
-        
-                return True
-            else:
-                logger.debug("Could not find load cell connection on {}".format(self.comport))
-                QMessageBox.information(self,"No Connection","Could not find load_cell connection on {}".format(self.comport))
-                self.connected = False
-                return False
+            if "PermissionError" in repr(traceback.format_exc()) and not quiet:
+                QMessageBox.information(self,"load_cell Status","The port {} is already in use. Please unplug and replug the load cell unit.".format(comport))
+            return None
         except:
             logger.debug(traceback.format_exc())
-            return False
+            return None
+        if ser is None and not quiet:
+            QMessageBox.information(self,"No Connection","Could not find load_cell connection on {}".format(comport))
+        return ser
+
+    def list_ports(self):
+        ''' The serial ports on this computer, newest first. '''
+        import serial.tools.list_ports
+        try:
+            return sorted(serial.tools.list_ports.comports(), reverse = True)
+        except Exception:
+            logger.debug(traceback.format_exc())
+            return []
+
+    def start_search(self):
+        '''
+        List the ports and reconnect the devices in the settings file on a 
+        worker thread. Opening a port and waiting for a load cell to answer 
+        can take seconds, which would otherwise freeze the window. The search
+        is over when searching is False; then call finish_search.
+        '''
+        self.read_settings()
+        # The worker gets its own copy of the devices to try
+        devices = {name: dict(device) for name, device in self.devices.items() 
+                   if name not in self.connections}
+        self.found = {}
+        self.search_thread = threading.Thread(target=self.search, args=(devices,))
+        self.search_thread.daemon = True
+        self.search_thread.start()
+
+    @property
+    def searching(self):
+        return self.search_thread is not None and self.search_thread.is_alive()
+
+    def search(self, devices):
+        '''
+        The body of the search thread. It must not touch any widgets or the
+        connections, which the GUI thread uses meanwhile, so it only sets
+        ports and found.
+        '''
+        ports = self.list_ports()
+        found = {}
+        for name, device in devices.items():
+            ser = self.connect_load_cell(device["Port"], device["Baud"], quiet=True)
+            if ser is not None:
+                found[name] = ser
+        logger.debug("Found {} ports and connected {} load cells.".format(len(ports), len(found)))
+        self.ports = ports
+        self.found = found
+
+    def finish_search(self):
+        '''
+        Add the load cells the search connected to the connections. A device
+        that was connected or removed meanwhile has its port closed again.
+        '''
+        found = self.found
+        self.found = {}
+        for name, ser in found.items():
+            if name in self.connections or name not in self.devices:
+                ser.close()
+            else:
+                self.connections[name] = ser
 
     def try_loadcell(self):
+        ''' Connect the devices in the settings file right away. '''
+        self.read_settings()
+        return self.connect_all()
+
+    def read_settings(self):
+        ''' Add the devices in the settings file to the configured ones. '''
         try:
             with open(self.load_cell_settings_file, "r") as in_file:
                 lines = in_file.readlines()
-            line_list = lines[0].split(",")
-            self.comport = line_list[0]
-            self.baud = line_list[1]
-            self.connected = self.connect_load_cell()
-
         except FileNotFoundError:
-            self.connected = False
-        return self.connected 
-
-
-def get_plot_bytes(self, fig):
-    """
-    A helper function to produce a bytestream from a matplotlib figure
-    """
-    img = BytesIO()
-    fig.figsize=(7.5, 8.5) #inches
-    fig.savefig(img, format='PDF',)
-    return img
- 
-class GraphDialog(QDialog):
-    def __init__(self, parent, title="Graph"):
-        super(GraphDialog, self).__init__(parent)
-        self.setWindowTitle(title)
-        self.figure = mpl.Figure()
-        self.canvas = FigureCanvas(self.figure)
-        self.toolbar = NavigationToolbar(self.canvas, self)
-        self.data = {}
-        self.root = parent
-        self.ax = self.figure.add_subplot(111)
-        self.ymin = None
-        self.ymax = None
-        self.x_label = ""
-        self.y_label = ""
-        self.title = ""
-
-        self.update_button = QCheckBox("Dynamically Update Table")
-        self.update_button.setChecked(True)
-
-        self.clear_button = QPushButton("Clear Data")
-        self.clear_button.clicked.connect(self.clear_data)
-        
-        self.export_button = QPushButton("Export Data")
-        self.export_button.clicked.connect(self.export_data)
-
-        # set the layout
-        layout = QVBoxLayout()
-        layout.addWidget(self.canvas)
-        layout.addWidget(self.update_button)
-        layout.addWidget(self.clear_button)
-        layout.addWidget(self.export_button)
-        layout.addWidget(self.toolbar)
-        self.setLayout(layout)
-        #self.show()
-    
-    def clear_data(self):
-        self.data = {}
-        self.root.load_history=[]
-        self.plot()
-        logger.debug("Cleared Graph")
-
-    def export_data(self):
-        csv_string = ''
-        for key, value in self.data.items():
-            csv_string += "Time,{}\n".format(key)
-            for x,y in zip(value["X"],value["Y"]):
-                csv_string += "{},{}\n".format(x,y)
-            csv_string += "\n\n"
-        
-        filters = "{} Data Files (*.csv);;All Files (*.*)".format(self.root.title)
-        selected_filter = "{} Data Files (*.csv)".format(self.root.title)
-        fname = QFileDialog.getSaveFileName(self, 
-                                            'Save File As',
-                                            '',
-                                            filters,
-                                            selected_filter)
-        if fname[0]:
-            if fname[0][-4:] ==".csv":
-                self.filename = fname[0]
+            return
+        for line in lines:
+            line_list = [item.strip() for item in line.split(",")]
+            if len(line_list) < 2 or not line_list[0]:
+                continue
+            if len(line_list) > 2 and line_list[2]:
+                name = line_list[2]
             else:
-                self.filename = fname[0]+".csv"
-            self.export_path, self.filename = os.path.split(fname[0])
-            with open(fname[0],'w') as f:
-                f.write(csv_string)
-
-    def plot(self):
-        ''' plot data '''
-        self.ax.cla()
-        #self.ax.hold(False)
-        for key, value in self.data.items():
-            self.ax.plot(value["X"],value["Y"],value["Marker"],label=key)
-        self.ax.grid(True)
-        self.ax.legend()
-        [xmin, xmax, ymin, ymax] = self.ax.axis()
-        try:
-            self.ax.axis([xmin, xmax, self.ymin, self.ymax])
-        except:
-            pass
-        xfmt = md.DateFormatter('%Y-%m-%d %H:%M:%S')
-        self.ax.xaxis.set_major_formatter(xfmt)
-        self.figure.autofmt_xdate()
-        self.ax.set_xlabel(self.x_label)
-        self.ax.set_ylabel(self.y_label)
-        self.ax.set_title(self.title)
-        if self.update_button.isChecked():
-            self.canvas.draw()
-    
-    def plot_xy(self):
-        self.ax.cla()
-        #self.ax.hold(False)
-        for key, value in self.data.items():
-            self.ax.plot(value["X"], value["Y"], value["Marker"],label=key)
-        self.ax.grid(True)
-        self.ax.legend()
-        [xmin, xmax, ymin, ymax] = self.ax.axis()
-        try:
-            self.ax.axis([xmin, xmax, self.ymin, self.ymax])
-        except:
-            pass
-        self.ax.set_xlabel(self.x_label)
-        self.ax.set_ylabel(self.y_label)
-        self.ax.set_title(self.title)
-        if self.update_button.isChecked():
-            self.canvas.draw()
-    
-    def add_data(self, data, marker='*-', label=""):
-        x, y = zip(*data) #unpacks a list of tuples
-        dates = [dt.datetime.fromtimestamp(ts) for ts in x]
-        self.data[label] = {"X": dates, "Y": y, "Marker": marker}
-    
-    def add_xy_data(self, data, marker='*-', label=""):
-        x, y = zip(*data) #unpacks a list of tuples
-        # logger.debug("X data:")
-        # logger.debug(x)
-        # logger.debug("Y data:")
-        # logger.debug(y)
-
-        self.data[label] = {"X": [float(val) for val in x], 
-                            "Y": [float(val) for val in y], 
-                            "Marker": marker}
-        
+                name = "Load {}".format(line_list[0])
+            self.devices[name] = {"Port": line_list[0], "Baud": int(line_list[1])}
 
-    def set_yrange(self,min_y, max_y):
-        self.ymax = max_y
-        self.ymin = min_y
-            
-    
-    def set_xlabel(self,label):
-        self.x_label = label
-    
-    def set_ylabel(self,label):
-        self.y_label = label
-    
-    def set_title(self,label):
-        self.title = label
-    
-class GraphTab(QWidget):
-    def __init__(self, parent=None, tabs=None, tab_name="Graph Tab"):
-        super(GraphTab, self).__init__(parent)
-        logger.debug("Setting up Graph Tab.")
-        self.root = parent
-        self.tabs = tabs
-        self.tab_name = tab_name
-        self.data_list=[]
-        self.init_ui()
-    
-    def init_ui(self):
-        self.graph_tab = QWidget()
-        self.tabs.addTab(self.graph_tab, self.tab_name)
-        logger.debug("Making Attribution Box")
-        attribution_box = QGroupBox("Event Attribution Data")
-        tab_layout = QGridLayout()
-        self.graph_tab.setLayout(tab_layout)
-
-        self.event_name_label = QLabel("Name of Event: ")
-        self.ecm_rtc_label = QLabel("ECM Real Time Clock at Event: ")
-        self.actual_rtc_label = QLabel("Actual Real Time Clock at Event: ")
-        self.engine_hours_label = QLabel("Engine Hours at Event: ")
-        self.odometer_label = QLabel("Distance Reading at Event: ")
-
-        attribution_layout = QVBoxLayout()
-        attribution_layout.addWidget(self.event_name_label)
-        attribution_layout.addWidget(self.ecm_rtc_label)
-        attribution_layout.addWidget(self.actual_rtc_label)
-        attribution_layout.addWidget(self.engine_hours_label)
-        attribution_layout.addWidget(self.odometer_label)
-        attribution_box.setLayout(attribution_layout)
-        logger.debug("Finished Setting Attribution Layout")
-        
-        self.data_table = QTableWidget()
-        self.data_table.setSelectionBehavior(QAbstractItemView.SelectColumns)
-        logger.debug("Finished with Data Table")
-        
-        self.csv_button = QPushButton("Export CSV")
-        self.csv_button.clicked.connect(self.export_csv)
-        logger.debug("Finished with CSV")
-
-        self.figure = mpl.Figure(figsize=(7,9))
-        self.canvas = FigureCanvas(self.figure)
-        self.top_axis = self.figure.add_subplot(3,1,1)
-        self.top_axis.set_ylabel("Road Speed (mph)")
-        self.middle_axis = self.figure.add_subplot(3,1,2)
-        self.middle_axis.set_ylabel("Throttle Position (%)")
-        self.bottom_axis = self.figure.add_subplot(3,1,3)
-        self.bottom_axis.set_ylabel("Brake Switch Status")
-        self.bottom_axis.set_xlabel("Event Time (sec)")
-        self.canvas.draw()
-
-        self.toolbar = NavigationToolbar(self.canvas, self.graph_tab)
-        logger.debug("Finished with toolbar")
-
-        # set the layout
-        
-        tab_layout.addWidget(attribution_box,0,0,1,1)
-        tab_layout.addWidget(self.data_table,1,0,1,1)
-        tab_layout.addWidget(self.csv_button,2,0,1,1)
-        tab_layout.addWidget(self.canvas,0,1,2,1)
-        tab_layout.addWidget(self.toolbar,2,1,1,1) 
-        
-        logger.debug("Finished with UI for Tab {}".format(self.tab_name))
-
-    def export_csv(self):
-        logger.debug("Export CSV")
-        filters = "Comma Separated Values (*.csv);;All Files (*.*)"
-        selected_filter = "Comma Separated Values (*.csv)"
-        fname = QFileDialog.getSaveFileName(self, 
-                                            'Export CSV',
-                                            self.tab_name + ".csv",
-                                            filters,
-                                            selected_filter)
+
+class TriggerDialog(QDialog):
+    '''
+    Sets up the trigger that captures events. The settings are a dictionary
+    with the Kind, Direction, Level, Hysteresis and Window of the trigger and
+    the Pre and Post trigger times in seconds.
+    '''
+    def __init__(self, settings=None):
+        super(TriggerDialog,self).__init__()
+        from LoadStarTrigger import TRIGGER_KINDS, TRIGGER_DIRECTIONS
+        self.setWindowTitle("Set Up Event Trigger")
+        self.setWindowModality(Qt.ApplicationModal)
+        if settings is None:
+            settings = {"Kind": "threshold", "Direction": "rising", "Level": 100.0, 
+                        "Hysteresis": 5.0, "Window": 0.1, "Pre": 0.5, "Post": 2.0}
+
+        self.kind_combo_box = QComboBox()
+        self.kind_combo_box.addItems(["Load Threshold (lb)", "Slope (lb/s)", "Change over Window (lb)"])
+        self.kind_combo_box.setCurrentIndex(TRIGGER_KINDS.index(settings["Kind"]))
+        self.direction_combo_box = QComboBox()
+        self.direction_combo_box.addItems(["Rising", "Falling"])
+        self.direction_combo_box.setCurrentIndex(TRIGGER_DIRECTIONS.index(settings["Direction"]))
+        self.level_box = self.spin_box(settings["Level"], -1e9, 1e9)
+        self.hysteresis_box = self.spin_box(settings["Hysteresis"], 0, 1e9)
+        self.window_box = self.spin_box(settings["Window"], 0.001, 3600)
+        self.pre_box = self.spin_box(settings["Pre"], 0, 3600)
+        self.post_box = self.spin_box(settings["Post"], 0.001, 3600)
+
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            Qt.Horizontal, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        form_layout = QFormLayout()
+        form_layout.addRow("Trigger on", self.kind_combo_box)
+        form_layout.addRow("Direction", self.direction_combo_box)
+        form_layout.addRow("Level", self.level_box)
+        form_layout.addRow("Hysteresis", self.hysteresis_box)
+        form_layout.addRow("Window (s)", self.window_box)
+        form_layout.addRow("Before Trigger (s)", self.pre_box)
+        form_layout.addRow("After Trigger (s)", self.post_box)
+        form_layout.addRow(self.buttons)
+        self.setLayout(form_layout)
+
+    def spin_box(self, value, minimum, maximum):
+        box = QDoubleSpinBox()
+        box.setDecimals(3)
+        box.setRange(minimum, maximum)
+        box.setValue(value)
+        return box
+
+    def settings(self):
+        from LoadStarTrigger import TRIGGER_KINDS, TRIGGER_DIRECTIONS
+        return {"Kind": TRIGGER_KINDS[self.kind_combo_box.currentIndex()],
+                "Direction": TRIGGER_DIRECTIONS[self.direction_combo_box.currentIndex()],
+                "Level": self.level_box.value(),
+                "Hysteresis": self.hysteresis_box.value(),
+                "Window": self.window_box.value(),
+                "Pre": self.pre_box.value(),
+                "Post": self.post_box.value()}
+
+
+class FilterDialog(QDialog):
+    '''
+    Sets up the filters applied to the loads. The settings are a dictionary
+    with the Median and Average lengths and the Exponential time constant
+    in samples, and the Low-pass cutoff as a fraction of the sample rate.
+    A filter set to 0 is not used.
+    '''
+    def __init__(self, settings=None):
+        super(FilterDialog,self).__init__()
+        self.setWindowTitle("Set Up Load Filter")
+        self.setWindowModality(Qt.ApplicationModal)
+        if settings is None:
+            settings = {"Median": 0, "Average": 10, "Exponential": 0, "Low-pass": 0.0}
+
+        self.median_box = self.spin_box(settings["Median"], 0, 1001, 0)
+        self.average_box = self.spin_box(settings["Average"], 0, 100000, 0)
+        self.exponential_box = self.spin_box(settings["Exponential"], 0, 1e6, 1)
+        self.lowpass_box = self.spin_box(settings["Low-pass"], 0, 0.499, 4)
+
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            Qt.Horizontal, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        form_layout = QFormLayout()
+        form_layout.addRow(QLabel("The filters are applied in this order. Set a filter to 0 to leave it out."))
+        form_layout.addRow("Running Median (samples)", self.median_box)
+        form_layout.addRow("Moving Average (samples)", self.average_box)
+        form_layout.addRow("Exponential Time Constant (samples)", self.exponential_box)
+        form_layout.addRow("Low-pass Cutoff (fraction of sample rate)", self.lowpass_box)
+        form_layout.addRow(self.buttons)
+        self.setLayout(form_layout)
+
+    def spin_box(self, value, minimum, maximum, decimals):
+        box = QDoubleSpinBox()
+        box.setDecimals(decimals)
+        box.setRange(minimum, maximum)
+        box.setValue(value)
+        return box
+
+    def settings(self):
+        return {"Median": int(self.median_box.value()),
+                "Average": int(self.average_box.value()),
+                "Exponential": self.exponential_box.value(),
+                "Low-pass": self.lowpass_box.value()}
+
+
+
+class PublishDialog(QDialog):
+    '''
+    Sets up serving the live samples to other programs. The settings are a
+    dictionary with the Protocol (tcp or udp), the Address to listen on, the
+    Port and the Mode (latency or throughput).
+    '''
+    def __init__(self, settings=None):
+        super(PublishDialog,self).__init__()
+        from LoadStarPublish import PUBLISH_PORT, PUBLISH_PROTOCOLS, PUBLISH_MODES
+        self.setWindowTitle("Publish Samples")
+        self.setWindowModality(Qt.ApplicationModal)
+        if settings is None:
+            settings = {"Protocol": "tcp", "Address": "127.0.0.1", "Port": PUBLISH_PORT, 
+                        "Mode": "latency"}
+
+        self.protocol_combo_box = QComboBox()
+        self.protocol_combo_box.addItems(["TCP", "UDP"])
+        self.protocol_combo_box.setCurrentIndex(PUBLISH_PROTOCOLS.index(settings["Protocol"]))
+        self.address_edit = QLineEdit(settings["Address"])
+        self.address_edit.setToolTip("127.0.0.1 for this computer only, 0.0.0.0 for the network.")
+        self.port_box = QSpinBox()
+        self.port_box.setRange(1, 65535)
+        self.port_box.setValue(settings["Port"])
+        self.mode_combo_box = QComboBox()
+        self.mode_combo_box.addItems(["Low Latency (small frames)", "High Throughput (batched frames)"])
+        self.mode_combo_box.setCurrentIndex(PUBLISH_MODES.index(settings["Mode"]))
+
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            Qt.Horizontal, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        form_layout = QFormLayout()
+        form_layout.addRow("Protocol", self.protocol_combo_box)
+        form_layout.addRow("Listen on Address", self.address_edit)
+        form_layout.addRow("Port", self.port_box)
+        form_layout.addRow("Mode", self.mode_combo_box)
+        form_layout.addRow(self.buttons)
+        self.setLayout(form_layout)
+
+    def settings(self):
+        from LoadStarPublish import PUBLISH_PROTOCOLS, PUBLISH_MODES
+        return {"Protocol": PUBLISH_PROTOCOLS[self.protocol_combo_box.currentIndex()],
+                "Address": self.address_edit.text().strip() or "127.0.0.1",
+                "Port": self.port_box.value(),
+                "Mode": PUBLISH_MODES[self.mode_combo_box.currentIndex()]}
+
+
+class ReplayDialog(QDialog):
+    '''
+    Sets up a replay of a recorded file. The settings are a dictionary with
+    the File (a session or an exported CSV file), the Mode of REPLAY_MODES,
+    the Speed as a factor of the original timing for the "factor" mode and
+    whether to Loop back to the start at the end.
+    '''
+    def __init__(self, settings=None, directory=""):
+        super(ReplayDialog,self).__init__()
+        from LoadStarReplay import REPLAY_MODES
+        self.setWindowTitle("Replay a Recording")
+        self.setWindowModality(Qt.ApplicationModal)
+        self.directory = directory
+        if settings is None:
+            settings = {"File": "", "Mode": "original", "Speed": 10.0, "Loop": False}
+
+        self.file_edit = QLineEdit(settings["File"])
+        self.file_edit.setMinimumWidth(300)
+        browse_button = QPushButton("Browse...")
+        browse_button.clicked.connect(self.browse)
+        file_layout = QHBoxLayout()
+        file_layout.addWidget(self.file_edit)
+        file_layout.addWidget(browse_button)
+        self.speed_combo_box = QComboBox()
+        self.speed_combo_box.addItems(["Original Timing", "Faster or Slower", "As Fast As Possible"])
+        self.speed_box = QDoubleSpinBox()
+        self.speed_box.setDecimals(2)
+        self.speed_box.setRange(0.01, 10000)
+        self.speed_box.setSuffix(" x")
+        self.speed_combo_box.setCurrentIndex(REPLAY_MODES.index(settings["Mode"]))
+        self.speed_box.setValue(settings["Speed"])
+        self.speed_combo_box.currentIndexChanged.connect(self.speed_changed)
+        self.speed_changed(self.speed_combo_box.currentIndex())
+        self.loop_check_box = QCheckBox("Start over at the end")
+        self.loop_check_box.setChecked(settings["Loop"])
+
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            Qt.Horizontal, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        form_layout = QFormLayout()
+        form_layout.addRow("File", file_layout)
+        form_layout.addRow("Speed", self.speed_combo_box)
+        form_layout.addRow("Speed Factor", self.speed_box)
+        form_layout.addRow(self.loop_check_box)
+        form_layout.addRow(self.buttons)
+        self.setLayout(form_layout)
+
+    def browse(self):
+        filters = "Session Files (*{});;Data Files (*.csv);;All Files (*.*)".format(SESSION_EXTENSION)
+        fname = QFileDialog.getOpenFileName(self, 'Replay File', 
+                                            self.file_edit.text() or self.directory, filters)
         if fname[0]:
-            if fname[0][-4:] ==".csv":
-                filename = fname[0]
-            else:
-                filename = fname[0]+".csv"
-            try:
-                with open(filename,'w', newline='') as csv_file:
-                    writer = csv.writer(csv_file)
-                    writer.writerow(["The University of Tulsa"])
-
-                    writer.writerow(["Date of Creation:", "{}".format(get_local_time_string(time.time()))])
-                    
-                    
-                    writer.writerows(['',["Vehicle Component Information"]])
-                    writer.writerows(get_list_from_dict(self.root.data_package["Component Information"]))
-
-                    writer.writerows(['',["Vehicle Distance Information"]])
-                    writer.writerows(get_list_from_dict(self.root.data_package["Distance Information"]))
-
-                    writer.writerows(['',["Vehicle Time Information"]])
-                    writer.writerows(get_list_from_dict(self.root.data_package["ECU Time Information"]))
-
-
-                    writer.writerows(['',["Event Attribution Data"]])
-                    writer.writerow([''] + self.event_name_label.text().split(": "))
-                    writer.writerow([''] + self.ecm_rtc_label.text().split(": "))
-                    writer.writerow([''] + self.actual_rtc_label.text().split(": "))
-                    writer.writerow([''] + self.engine_hours_label.text().split(": "))
-                    writer.writerow([''] + self.odometer_label.text().split(": "))
-                    writer.writerows(['',["Event Table Data"]])
-                    writer.writerows(self.data_list)
-
-                    writer.writerows(['',["User Data"]])
-                    writer.writerows(self.root.user_data.get_user_data_list())
-                self.root.sign_file(filename)
-                base_name = os.path.basename(filename)
-                QMessageBox.information(self,"Export Success","The comma separated values file\n{}\nwas successfully exported. A verification signature was also saved as\n{}.".format(base_name,base_name+".signature"))
-            
-            except PermissionError:
-                logger.info("Permission Error - Please close the file and try again.")
-                QMessageBox.warning(self,"Permission Error","Permission Error\nThe file may be open in another application.\nPlease close the file and try again.")
-            
-    
+            self.file_edit.setText(fname[0])
+
+    def speed_changed(self, index):
+        self.speed_box.setEnabled(index == 1)
+
+    def accept(self):
+        if not os.path.isfile(self.file_edit.text()):
+            QMessageBox.warning(self, "Replay a Recording", "Choose a file to replay.")
+            return
+        super(ReplayDialog,self).accept()
+
+    def settings(self):
+        from LoadStarReplay import REPLAY_MODES
+        return {"File": self.file_edit.text(),
+                "Mode": REPLAY_MODES[self.speed_combo_box.currentIndex()],
+                "Speed": self.speed_box.value(),
+                "Loop": self.loop_check_box.isChecked()}
 
-    def update_plot_xy(self):
-        for key, value in self.data.items():
-            self.ax.plot(value["X"], value["Y"], value["Marker"],label=key)
-        self.ax.grid(True)
-        self.ax.legend()
-        [xmin, xmax, ymin, ymax] = self.ax.axis()
-        try:
-            self.ax.axis([xmin, xmax, self.ymin, self.ymax])
-        except:
-            pass
-        self.ax.set_xlabel(self.x_label)
-        self.ax.set_ylabel(self.y_label)
-        self.ax.set_title(self.title)
-        if self.update_button.isChecked():
-            self.canvas.draw()
 
 if __name__ == '__main__':
+    start_logging()
     app = QApplication(sys.argv)
     execute = LoadStarLogger()
     sys.exit(app.exec_())
\ No newline at end of file
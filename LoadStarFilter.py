@@ -0,0 +1,243 @@
+"""
+Filters that smooth the load before it is stored and plotted: a running
+median (for spikes), a moving average, an exponential filter and a biquad
+low-pass. They work on the blocks of samples the reader gets from the port,
+with numpy, and keep their state from one block to the next, so the result
+is the same (up to rounding) as filtering the samples one at a time, no
+matter how the samples were split into blocks.
+
+Lengths are in samples and the low-pass cutoff is a fraction of the sample
+rate, since that is what the filters see. Every filter starts settled at the
+first sample, so there is no start-up transient from zero.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+from numpy.lib.stride_tricks import as_strided
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def sliding_windows(values, length):
+    ''' A read-only (len(values) - length + 1, length) view of all windows. '''
+    count = len(values) - length + 1
+    stride = values.strides[0]
+    return as_strided(values, (count, length), (stride, stride), writeable=False)
+
+
+class WindowFilter(object):
+    '''
+    Base of the filters that look at the last length samples. The last
+    length - 1 samples of the previous block are kept to complete the
+    windows at the start of the next one.
+    '''
+    def __init__(self, length):
+        if length < 1:
+            raise ValueError("The filter length must be at least one sample.")
+        self.length = int(length)
+        self.reset()
+
+    def reset(self):
+        self.history = None
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return values.copy()
+        if self.history is None:
+            self.history = np.full(self.length - 1, values[0])
+        padded = np.concatenate((self.history, values))
+        self.history = padded[len(padded) - self.length + 1:]
+        return self.apply(padded)
+
+
+class MovingAverage(WindowFilter):
+    ''' The mean of the last length samples. '''
+    def apply(self, padded):
+        sums = np.empty(len(padded) + 1)
+        sums[0] = 0.0
+        # The running sum starts over with every block, so rounding errors
+        # do not build up over a long recording.
+        np.cumsum(padded, out=sums[1:])
+        return (sums[self.length:] - sums[:-self.length]) / self.length
+
+    def describe(self):
+        return "average of {} samples".format(self.length)
+
+
+class RunningMedian(WindowFilter):
+    ''' The median of the last length samples, which removes short spikes. '''
+    # Samples in the windows sorted at once (32 MB), to bound the memory of np.median
+    SLICE = 2 ** 22
+
+    def apply(self, padded):
+        windows = sliding_windows(padded, self.length)
+        output = np.empty(len(windows))
+        rows = max(1, self.SLICE // self.length)
+        for start in range(0, len(windows), rows):
+            output[start:start + rows] = np.median(windows[start:start + rows], axis=1)
+        return output
+
+    def describe(self):
+        return "median of {} samples".format(self.length)
+
+
+class LinearFilter(object):
+    '''
+    A recursive (IIR) filter given in state space form:
+        y[n]   = C s[n] + D x[n]
+        s[n+1] = A s[n] + B x[n]
+
+    Running the recursion one sample at a time in Python would be far too
+    slow for the fastest devices, so the samples are processed in blocks of
+    block samples. Within a block the outputs are a matrix product of the
+    inputs with the impulse response, plus the response to the state at the
+    start of the block, and only the state is carried from block to block.
+    '''
+    def __init__(self, A, B, C, D, block=128):
+        self.A = np.atleast_2d(np.asarray(A, dtype=np.float64))
+        self.B = np.asarray(B, dtype=np.float64).ravel()
+        self.C = np.asarray(C, dtype=np.float64).ravel()
+        self.D = float(D)
+        self.block = block
+        order = len(self.B)
+        powers = [np.eye(order)]
+        for k in range(block):
+            powers.append(powers[-1].dot(self.A))
+        # Response of the outputs of a block to the state at its start
+        self.observe = np.array([self.C.dot(power) for power in powers[:block]])
+        # Response of the outputs to the inputs (lower triangular Toeplitz)
+        markov = np.r_[self.D, [self.C.dot(power).dot(self.B) for power in powers[:block - 1]]]
+        rows, columns = np.indices((block, block))
+        self.response = np.where(rows >= columns, markov[np.clip(rows - columns, 0, None)], 0.0)
+        # Contribution of each input of a block to the state after it
+        self.control = np.array([power.dot(self.B) for power in powers[block - 1::-1]]).T
+        self.powers = powers
+        self.reset()
+
+    def reset(self):
+        self.state = None
+
+    def settle(self, value):
+        ''' The state the filter has after a long time at a constant input. '''
+        order = len(self.B)
+        return np.linalg.solve(np.eye(order) - self.A, self.B * value)
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        count = len(values)
+        if count == 0:
+            return values.copy()
+        if self.state is None:
+            self.state = self.settle(values[0])
+        block = self.block
+        full = count // block
+        output = np.empty(count)
+        state = self.state
+        if full:
+            blocks = values[:full * block].reshape(full, block)
+            forced = blocks.dot(self.response.T)
+            driven = blocks.dot(self.control.T)
+            step = self.powers[block]
+            starts = np.empty((full, len(state)))
+            for k in range(full):
+                starts[k] = state
+                state = step.dot(state) + driven[k]
+            output[:full * block] = (forced + starts.dot(self.observe.T)).ravel()
+        rest = count - full * block
+        if rest:
+            tail = values[full * block:]
+            output[full * block:] = self.response[:rest, :rest].dot(tail) + self.observe[:rest].dot(state)
+            state = self.powers[rest].dot(state) + self.control[:, block - rest:].dot(tail)
+        self.state = state
+        return output
+
+
+class ExponentialFilter(LinearFilter):
+    '''
+    First order low-pass: y[n] = y[n-1] + (x[n] - y[n-1]) / time_constant,
+    with the time constant in samples.
+    '''
+    def __init__(self, time_constant, block=128):
+        if time_constant < 1:
+            raise ValueError("The time constant must be at least one sample.")
+        self.time_constant = time_constant
+        alpha = 1.0 / time_constant
+        super(ExponentialFilter, self).__init__([[1 - alpha]], [alpha], [1 - alpha], alpha, block)
+
+    def describe(self):
+        return "exponential over {:g} samples".format(self.time_constant)
+
+
+class BiquadLowPass(LinearFilter):
+    '''
+    Second order low-pass (from the Audio EQ Cookbook by R. Bristow-Johnson)
+    with the cutoff given as a fraction of the sample rate, below 0.5. The
+    default Q gives a Butterworth response.
+    '''
+    def __init__(self, cutoff, q=0.7071067811865476, block=128):
+        if not 0 < cutoff < 0.5:
+            raise ValueError("The cutoff must be between 0 and half the sample rate.")
+        self.cutoff = cutoff
+        self.q = q
+        w0 = 2 * np.pi * cutoff
+        alpha = np.sin(w0) / (2 * q)
+        cos_w0 = np.cos(w0)
+        a0 = 1 + alpha
+        b0 = (1 - cos_w0) / 2 / a0
+        b1 = (1 - cos_w0) / a0
+        b2 = b0
+        a1 = -2 * cos_w0 / a0
+        a2 = (1 - alpha) / a0
+        # Transposed direct form II as a state space system
+        super(BiquadLowPass, self).__init__([[-a1, 1], [-a2, 0]],
+                                            [b1 - a1 * b0, b2 - a2 * b0],
+                                            [1, 0], b0, block)
+
+    def describe(self):
+        return "low-pass at {:g} of the sample rate".format(self.cutoff)
+
+
+class FilterChain(object):
+    ''' Filters applied one after the other. '''
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        A chain from a dictionary with a Median length, an Average length,
+        an Exponential time constant (in samples) and a Low-pass cutoff (as
+        a fraction of the sample rate). Filters set to 0 are left out.
+        Returns None if all are.
+        '''
+        filters = []
+        if settings.get("Median", 0) > 1:
+            filters.append(RunningMedian(settings["Median"]))
+        if settings.get("Average", 0) > 1:
+            filters.append(MovingAverage(settings["Average"]))
+        if settings.get("Exponential", 0) >= 1:
+            filters.append(ExponentialFilter(settings["Exponential"]))
+        if settings.get("Low-pass", 0) > 0:
+            filters.append(BiquadLowPass(settings["Low-pass"]))
+        if not filters:
+            return None
+        return cls(filters)
+
+    def reset(self):
+        for stage in self.filters:
+            stage.reset()
+
+    def process(self, values):
+        for stage in self.filters:
+            values = stage.process(values)
+        return values
+
+    def describe(self):
+        return ", then ".join(stage.describe() for stage in self.filters)
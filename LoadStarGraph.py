@@ -0,0 +1,613 @@
+"""
+The plotting windows of the LoadStar Logger. matplotlib and its Qt backend
+take most of the time needed to start the program, so the main window only
+imports this module once it is on screen.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+from PyQt5.QtWidgets import (QWidget,
+                             QMessageBox,
+                             QFileDialog,
+                             QLabel,
+                             QCheckBox,
+                             QVBoxLayout,
+                             QPushButton,
+                             QTableWidget,
+                             QTableWidgetItem,
+                             QAbstractItemView,
+                             QGridLayout,
+                             QGroupBox,
+                             QComboBox,
+                             QDialog,
+                             QProgressDialog)
+from PyQt5.QtCore import QTimer
+import time
+import os
+
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+#import matplotlib.pyplot as plt
+import matplotlib.figure as mpl
+import matplotlib.dates as md
+import datetime as dt
+from dateutil import tz
+import numpy as np
+import csv
+
+from LoadStarData import Decimator, SampleBuffer
+from LoadStarSession import CSVExporter, CSV_TIME_FORMATS
+
+import logging
+logger = logging.getLogger(__name__)
+
+from matplotlib import rcParams
+rcParams.update({'figure.autolayout': True}) #Depends on matplotlib from graphing
+# matplotlib date number of the Unix epoch. Date numbers are days, so a Unix
+# timestamp converts with a single multiply and add.
+EPOCH_DATENUM = md.date2num(dt.datetime(1970, 1, 1))
+# Rows shown in the table of an event tab
+EVENT_TABLE_ROWS = 10000
+markers = [ "D", "o", "v", "*", "^", "<", ">", "1", "2", "3", "4", "8", "s", "p", "P", "h", "H", "+", "x", "X", "d", "|"]
+
+class GraphDialog(QDialog):
+    def __init__(self, parent, title="Graph"):
+        super(GraphDialog, self).__init__(parent)
+        self.setWindowTitle(title)
+        self.figure = mpl.Figure()
+        self.canvas = FigureCanvas(self.figure)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        self.data = {}
+        self.lines = {}
+        self.root = parent
+        self.ax = self.figure.add_subplot(111)
+        self.ymin = None
+        self.ymax = None
+        self.x_label = ""
+        self.y_label = ""
+        self.title = ""
+
+        # Live plotting keeps the Line2D artists between ticks and blits them
+        # over a cached copy of the static background (grid, labels, ticks).
+        self.background = None
+        self.live_limits = None
+        self.last_draw = None
+        self.headroom = 0.25 #fraction of the data span kept free to the right
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+        self.update_button = QCheckBox("Dynamically Update Table")
+        self.update_button.setChecked(True)
+
+        self.follow_button = QCheckBox("Follow Live Data")
+        self.follow_button.setChecked(True)
+        self.follow_button.stateChanged.connect(self.follow_changed)
+
+        self.decimation_combo_box = QComboBox()
+        self.decimation_combo_box.addItems(["Min/Max per Pixel", "LTTB", "All Samples"])
+        self.decimation_combo_box.currentIndexChanged.connect(self.decimation_changed)
+
+        self.series_combo_box = QComboBox()
+        self.series_combo_box.addItems(["Show Raw and Filtered Loads", 
+                                        "Show Raw Loads", 
+                                        "Show Filtered Loads"])
+        self.series_combo_box.currentIndexChanged.connect(self.series_changed)
+
+        self.clear_button = QPushButton("Clear Data")
+        self.clear_button.clicked.connect(self.clear_data)
+        
+        self.export_button = QPushButton("Export Data")
+        self.export_button.clicked.connect(self.export_data)
+
+        self.time_format_combo_box = QComboBox()
+        self.time_format_combo_box.addItems(["Export Local Date and Time", 
+                                             "Export Unix Time (s)", 
+                                             "Export Elapsed Time (s)"])
+        self.exporter = None
+        self.export_progress = None
+        self.export_timer = QTimer(self)
+        self.export_timer.timeout.connect(self.check_export)
+
+        # set the layout
+        layout = QVBoxLayout()
+        layout.addWidget(self.canvas)
+        layout.addWidget(self.update_button)
+        layout.addWidget(self.follow_button)
+        layout.addWidget(self.decimation_combo_box)
+        layout.addWidget(self.series_combo_box)
+        layout.addWidget(self.clear_button)
+        layout.addWidget(self.export_button)
+        layout.addWidget(self.time_format_combo_box)
+        layout.addWidget(self.toolbar)
+        self.setLayout(layout)
+        self.init_axes()
+        #self.show()
+    
+    def clear_data(self):
+        self.data = {}
+        # New stores rather than clearing the old ones, which a running
+        # export may still be reading
+        for histories in (self.root.load_histories, self.root.filtered_histories):
+            for name in list(histories):
+                histories[name] = SampleBuffer()
+        for stats in self.root.load_stats.values():
+            stats.reset()
+        self.init_axes()
+        self.follow_button.setChecked(True)
+        self.canvas.draw()
+        logger.debug("Cleared Graph")
+
+    def export_data(self):
+        '''
+        Write all series to a CSV file. The rows are formatted and written in
+        chunks on a worker thread while a progress dialog is shown, so the 
+        window stays responsive and the export can be cancelled.
+        '''
+        if self.exporter is not None and self.exporter.is_alive():
+            QMessageBox.information(self, "Export Data", "An export is already running.")
+            return
+        filters = "{} Data Files (*.csv);;All Files (*.*)".format(self.root.title)
+        selected_filter = "{} Data Files (*.csv)".format(self.root.title)
+        fname = QFileDialog.getSaveFileName(self, 
+                                            'Save File As',
+                                            '',
+                                            filters,
+                                            selected_filter)
+        if not fname[0]:
+            return
+        if fname[0][-4:] ==".csv":
+            filename = fname[0]
+        else:
+            filename = fname[0]+".csv"
+        self.export_path, self.filename = os.path.split(filename)
+
+        series = []
+        for key, value in self.data.items():
+            if not self.is_shown(value):
+                continue
+            if "Samples" in value or "Session" in value:
+                samples = value.get("Samples", value.get("Session"))
+                series.append((key, samples.times, samples.values))
+            else:
+                series.append((key, np.asarray(value["X"], dtype=np.float64), 
+                               np.asarray(value["Y"], dtype=np.float64)))
+        time_format = CSV_TIME_FORMATS[self.time_format_combo_box.currentIndex()]
+        self.exporter = CSVExporter(filename, series, time_format)
+
+        self.export_progress = QProgressDialog("Exporting data to {}".format(self.filename),
+                                               "Cancel", 0, 1000, self)
+        self.export_progress.setWindowTitle("Export Data")
+        self.export_progress.setAutoClose(False)
+        self.export_progress.setAutoReset(False)
+        self.export_progress.canceled.connect(self.exporter.cancel)
+        self.export_progress.show()
+        self.exporter.start()
+        self.export_timer.start(100)
+
+    def check_export(self):
+        ''' Update the export progress from the GUI thread. '''
+        exporter = self.exporter
+        if exporter.total:
+            self.export_progress.setValue(int(1000 * exporter.written / exporter.total))
+        if exporter.is_alive():
+            return
+        self.export_timer.stop()
+        self.export_progress.close()
+        if exporter.error is not None:
+            QMessageBox.warning(self, "Export Error", 
+                "Failed to export data to {}\n{}".format(exporter.path, exporter.error))
+        elif not exporter.cancelled:
+            logger.info("Finished exporting to {}".format(exporter.path))
+
+    def init_axes(self):
+        ''' 
+        Set up the static parts of the live axes once. Everything here used to
+        be rebuilt on every tick by plot().
+        '''
+        self.ax.cla()
+        self.lines = {}
+        self.background = None
+        self.live_limits = None
+        self.ax.grid(True)
+        # The x data are UTC date numbers, so the axis does the conversion 
+        # to local time when it formats the tick labels.
+        local_tz = tz.tzlocal()
+        self.ax.xaxis_date(tz=local_tz)
+        self.ax.xaxis.set_major_locator(md.AutoDateLocator(tz=local_tz))
+        xfmt = md.DateFormatter('%Y-%m-%d %H:%M:%S', tz=local_tz)
+        self.ax.xaxis.set_major_formatter(xfmt)
+        self.figure.autofmt_xdate()
+        self.ax.set_xlabel(self.x_label)
+        self.ax.set_ylabel(self.y_label)
+        self.ax.set_title(self.title)
+
+    def plot(self):
+        ''' 
+        Push the current data into the persistent line artists. A full canvas
+        draw only happens when a series is added or the axis limits change,
+        otherwise only the data layer is blitted.
+        '''
+        new_series = False
+        for key, value in self.data.items():
+            if key not in self.lines:
+                line, = self.ax.plot([], [], value["Marker"], label=key, animated=True)
+                line.set_visible(self.is_shown(value))
+                self.lines[key] = line
+                new_series = True
+        if new_series:
+            self.update_legend()
+            # The label setters may have been called after init_axes
+            self.ax.set_xlabel(self.x_label)
+            self.ax.set_ylabel(self.y_label)
+            self.ax.set_title(self.title)
+
+        # (seconds, whether it was a full draw) of this call, for the metrics
+        self.last_draw = None
+        if not self.update_button.isChecked():
+            return
+        start = time.perf_counter()
+        full = self.rescale_axes() or new_series or self.background is None
+        if full:
+            self.canvas.draw()
+        else:
+            self.update_lines()
+            self.blit_lines()
+        self.last_draw = (time.perf_counter() - start, full)
+
+    def update_lines(self):
+        '''
+        Give each line the samples that are visible in the current x range,
+        reduced to what the width of the axes can show.
+        '''
+        x0, x1 = self.ax.get_xlim()
+        pixels = max(int(self.ax.bbox.width), 1)
+        for key, line in self.lines.items():
+            value = self.data[key]
+            if "Session" in value:
+                times, values = value["Session"].window((x0 - EPOCH_DATENUM) * 86400.0, 
+                                                        (x1 - EPOCH_DATENUM) * 86400.0, 
+                                                        pixels)
+                line.set_data(times / 86400.0 + EPOCH_DATENUM, values)
+            elif "Decimator" in value:
+                line.set_data(*value["Decimator"].decimate(value["X"], value["Y"], x0, x1, pixels))
+            else:
+                line.set_data(value["X"], value["Y"])
+
+    def rescale_axes(self):
+        '''
+        Grow the axis limits when the data leaves the current view. The x axis
+        is extended with some headroom so that the limits (and thus the full
+        redraw of ticks and labels) only change once in a while.
+        Returns True if the limits were changed.
+        '''
+        if not self.follow_button.isChecked() or not self.lines:
+            return False
+        if (self.live_limits is not None and 
+            (self.ax.get_xlim(), self.ax.get_ylim()) != self.live_limits):
+            # The user zoomed or panned with the navigation toolbar. 
+            self.follow_button.setChecked(False)
+            return False
+        
+        extents = self.data_extents()
+        if extents is None:
+            return False
+        x0, x1, y0, y1 = extents
+        if self.ymin is not None and self.ymax is not None:
+            y0, y1 = self.ymin, self.ymax
+        if self.live_limits is not None:
+            (xmin, xmax), (ymin, ymax) = self.live_limits
+            if x0 >= xmin and x1 <= xmax and y0 >= ymin and y1 <= ymax:
+                return False
+        
+        x_span = max(x1 - x0, 1.0/86400) #at least a second, in matplotlib days
+        y_pad = max(0.1 * (y1 - y0), 0.001)
+        if self.ymin is not None and self.ymax is not None:
+            y_pad = 0
+        self.ax.set_xlim(x0, x1 + self.headroom * x_span)
+        self.ax.set_ylim(y0 - y_pad, y1 + y_pad)
+        self.live_limits = (self.ax.get_xlim(), self.ax.get_ylim())
+        return True
+
+    def data_extents(self):
+        ''' The [xmin, xmax, ymin, ymax] of all lines in axis units. '''
+        extents = None
+        for key, line in self.lines.items():
+            if not line.get_visible():
+                continue
+            if "Extents" in self.data[key]:
+                if self.data[key]["Extents"] is None:
+                    continue
+                x0, x1, y0, y1 = self.data[key]["Extents"]
+                if extents is None:
+                    extents = [x0, x1, y0, y1]
+                else:
+                    extents = [min(extents[0], x0), max(extents[1], x1), 
+                               min(extents[2], y0), max(extents[3], y1)]
+                continue
+            xy = line.get_xydata()
+            if len(xy) == 0:
+                continue
+            x0, y0 = xy.min(axis=0)
+            x1, y1 = xy.max(axis=0)
+            if extents is None:
+                extents = [x0, x1, y0, y1]
+            else:
+                extents = [min(extents[0], x0), max(extents[1], x1), 
+                           min(extents[2], y0), max(extents[3], y1)]
+        return extents
+
+    def on_draw(self, event):
+        ''' 
+        Called after every full canvas draw (including resizing and toolbar
+        navigation) to cache the static background and put the animated lines
+        back on top of it.
+        '''
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.update_lines()
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+    def blit_lines(self):
+        ''' Redraw only the data layer over the cached background. '''
+        self.canvas.restore_region(self.background)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        self.canvas.blit(self.ax.bbox)
+
+    def decimation_method(self):
+        return Decimator.METHODS[self.decimation_combo_box.currentIndex()]
+
+    def decimation_changed(self, index):
+        for value in self.data.values():
+            if "Decimator" in value:
+                value["Decimator"].method = self.decimation_method()
+                value["Decimator"].reset()
+        self.canvas.draw()
+
+    def is_shown(self, value):
+        ''' Whether a series is shown with the current choice of raw and filtered loads. '''
+        choice = self.series_combo_box.currentIndex()
+        if choice == 1:
+            return not value.get("Filtered", False)
+        if choice == 2:
+            return value.get("Filtered", False)
+        return True
+
+    def series_changed(self, index):
+        for key, line in self.lines.items():
+            line.set_visible(self.is_shown(self.data[key]))
+        self.update_legend()
+        self.live_limits = None
+        self.rescale_axes()
+        self.canvas.draw()
+
+    def update_legend(self):
+        lines = [line for line in self.lines.values() if line.get_visible()]
+        if lines:
+            self.ax.legend(lines, [line.get_label() for line in lines])
+        elif self.ax.get_legend() is not None:
+            self.ax.get_legend().remove()
+
+    def follow_changed(self, state):
+        if self.follow_button.isChecked():
+            self.live_limits = None
+            self.plot()
+    
+    def add_data(self, data, marker='*-', label="", filtered=False):
+        ''' 
+        data is a SampleBuffer of (timestamp, value) samples. Only the samples
+        that arrived since the last call are converted to date numbers. 
+        filtered marks a series of filtered loads.
+        '''
+        series = self.data.get(label)
+        if (series is None or series["Samples"] is not data or
+            series["Generation"] != data.generation or series["Converted"] > len(data)):
+            series = {"Samples": data, 
+                      "Generation": data.generation,
+                      "Converted": 0,
+                      "Dates": np.empty(len(data)),
+                      "Extents": None,
+                      "Decimator": Decimator(self.decimation_method())}
+            self.data[label] = series
+        series["Marker"] = marker
+        series["Filtered"] = filtered
+        
+        start = series["Converted"]
+        count = len(data)
+        if count > len(series["Dates"]):
+            dates = np.empty(max(count, 2 * len(series["Dates"])))
+            dates[:start] = series["Dates"][:start]
+            series["Dates"] = dates
+        new_times, new_values = data.since(start)
+        series["Dates"][start:count] = new_times / 86400.0 + EPOCH_DATENUM
+        series["Converted"] = count
+        series["X"] = series["Dates"][:count]
+        series["Y"] = data.values
+        
+        if count > start:
+            x0 = series["X"][0]
+            x1 = series["X"][-1]
+            y0 = new_values.min()
+            y1 = new_values.max()
+            if series["Extents"] is not None:
+                y0 = min(y0, series["Extents"][2])
+                y1 = max(y1, series["Extents"][3])
+            series["Extents"] = [x0, x1, y0, y1]
+    
+    def add_session(self, session, marker='*-', label=""):
+        '''
+        session is a SessionReader. Its samples stay in the file and only the
+        visible window is read each time the view changes.
+        '''
+        time_range = session.time_range()
+        extents = None
+        if time_range is not None:
+            value_range = session.value_range()
+            extents = [time_range[0] / 86400.0 + EPOCH_DATENUM, 
+                       time_range[1] / 86400.0 + EPOCH_DATENUM, 
+                       value_range[0], value_range[1]]
+        self.data[label] = {"Session": session, "Marker": marker, "Extents": extents}
+
+    def show_all(self):
+        ''' Stop following the live data and zoom out to all series. '''
+        self.follow_button.setChecked(False)
+        self.plot()
+        extents = self.data_extents()
+        if extents is not None:
+            x0, x1, y0, y1 = extents
+            y_pad = max(0.1 * (y1 - y0), 0.001)
+            self.ax.set_xlim(x0, max(x1, x0 + 1.0/86400))
+            self.ax.set_ylim(y0 - y_pad, y1 + y_pad)
+        self.canvas.draw()
+
+    def set_yrange(self,min_y, max_y):
+        self.ymax = max_y
+        self.ymin = min_y
+            
+    
+    def set_xlabel(self,label):
+        self.x_label = label
+    
+    def set_ylabel(self,label):
+        self.y_label = label
+    
+    def set_title(self,label):
+        self.title = label
+    
+class GraphTab(QWidget):
+    '''
+    A tab with the plot, the attributes and a table of the samples of one
+    captured event.
+    '''
+    def __init__(self, parent=None, tabs=None, tab_name="Graph Tab"):
+        super(GraphTab, self).__init__(parent)
+        logger.debug("Setting up Graph Tab.")
+        self.root = parent
+        self.tabs = tabs
+        self.tab_name = tab_name
+        self.data_list=[]
+        self.event = None
+        self.init_ui()
+    
+    def init_ui(self):
+        self.graph_tab = QWidget()
+        self.tabs.addTab(self.graph_tab, self.tab_name)
+        logger.debug("Making Attribution Box")
+        attribution_box = QGroupBox("Event Attribution Data")
+        tab_layout = QGridLayout()
+        self.graph_tab.setLayout(tab_layout)
+
+        self.event_name_label = QLabel("Name of Event: ")
+        self.trigger_label = QLabel("Trigger: ")
+        self.trigger_time_label = QLabel("Time of Trigger: ")
+        self.peak_label = QLabel("Peak Load: ")
+        self.samples_label = QLabel("Samples: ")
+
+        attribution_layout = QVBoxLayout()
+        attribution_layout.addWidget(self.event_name_label)
+        attribution_layout.addWidget(self.trigger_label)
+        attribution_layout.addWidget(self.trigger_time_label)
+        attribution_layout.addWidget(self.peak_label)
+        attribution_layout.addWidget(self.samples_label)
+        attribution_box.setLayout(attribution_layout)
+        logger.debug("Finished Setting Attribution Layout")
+        
+        self.data_table = QTableWidget()
+        self.data_table.setSelectionBehavior(QAbstractItemView.SelectColumns)
+        logger.debug("Finished with Data Table")
+        
+        self.csv_button = QPushButton("Export CSV")
+        self.csv_button.clicked.connect(self.export_csv)
+        logger.debug("Finished with CSV")
+
+        self.figure = mpl.Figure(figsize=(7,5))
+        self.canvas = FigureCanvas(self.figure)
+        self.ax = self.figure.add_subplot(1,1,1)
+        self.ax.set_ylabel("Load (lb)")
+        self.ax.set_xlabel("Time from Trigger (sec)")
+        self.canvas.draw()
+
+        self.toolbar = NavigationToolbar(self.canvas, self.graph_tab)
+        logger.debug("Finished with toolbar")
+
+        # set the layout
+        
+        tab_layout.addWidget(attribution_box,0,0,1,1)
+        tab_layout.addWidget(self.data_table,1,0,1,1)
+        tab_layout.addWidget(self.csv_button,2,0,1,1)
+        tab_layout.addWidget(self.canvas,0,1,2,1)
+        tab_layout.addWidget(self.toolbar,2,1,1,1) 
+        
+        logger.debug("Finished with UI for Tab {}".format(self.tab_name))
+
+    def show_event(self, event):
+        ''' Fill the tab with an EventRecord. '''
+        self.event = event
+        trigger_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.trigger_time))
+        trigger_time += "{:.3f}".format(event.trigger_time % 1)[1:]
+        self.event_name_label.setText("Name of Event: {}".format(event.title))
+        self.trigger_label.setText("Trigger: {}".format(event.trigger.describe()))
+        self.trigger_time_label.setText("Time of Trigger: {}".format(trigger_time))
+        if event.peak is not None:
+            self.peak_label.setText("Peak Load: {:.3f} lb at {:+.4f} s".format(
+                event.peak, event.peak_time - event.trigger_time))
+        self.samples_label.setText("Samples: {}".format(len(event.times)))
+
+        offsets = event.times - event.trigger_time
+        self.data_list = [["Time from Trigger (sec)", "Load (lb)"]]
+        self.data_list += [["{:.6f}".format(t), "{:.3f}".format(v)] 
+                           for t, v in zip(offsets.tolist(), event.values.tolist())]
+        # A table with very many rows takes long to build; the CSV has them all
+        rows = self.data_list[1:EVENT_TABLE_ROWS + 1]
+        self.data_table.setColumnCount(2)
+        self.data_table.setHorizontalHeaderLabels(self.data_list[0])
+        self.data_table.setRowCount(len(rows))
+        for row, (offset, load) in enumerate(rows):
+            self.data_table.setItem(row, 0, QTableWidgetItem(offset))
+            self.data_table.setItem(row, 1, QTableWidgetItem(load))
+        self.data_table.resizeColumnsToContents()
+
+        self.ax.plot(offsets, event.values, '.-', markersize=2)
+        self.ax.axvline(0, color='r', linestyle='--')
+        self.ax.grid(True)
+        self.ax.set_title(event.title)
+        self.canvas.draw()
+
+    def export_csv(self):
+        logger.debug("Export CSV")
+        filters = "Comma Separated Values (*.csv);;All Files (*.*)"
+        selected_filter = "Comma Separated Values (*.csv)"
+        fname = QFileDialog.getSaveFileName(self, 
+                                            'Export CSV',
+                                            self.tab_name + ".csv",
+                                            filters,
+                                            selected_filter)
+        if fname[0]:
+            if fname[0][-4:] ==".csv":
+                filename = fname[0]
+            else:
+                filename = fname[0]+".csv"
+            try:
+                with open(filename,'w', newline='') as csv_file:
+                    writer = csv.writer(csv_file)
+                    writer.writerow(["The University of Tulsa"])
+
+                    writer.writerow(["Date of Creation:", time.strftime("%Y-%m-%d %H:%M:%S")])
+
+                    writer.writerows(['',["Event Attribution Data"]])
+                    writer.writerow([''] + self.event_name_label.text().split(": "))
+                    writer.writerow([''] + self.trigger_label.text().split(": "))
+                    writer.writerow([''] + self.trigger_time_label.text().split(": "))
+                    writer.writerow([''] + self.peak_label.text().split(": "))
+                    writer.writerow([''] + self.samples_label.text().split(": "))
+                    writer.writerows(['',["Event Table Data"]])
+                    writer.writerows(self.data_list)
+                base_name = os.path.basename(filename)
+                QMessageBox.information(self,"Export Success","The comma separated values file\n{}\nwas successfully exported.".format(base_name))
+            
+            except PermissionError:
+                logger.info("Permission Error - Please close the file and try again.")
+                QMessageBox.warning(self,"Permission Error","Permission Error\nThe file may be open in another application.\nPlease close the file and try again.")
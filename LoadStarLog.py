@@ -0,0 +1,246 @@
+"""
+Logging that never makes the threads that log wait for a terminal or a disk.
+
+Records go onto a queue through a QueueHandler. A QueueListener thread takes
+them off and writes them to the console and to the log file of the session.
+Every run gets its own file of JSON lines in the log directory. The file is
+rolled over when it gets too big or too old, and only the files of the
+newest sessions are kept. A burst of messages from the same line of code,
+such as the same error over and over, is cut short, and the number that was
+left out is added to the next message from that line that gets through.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import logging.handlers
+import threading
+import datetime
+import atexit
+import copy
+import queue
+import json
+import glob
+import time
+import sys
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+LOG_DIRECTORY = "Logs"
+LOG_FILE_PREFIX = "LoadStar_Log"
+LOG_EXTENSION = ".jsonl"
+LOG_MAX_BYTES = 10 * 2**20
+LOG_MAX_SECONDS = 24 * 3600
+LOG_BACKUPS = 5 # rolled over files kept of one session
+LOG_SESSIONS_KEPT = 20
+LOG_QUEUE_SIZE = 10000 # records waiting for the listener before new ones are dropped
+RATE_LIMIT_BURST = 10 # records per line of code...
+RATE_LIMIT_INTERVAL = 10.0 # ...in this many seconds
+
+# The LogSession started by start_logging
+active_session = None
+
+
+class JSONFormatter(logging.Formatter):
+    ''' Formats each record as one JSON object. '''
+    def format(self, record):
+        entry = {"time": datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(
+                     timespec="milliseconds"),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "thread": record.threadName,
+                 "message": record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Lets at most burst records from the same line of code through in any
+    interval seconds. How many were left out is added to the next record
+    from that line that is let through.
+    '''
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL, clock=time.monotonic):
+        super(RateLimitFilter, self).__init__()
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (file, line) -> [start of the interval, records let through, records left out]
+        self.sites = {}
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = self.clock()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [now, 0, 0]
+            elif now - site[0] >= self.interval:
+                site[0] = now
+                site[1] = 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            suppressed = site[2]
+            site[2] = 0
+        if suppressed:
+            record.msg = "{} ({} similar messages were left out)".format(record.getMessage(), suppressed)
+            record.args = None
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    A QueueHandler for a bounded queue. When the listener falls that far
+    behind, records are dropped rather than making the caller wait, and a
+    warning with their number is queued once there is room again.
+    '''
+    def __init__(self, record_queue):
+        super(DroppingQueueHandler, self).__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        '''
+        Fill in the message and the traceback now, since the arguments may
+        change before the listener gets to them. Unlike the QueueHandler
+        default, the traceback is kept apart from the message, so the JSON
+        lines have it in a field of its own.
+        '''
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Called with the handler lock held, so dropped needs no other lock
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "{} log messages were dropped.".format(self.dropped)}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SessionFileHandler(logging.handlers.RotatingFileHandler):
+    ''' A RotatingFileHandler that also rolls over once the file is max_seconds old. '''
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, max_seconds=LOG_MAX_SECONDS,
+                 backups=LOG_BACKUPS):
+        super(SessionFileHandler, self).__init__(filename, maxBytes=max_bytes,
+                                                 backupCount=backups, encoding="utf8")
+        self.max_seconds = max_seconds
+        self.opened = time.time()
+
+    def shouldRollover(self, record):
+        if self.max_seconds and time.time() - self.opened >= self.max_seconds:
+            return True
+        return super(SessionFileHandler, self).shouldRollover(record)
+
+    def doRollover(self):
+        super(SessionFileHandler, self).doRollover()
+        self.opened = time.time()
+
+
+def remove_old_sessions(directory, keep=LOG_SESSIONS_KEPT):
+    ''' Delete the log files of all but the newest keep sessions in directory. '''
+    pattern = os.path.join(glob.escape(directory), "{} *{}*".format(LOG_FILE_PREFIX, LOG_EXTENSION))
+    sessions = {}
+    for path in glob.glob(pattern):
+        # Rolled over files end in .1, .2 and so on
+        base = path[:path.rindex(LOG_EXTENSION) + len(LOG_EXTENSION)]
+        sessions.setdefault(base, []).append(path)
+    # The names start with the date and time, so they sort oldest first
+    for base in sorted(sessions)[:max(len(sessions) - keep, 0)]:
+        for path in sessions[base]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug("Could not remove old log file {}: {}".format(path, e))
+
+
+class LogSession(object):
+    '''
+    Routes all logging through a queue to a listener thread. The listener
+    writes to console (a stream, or None for no console output) and, if a
+    directory is given, to a new session file there, whose name is in path.
+    '''
+    def __init__(self, directory=LOG_DIRECTORY, level=logging.DEBUG, console=sys.stdout,
+                 console_format="%(message)s"):
+        handlers = []
+        if console is not None:
+            console_handler = logging.StreamHandler(console)
+            console_handler.setFormatter(logging.Formatter(console_format, "%Y-%m-%d %H:%M:%S"))
+            handlers.append(console_handler)
+        self.path = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            remove_old_sessions(directory, LOG_SESSIONS_KEPT - 1)
+            self.path = os.path.join(directory, "{} {} {}{}".format(
+                LOG_FILE_PREFIX, time.strftime("%Y-%m-%d %H%M%S"), os.getpid(), LOG_EXTENSION))
+            file_handler = SessionFileHandler(self.path)
+            file_handler.setFormatter(JSONFormatter())
+            handlers.append(file_handler)
+
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.queue_handler.addFilter(RateLimitFilter())
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers)
+        root = logging.getLogger()
+        self.previous_handlers = root.handlers[:]
+        for handler in self.previous_handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(level)
+        self.listener.start()
+
+    def stop(self):
+        ''' Write out what is still queued and go back to the previous handlers. '''
+        if self.listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self.previous_handlers:
+            root.addHandler(handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        self.listener = None
+
+
+def start_logging(directory=LOG_DIRECTORY, level=logging.DEBUG, console=sys.stdout,
+                  console_format="%(message)s"):
+    ''' Start the LogSession of this program. It is stopped when the program exits. '''
+    global active_session
+    if active_session is not None:
+        active_session.stop()
+    active_session = LogSession(directory, level, console, console_format)
+    atexit.register(active_session.stop)
+    return active_session
+
+
+def log_file():
+    ''' The log file of this session, or None. '''
+    if active_session is None:
+        return None
+    return active_session.path
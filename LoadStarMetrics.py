@@ -0,0 +1,175 @@
+"""
+Counters and latency histograms for the stages of the acquisition and
+plotting pipeline, and writing them to files other tools can read: JSON
+lines (one snapshot per line) and the Prometheus text exposition format
+(for the node_exporter textfile collector, for example).
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import bisect
+import json
+import time
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1,
+                   0.2, 0.5, 1.0, 2.0, 5.0, 10.0, float("inf"))
+METRICS_PREFIX = "loadstar_"
+
+
+class Histogram(object):
+    '''
+    Counts observations in fixed buckets, like a Prometheus histogram, so
+    recording one costs a binary search no matter how many there are.
+    '''
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = None
+
+    def observe(self, value):
+        self.counts[min(bisect.bisect_left(self.bounds, value), len(self.bounds) - 1)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def quantile(self, q):
+        ''' The upper bound of the bucket holding the q quantile, or None if empty. '''
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "last": self.last,
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "buckets": dict(zip(("{:g}".format(bound) for bound in self.bounds), self.counts))}
+
+
+class PipelineMetrics(object):
+    '''
+    A named set of counters (totals that only grow), gauges (the latest
+    reading of something) and histograms. Counters and gauges can carry a
+    device label.
+    '''
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1, device=None):
+        key = (name, device)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_counter(self, name, value, device=None):
+        ''' Set a counter that is kept elsewhere, such as by a reader thread. '''
+        self.counters[(name, device)] = value
+
+    def set_gauge(self, name, value, device=None):
+        self.gauges[(name, device)] = value
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name, device=None):
+        ''' The total of a counter, over all devices if device is None. '''
+        if device is not None:
+            return self.counters.get((name, device), 0)
+        return sum(value for (key, label), value in self.counters.items() if key == name)
+
+    def histogram(self, name):
+        return self.histograms.setdefault(name, Histogram())
+
+    def snapshot(self):
+        ''' All metrics as a dictionary that can be written as JSON. '''
+        def labelled(values):
+            result = {}
+            for (name, device), value in sorted(values.items(), key=lambda item: str(item[0])):
+                if device is None:
+                    result[name] = value
+                else:
+                    result.setdefault(name, {})[device] = value
+            return result
+        return {"time": time.time(),
+                "uptime": time.time() - self.start_time,
+                "counters": labelled(self.counters),
+                "gauges": labelled(self.gauges),
+                "histograms": {name: histogram.snapshot()
+                               for name, histogram in sorted(self.histograms.items())}}
+
+    def prometheus(self):
+        ''' All metrics in the Prometheus text exposition format. '''
+        def labels(device, extra=""):
+            parts = []
+            if device is not None:
+                parts.append('device="{}"'.format(str(device).replace('\\', '\\\\').replace('"', '\\"')))
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines = []
+        for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+            names = sorted(set(name for name, device in values))
+            for name in names:
+                metric = METRICS_PREFIX + name
+                lines.append("# TYPE {} {}".format(metric, kind))
+                for (key, device), value in sorted(values.items(), key=lambda item: str(item[0])):
+                    if key == name:
+                        lines.append("{}{} {}".format(metric, labels(device), value))
+        for name, histogram in sorted(self.histograms.items()):
+            metric = METRICS_PREFIX + name
+            lines.append("# TYPE {} histogram".format(metric))
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else "{:g}".format(bound)
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, le, cumulative))
+            lines.append("{}_sum {}".format(metric, histogram.sum))
+            lines.append("{}_count {}".format(metric, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prometheus_path=None):
+        '''
+        Append a snapshot to the JSON lines file and replace the Prometheus
+        file. The Prometheus file is written under a temporary name and
+        renamed, so a scraper never sees half of it.
+        '''
+        try:
+            if json_path:
+                with open(json_path, "a") as out_file:
+                    out_file.write(json.dumps(self.snapshot()) + "\n")
+            if prometheus_path:
+                temporary = prometheus_path + ".part"
+                with open(temporary, "w") as out_file:
+                    out_file.write(self.prometheus())
+                os.replace(temporary, prometheus_path)
+        except OSError as e:
+            logger.debug("Could not write the metrics: {}".format(e))
@@ -0,0 +1,454 @@
+"""
+Serving the live samples to other programs over TCP or UDP, on the same
+computer or the local network.
+
+The readers hand each block of samples to a Publisher, which turns them
+into binary frames and queues them for every subscriber. Each subscriber
+has its own bounded buffer. When a subscriber does not keep up, its oldest
+frames are dropped and the next frame it gets is marked, so a slow client
+never holds up the readers or the other clients. Sending is done by one
+thread of the publisher with non-blocking sockets.
+
+Modes:
+    latency     every block from a reader is sent as soon as it arrives, in
+                small frames, with Nagle's algorithm turned off.
+    throughput  samples are collected into frames of up to batch_samples
+                samples, or batch_seconds of waiting, whichever is first.
+
+TCP subscribers just connect and receive frames back to back. UDP
+subscribers send a datagram with the word subscribe to the port and get
+one frame per datagram from then on. They have to repeat it at least every
+SUBSCRIPTION_SECONDS, and can send unsubscribe when they are done.
+
+Frame layout (little-endian):
+    magic           4 bytes  b"LSF1"
+    version         uint8    1
+    flags           uint8    1 if frames were dropped for this subscriber
+                             before this one
+    name length     uint16   bytes of the device name
+    sequence        uint64   number of the first sample of the frame,
+                             counted per device since the publisher started
+    start time      float64  Unix time of the first sample
+    count           uint32   samples in the frame
+    name            the device name in UTF-8
+    offsets         count float32, seconds of each sample after start time
+    loads           count float64, in lb
+
+LoadStarSubscribe.py is a reference client that prints the samples.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+from collections import deque
+import urllib.parse
+import numpy as np
+import threading
+import selectors
+import traceback
+import socket
+import struct
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+FRAME_MAGIC = b"LSF1"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<4sBBHQdI")
+FLAG_GAP = 1
+PUBLISH_PORT = 5750
+PUBLISH_PROTOCOLS = ("tcp", "udp")
+PUBLISH_MODES = ("latency", "throughput")
+# Largest UDP payload that is not fragmented on an Ethernet network
+UDP_PAYLOAD = 1400
+# Bytes of frames waiting for one subscriber before the oldest are dropped
+CLIENT_BUFFER_BYTES = 4 * 2**20
+SUBSCRIPTION_SECONDS = 15.0
+
+
+def parse_address(text, default_port=PUBLISH_PORT):
+    ''' A "tcp://host:port" or "udp://host:port" string as (protocol, host, port). '''
+    if "://" not in text:
+        text = "tcp://" + text
+    parts = urllib.parse.urlsplit(text)
+    if parts.scheme not in PUBLISH_PROTOCOLS:
+        raise ValueError("Unknown protocol {!r}, use tcp:// or udp://".format(parts.scheme))
+    return parts.scheme, parts.hostname or "127.0.0.1", parts.port or default_port
+
+
+def encode_frame(name, sequence, times, values, flags=0):
+    ''' One frame with the samples (times, values) of the device called name. '''
+    encoded_name = name.encode("utf8")
+    start = float(times[0])
+    return b"".join((FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, len(encoded_name),
+                                       sequence, start, len(times)),
+                     encoded_name,
+                     (np.asarray(times, dtype=np.float64) - start).astype("<f4").tobytes(),
+                     np.asarray(values, dtype="<f8").tobytes()))
+
+
+class Frame(object):
+    ''' A decoded frame. times are Unix times, values loads in lb. '''
+    def __init__(self, name, sequence, times, values, flags=0):
+        self.name = name
+        self.sequence = sequence
+        self.times = times
+        self.values = values
+        self.flags = flags
+
+    @property
+    def gap(self):
+        return bool(self.flags & FLAG_GAP)
+
+
+def decode_frame(data, offset=0):
+    '''
+    Decode the frame that starts at offset in data. Returns the Frame and
+    the offset just after it, or (None, offset) if data does not hold all
+    of it yet. Raises ValueError if data is not a frame.
+    '''
+    if len(data) - offset < FRAME_HEADER.size:
+        return None, offset
+    magic, version, flags, name_length, sequence, start, count = FRAME_HEADER.unpack_from(data, offset)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Not a version {} LoadStar frame.".format(FRAME_VERSION))
+    position = offset + FRAME_HEADER.size
+    end = position + name_length + 12 * count
+    if len(data) < end:
+        return None, offset
+    name = bytes(data[position:position + name_length]).decode("utf8", "replace")
+    position += name_length
+    offsets = np.frombuffer(data, "<f4", count, position)
+    values = np.frombuffer(data, "<f8", count, position + 4 * count).copy()
+    return Frame(name, sequence, start + offsets.astype(np.float64), values, flags), end
+
+
+class ClientBuffer(object):
+    '''
+    The frames waiting for one subscriber, at most capacity bytes of them.
+    The first frame may be on its way out (sent is how much of it went out
+    over TCP already), so it is never dropped.
+    '''
+    def __init__(self, address, sock=None, capacity=CLIENT_BUFFER_BYTES):
+        self.address = address
+        self.sock = sock
+        self.capacity = capacity
+        self.frames = deque()
+        self.size = 0
+        self.sent = 0
+        self.last_seen = time.monotonic()
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+
+    def add(self, frame):
+        self.frames.append(frame)
+        self.size += len(frame)
+        gap = False
+        while self.size > self.capacity and len(self.frames) > 2:
+            dropped = self.frames[1]
+            del self.frames[1]
+            self.size -= len(dropped)
+            self.frames_dropped += 1
+            gap = True
+        if gap:
+            # The frame now following the first one comes after the dropped
+            # ones, so it carries the gap flag to the subscriber
+            frame = bytearray(self.frames[1])
+            frame[5] |= FLAG_GAP
+            self.frames[1] = bytes(frame)
+
+    def next_frame(self):
+        ''' The frame to send next. '''
+        return self.frames[0]
+
+    def pop(self):
+        frame = self.frames.popleft()
+        self.size -= len(frame)
+        self.sent = 0
+        self.bytes_sent += len(frame)
+
+
+class Publisher(threading.Thread):
+    '''
+    Serves the samples given to publish() to any number of subscribers on
+    host and port with the protocol (tcp or udp) and mode (latency or
+    throughput) described at the top of this module. publish() can be
+    called from any thread and never waits for the network.
+    '''
+    def __init__(self, host="127.0.0.1", port=PUBLISH_PORT, protocol="tcp", mode="latency",
+                 batch_samples=4096, batch_seconds=0.05, buffer_bytes=CLIENT_BUFFER_BYTES):
+        threading.Thread.__init__(self)
+        if protocol not in PUBLISH_PROTOCOLS:
+            raise ValueError("Unknown protocol {}".format(protocol))
+        if mode not in PUBLISH_MODES:
+            raise ValueError("Unknown publishing mode {}".format(mode))
+        self.daemon = True
+        self.protocol = protocol
+        self.mode = mode
+        self.batch_samples = batch_samples
+        self.batch_seconds = batch_seconds
+        self.buffer_bytes = buffer_bytes
+        self.runSignal = True
+        # When stop() was called, how long the last samples may take to go out
+        self.stop_deadline = None
+        self.lock = threading.Lock()
+        self.clients = {}
+        # Per device: [next sequence number, time blocks, value blocks, samples, time of first]
+        self.devices = {}
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+
+        kind = socket.SOCK_STREAM if protocol == "tcp" else socket.SOCK_DGRAM
+        self.sock = socket.socket(socket.AF_INET, kind)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        if protocol == "tcp":
+            self.sock.listen(8)
+            self.max_samples = 65536
+        else:
+            self.max_samples = None # depends on the length of the name
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        # Writing a byte to wake_in wakes the sending thread up
+        self.wake_out, self.wake_in = socket.socketpair()
+        self.wake_out.setblocking(False)
+        self.wake_in.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, "server")
+        self.selector.register(self.wake_out, selectors.EVENT_READ, "wake")
+        logger.info("Publishing samples on {}://{}:{} for {}.".format(
+            protocol, self.address[0], self.address[1], mode))
+
+    @property
+    def url(self):
+        return "{}://{}:{}".format(self.protocol, self.address[0], self.address[1])
+
+    def publish(self, name, times, values):
+        ''' Queue a block of samples of the device called name for all subscribers. '''
+        if len(times) == 0:
+            return
+        with self.lock:
+            device = self.devices.get(name)
+            if device is None:
+                device = self.devices[name] = [0, [], [], 0, None]
+            device[1].append(times)
+            device[2].append(values)
+            device[3] += len(times)
+            if device[4] is None:
+                device[4] = time.monotonic()
+            if self.mode == "throughput" and device[3] < self.batch_samples:
+                return
+            self.flush_device(name, device)
+        self.wake()
+
+    def flush_device(self, name, device):
+        ''' Turn the samples waiting for a device into frames. Call with the lock held. '''
+        times = np.concatenate(device[1])
+        values = np.concatenate(device[2])
+        device[1] = []
+        device[2] = []
+        device[3] = 0
+        device[4] = None
+        step = self.max_samples
+        if step is None:
+            step = max((UDP_PAYLOAD - FRAME_HEADER.size - len(name.encode("utf8"))) // 12, 1)
+        for start in range(0, len(times), step):
+            frame = encode_frame(name, device[0] + start, times[start:start + step],
+                                 values[start:start + step])
+            for client in self.clients.values():
+                dropped = client.frames_dropped
+                client.add(frame)
+                self.frames_dropped += client.frames_dropped - dropped
+        device[0] += len(times)
+
+    def flush_batches(self, force=False):
+        ''' Send the batches that have waited batch_seconds (or all of them). '''
+        now = time.monotonic()
+        with self.lock:
+            for name, device in self.devices.items():
+                if device[3] and (force or now - device[4] >= self.batch_seconds):
+                    self.flush_device(name, device)
+
+    def wake(self):
+        try:
+            self.wake_in.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already woken up, or stopping
+            pass
+
+    @property
+    def client_count(self):
+        return len(self.clients)
+
+    def run(self):
+        try:
+            while self.runSignal:
+                timeout = self.batch_seconds if self.mode == "throughput" else 1.0
+                for key, mask in self.selector.select(timeout):
+                    if key.data == "wake":
+                        try:
+                            while self.wake_out.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif key.data == "server" and self.protocol == "udp":
+                        self.receive_datagrams()
+                    elif key.data == "server":
+                        self.accept()
+                    elif mask & selectors.EVENT_READ:
+                        self.receive(key.data)
+                if self.mode == "throughput":
+                    self.flush_batches()
+                self.send_all()
+            self.finish()
+        except Exception:
+            logger.debug(traceback.format_exc())
+        finally:
+            self.close_sockets()
+        logger.debug("Publisher on {} is finished.".format(self.url))
+
+    def accept(self):
+        try:
+            sock, address = self.sock.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        if self.mode == "latency":
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = ClientBuffer(address, sock, self.buffer_bytes)
+        with self.lock:
+            self.clients[address] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        logger.info("Subscriber {}:{} connected.".format(*address))
+
+    def receive_datagrams(self):
+        ''' Subscriptions of UDP clients. '''
+        while True:
+            try:
+                message, address = self.sock.recvfrom(256)
+            except (BlockingIOError, OSError):
+                return
+            command = message.strip().lower()
+            with self.lock:
+                if command == b"subscribe":
+                    client = self.clients.get(address)
+                    if client is None:
+                        self.clients[address] = ClientBuffer(address, None, self.buffer_bytes)
+                        logger.info("Subscriber {}:{} subscribed.".format(*address))
+                    else:
+                        client.last_seen = time.monotonic()
+                elif command == b"unsubscribe" and self.clients.pop(address, None) is not None:
+                    logger.info("Subscriber {}:{} unsubscribed.".format(*address))
+
+    def receive(self, client):
+        ''' TCP subscribers send nothing, so anything readable means they hung up. '''
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop_client(client)
+
+    def drop_client(self, client):
+        with self.lock:
+            self.clients.pop(client.address, None)
+        if client.sock is not None:
+            self.selector.unregister(client.sock)
+            client.sock.close()
+        logger.info("Subscriber {}:{} disconnected.".format(*client.address))
+
+    def send_all(self):
+        now = time.monotonic()
+        with self.lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if client.sock is None and now - client.last_seen > SUBSCRIPTION_SECONDS:
+                with self.lock:
+                    self.clients.pop(client.address, None)
+                logger.info("Subscription of {}:{} expired.".format(*client.address))
+                continue
+            try:
+                self.send(client)
+            except OSError:
+                logger.debug(traceback.format_exc())
+                self.drop_client(client)
+                continue
+            if client.sock is not None:
+                events = selectors.EVENT_READ
+                if client.frames:
+                    events |= selectors.EVENT_WRITE
+                if self.selector.get_key(client.sock).events != events:
+                    self.selector.modify(client.sock, events, client)
+
+    def send(self, client):
+        ''' Send what the socket takes without waiting. '''
+        while True:
+            with self.lock:
+                if not client.frames:
+                    return
+                frame = client.next_frame()
+                sent = client.sent
+            try:
+                if client.sock is None:
+                    self.sock.sendto(frame, client.address)
+                    count = len(frame)
+                else:
+                    count = client.sock.send(memoryview(frame)[sent:])
+            except BlockingIOError:
+                return
+            with self.lock:
+                if client.sock is None or sent + count >= len(frame):
+                    client.pop()
+                    self.frames_sent += 1
+                else:
+                    client.sent = sent + count
+                self.bytes_sent += count
+
+    def finish(self):
+        '''
+        The last pass of the thread after stop(): send what is batched and
+        queued for the subscribers, until it is out or the deadline passed.
+        '''
+        self.flush_batches(force=True)
+        while True:
+            self.send_all()
+            with self.lock:
+                waiting = any(client.frames for client in self.clients.values())
+            remaining = self.stop_deadline - time.monotonic()
+            if not waiting or remaining <= 0:
+                break
+            self.selector.select(min(remaining, 0.05))
+
+    def stop(self, timeout=2):
+        '''
+        Stop the thread, which sends what is still batched and queued for up
+        to timeout seconds before it closes the sockets.
+        '''
+        self.stop_deadline = time.monotonic() + timeout
+        self.runSignal = False
+        self.wake()
+        if self.is_alive():
+            self.join(timeout + 1)
+        else:
+            self.close_sockets()
+
+    def close_sockets(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+        for client in clients:
+            if client.sock is not None:
+                client.sock.close()
+        for sock in (self.sock, self.wake_out, self.wake_in):
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self.selector.close()
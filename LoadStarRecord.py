@@ -0,0 +1,248 @@
+"""
+loadstar-record: headless acquisition from one or more iLoad Pro load cells.
+
+This connects to the load cells, streams their samples to session files
+(the same .lsr format the GUI records) and/or to stdout as CSV, and exits
+cleanly on Ctrl+C or SIGTERM. It only needs numpy and pyserial, so it
+starts quickly and runs on machines without a display.
+
+Examples:
+    python LoadStarRecord.py --device COM14,4800 --output test.lsr
+    python LoadStarRecord.py --settings load_cell_setting.txt --stdout
+    python LoadStarRecord.py --replay test.lsr --speed 10 --publish tcp://0.0.0.0:5750
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import argparse
+import signal
+import time
+import sys
+import os
+
+from LoadStarSerial import loadcellThread, open_load_cell
+from LoadStarSession import SessionRecorder, SessionFormatError, SESSION_EXTENSION
+from LoadStarData import BlockRing
+from LoadStarLog import start_logging
+# Publishing, shared memory and replays are imported when they are asked for
+
+import logging
+logger = logging.getLogger("LoadStarRecord")
+
+HANDOFF_CAPACITY = 1024 # blocks waiting for stdout per device, as in the GUI
+HANDOFF_POLICY = "drop-oldest"
+LOSS_REPORT_SECONDS = 5.0
+
+
+def parse_device(text):
+    ''' A "port[,baud[,name]]" string as a (name, port, baud) tuple. '''
+    fields = [field.strip() for field in text.split(",")]
+    port = fields[0]
+    baud = int(fields[1]) if len(fields) > 1 and fields[1] else 4800
+    name = fields[2] if len(fields) > 2 and fields[2] else "Load {}".format(port)
+    return name, port, baud
+
+
+def read_settings(path):
+    ''' The devices in a GUI settings file, one "port,baud,name" line each. '''
+    with open(path, "r") as in_file:
+        return [parse_device(line) for line in in_file if line.strip()]
+
+
+def session_path(output, name, device_count):
+    ''' The session file for a device. With several devices the name is added. '''
+    if device_count == 1:
+        return output
+    base, extension = os.path.splitext(output)
+    return "{} {}{}".format(base, name, extension or SESSION_EXTENSION)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="loadstar-record",
+                                     description="Record iLoad Pro load cells without the GUI.")
+    parser.add_argument("--device", action="append", default=[], metavar="PORT[,BAUD[,NAME]]",
+                        help="A load cell to record, or a sim:// URL for a simulated one. "
+                             "Can be given more than once.")
+    parser.add_argument("--settings", metavar="FILE",
+                        help="Read the devices from a load_cell_setting.txt file.")
+    parser.add_argument("--replay", action="append", default=[], metavar="FILE",
+                        help="Play back a recorded session or exported CSV file as if its "
+                             "load cells were connected. Can be given more than once.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay this many times faster than recorded, 0 for as fast as possible.")
+    parser.add_argument("--loop", action="store_true",
+                        help="Start the replays over at the end.")
+    parser.add_argument("--output", metavar="FILE",
+                        help="Session file to append the samples to.")
+    parser.add_argument("--stdout", action="store_true",
+                        help="Write name,unix_time,load rows to stdout.")
+    parser.add_argument("--publish", metavar="URL",
+                        help="Serve the samples to subscribers on tcp://HOST:PORT or udp://HOST:PORT.")
+    parser.add_argument("--publish-mode", default="latency",
+                        help="Send every block at once (latency) or in batches (throughput).")
+    parser.add_argument("--share", action="store_true",
+                        help="Keep the newest samples of each device in shared memory for other processes.")
+    parser.add_argument("--duration", type=float, default=None, metavar="SECONDS",
+                        help="Stop after this many seconds.")
+    parser.add_argument("--verbose", action="store_true", help="Log debugging messages.")
+    parser.add_argument("--log-dir", metavar="DIRECTORY",
+                        help="Also write a JSON lines log file of the session to this directory.")
+    args = parser.parse_args(argv)
+
+    start_logging(args.log_dir, 
+                  level=logging.DEBUG if args.verbose else logging.INFO,
+                  console=sys.stderr, 
+                  console_format="%(asctime)s %(levelname)s %(message)s")
+
+    devices = [parse_device(device) for device in args.device]
+    if args.settings:
+        devices += read_settings(args.settings)
+    recordings = []
+    if args.replay:
+        from LoadStarReplay import ReplayThread, read_recordings, REPLAY_FASTEST
+    for path in args.replay:
+        try:
+            recordings += read_recordings(path)
+        except (SessionFormatError, ValueError, IndexError, OSError) as e:
+            parser.error("Can not replay {}: {}".format(path, e))
+    if not devices and not recordings:
+        parser.error("Give at least one --device, a --settings file or a --replay file.")
+    if args.speed < 0:
+        parser.error("The --speed can not be negative.")
+    if not args.output and not args.stdout and not args.publish and not args.share:
+        parser.error("Give an --output file, --stdout, --publish, --share, or more than one.")
+    publisher = None
+    if args.publish:
+        from LoadStarPublish import Publisher, parse_address
+        try:
+            protocol, host, port = parse_address(args.publish)
+            publisher = Publisher(host, port, protocol, args.publish_mode)
+        except (ValueError, OSError) as e:
+            parser.error("Can not publish on {}: {}".format(args.publish, e))
+        publisher.start()
+
+    stop = []
+    def request_stop(signum, frame):
+        stop.append(signum)
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    if args.share:
+        from LoadStarShared import SharedRing, shared_name
+    clock_anchor = (time.time(), time.monotonic())
+    threads = []
+    recorders = []
+    rings = []
+    sources = len(devices) + len(recordings)
+    for name, port, baud in devices + [(recording.name, recording, None) for recording in recordings]:
+        if baud is None:
+            # A recording to replay
+            ser = port
+            port = ser.port
+        else:
+            try:
+                ser = open_load_cell(port, baud)
+            except Exception as e:
+                logger.error("Could not open {}: {}".format(port, e))
+                ser = None
+            if ser is None:
+                logger.error("No load cell found on {}".format(port))
+                continue
+        recorder = None
+        if args.output:
+            recorder = SessionRecorder(session_path(args.output, name, sources),
+                                       metadata={"Title": "LoadStar Logger",
+                                                 "Name": name,
+                                                 "Port": port,
+                                                 "Baud": baud})
+            recorder.start()
+            recorders.append(recorder)
+        ring = None
+        if args.share:
+            try:
+                ring = SharedRing.create(shared_name(name))
+            except (OSError, RuntimeError) as e:
+                logger.error("Could not share {} in memory: {}".format(name, e))
+            else:
+                rings.append(ring)
+        # A bounded hand-off for each reader, so a slow consumer of stdout
+        # drops samples from it (they are still recorded) instead of making
+        # memory grow. A replay as fast as possible waits for it instead.
+        if baud is None:
+            policy = "block" if args.speed == REPLAY_FASTEST else HANDOFF_POLICY
+            thread = ReplayThread(BlockRing(HANDOFF_CAPACITY, policy), ser, recorder, name,
+                                  clock_anchor, publisher=publisher, shared=ring, 
+                                  speed=args.speed, loop=args.loop)
+        else:
+            thread = loadcellThread(BlockRing(HANDOFF_CAPACITY, HANDOFF_POLICY), ser, recorder,
+                                    name, clock_anchor, publisher=publisher, shared=ring)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    if not threads:
+        if publisher is not None:
+            publisher.stop()
+        return 1
+
+    start = last_report = time.monotonic()
+    samples = 0
+    dropped = 0
+    unreported = 0
+    out = sys.stdout
+    try:
+        # A replay can finish with samples still queued, so those are taken too
+        while not stop and (any(thread.is_alive() for thread in threads) or
+                            any(len(thread.rx_queue) for thread in threads)):
+            now = time.monotonic()
+            if args.duration is not None and now - start >= args.duration:
+                break
+            received = False
+            for thread in threads:
+                for name, times, values, filtered in thread.rx_queue.drain():
+                    received = True
+                    samples += len(values)
+                    if args.stdout:
+                        out.write("".join("{},{:.6f},{}\n".format(name, t, v)
+                                          for t, v in zip(times.tolist(), values.tolist())))
+                if args.stdout and received:
+                    out.flush()
+                unreported += thread.rx_queue.take_losses()[0]
+            if unreported and now - last_report >= LOSS_REPORT_SECONDS:
+                logger.warning("Dropped {} samples that were not taken in time.".format(unreported))
+                dropped += unreported
+                unreported = 0
+                last_report = now
+            if not received:
+                time.sleep(0.05)
+    except BrokenPipeError:
+        # stdout was closed by the reader, e.g. piping into head
+        pass
+    finally:
+        for thread in threads:
+            thread.runSignal = False
+            thread.rx_queue.close()
+        for thread in threads:
+            thread.join(timeout=3)
+            thread.ser.close()
+        for recorder in recorders:
+            recorder.close(timeout=10)
+        if publisher is not None:
+            publisher.stop()
+        for ring in rings:
+            ring.close()
+    dropped += unreported
+    if dropped:
+        logger.info("Recorded {} samples. {} more were dropped from the hand-off "
+                    "and are only in the session files, if any.".format(samples, dropped))
+    else:
+        logger.info("Recorded {} samples.".format(samples))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Deciding when the live graph is redrawn.
+
+Taking the samples from the readers is cheap and happens on every tick of
+the display timer, but converting them for the graph and drawing it is not.
+The RedrawScheduler collects the series that got new samples since the last
+redraw, so a redraw converts everything that came in meanwhile at once, and
+measures how long each redraw takes. The time between redraws follows from
+that cost and a budget, the fraction of the time of the GUI thread that may
+go into drawing: cheap blits of a short history come many times a second,
+and redraws of long histories come less often instead of making the window
+sluggish.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+REDRAW_BUDGET = 0.25 # fraction of the time of the GUI thread spent drawing
+REDRAW_FASTEST = 0.04 # seconds between redraws at the most (25 per second)
+REDRAW_SLOWEST = 2.0 # seconds between redraws at the least
+REDRAW_IDLE = 0.25 # seconds between ticks while nothing is drawn
+
+
+class RedrawScheduler(object):
+    '''
+    Tracks the series waiting to be redrawn and when the next redraw is due.
+    The cost of a redraw is smoothed exponentially, so a single slow full
+    draw (after the axes were rescaled, say) does not stall the graph.
+    '''
+    def __init__(self, budget=REDRAW_BUDGET, fastest=REDRAW_FASTEST, slowest=REDRAW_SLOWEST,
+                 smoothing=0.2, clock=time.monotonic):
+        if budget <= 0:
+            raise ValueError("The redraw budget must be more than zero.")
+        self.budget = budget
+        self.fastest = fastest
+        self.slowest = slowest
+        self.smoothing = smoothing
+        self.clock = clock
+        # (name, whether it holds filtered loads) of the series with new samples
+        self.pending = set()
+        self.cost = None
+        self.interval = fastest
+        self.last_redraw = None
+
+    def add(self, name, filtered=False):
+        self.pending.add((name, filtered))
+
+    def due(self):
+        ''' Whether there is something to redraw and the interval since the last redraw is over. '''
+        if not self.pending:
+            return False
+        return self.last_redraw is None or self.clock() - self.last_redraw >= self.interval
+
+    def take(self):
+        ''' The waiting series, which are no longer waiting afterwards. '''
+        pending = self.pending
+        self.pending = set()
+        return pending
+
+    def observe(self, seconds):
+        ''' Record that a redraw took seconds and work out the interval to the next one. '''
+        if self.cost is None:
+            self.cost = seconds
+        else:
+            self.cost += self.smoothing * (seconds - self.cost)
+        self.interval = min(max(self.cost / self.budget, self.fastest), self.slowest)
+        self.last_redraw = self.clock()
+
+    def next_tick(self, drawing=True):
+        '''
+        Milliseconds until the display timer should tick again: when the next
+        redraw is due, but never later than REDRAW_IDLE, so the samples are
+        still taken from the readers before their hand-off fills up. drawing
+        is False while nothing is drawn or no samples are coming in.
+        '''
+        wait = REDRAW_IDLE
+        if drawing:
+            if self.last_redraw is not None:
+                wait = min(wait, max(self.last_redraw + self.interval - self.clock(), self.fastest))
+            else:
+                wait = min(wait, self.fastest)
+        return max(int(round(1000 * wait)), 1)
@@ -0,0 +1,168 @@
+"""
+Replaying recorded sessions through the live pipeline, so filters, triggers
+and plotting can be tuned on repeatable input and a problem seen in the field
+can be reproduced at the bench.
+
+A ReplayThread takes the place of a loadcellThread: it hands its samples
+through the same filter, hand-off, publisher, shared memory and trigger
+stages, so the rest of the program can not tell the difference. It reads a
+session file (.lsr) or a CSV file exported from the graph and sends the
+samples at their original timing, some number of times faster, or as fast
+as they are taken. Replayed samples keep the spacing they were recorded
+with and are shifted to start when the replay starts, so at more than
+normal speed their times run ahead of the clock.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+import time
+import os
+
+from LoadStarSerial import loadcellThread
+from LoadStarSession import SessionReader, import_csv, RECORD_SIZE
+
+import logging
+logger = logging.getLogger(__name__)
+
+REPLAY_FASTEST = 0 # the speed that sends the samples as fast as they are taken
+REPLAY_MODES = ("original", "factor", "fastest") # see replay_speed
+REPLAY_BLOCK = 4096 # most samples handed over at once
+REPLAY_INTERVAL = 0.01 # seconds between blocks at a set speed, like serial reads
+REPLAY_WAIT = 0.1 # longest sleep, so a stop request is seen quickly
+
+
+def replay_speed(mode, factor):
+    '''
+    The speed of a ReplayThread for a mode of REPLAY_MODES: the original
+    timing, factor times faster, or as fast as possible.
+    '''
+    if mode not in REPLAY_MODES:
+        raise ValueError("Unknown replay mode {}".format(mode))
+    return {"original": 1.0, "factor": factor, "fastest": REPLAY_FASTEST}[mode]
+
+
+class Recording(object):
+    '''
+    The samples of one load cell in a recorded file. It stands in for the
+    serial port of a reader, so port is the file it came from.
+    '''
+    def __init__(self, path, name, times, values):
+        self.port = path
+        self.baudrate = None
+        self.name = name
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+    def duration(self):
+        if len(self.times) < 2:
+            return 0.0
+        return float(self.times[-1] - self.times[0])
+
+    def close(self):
+        pass
+
+
+def read_recordings(path):
+    '''
+    The Recordings in a session file, which holds one load cell, or in a CSV
+    file from the graph, which holds one for each series in it. Raises
+    SessionFormatError, ValueError or OSError for files that can not be read.
+    '''
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    if path.lower().endswith(".csv"):
+        return [Recording(path, label or base_name, times, values)
+                for label, times, values in import_csv(path)]
+    # Only the samples are needed, not the summary pyramid for the graph
+    session = SessionReader(path, build_pyramid=False)
+    name = session.metadata.get("Name") or base_name
+    return [Recording(path, name, session.times, session.values)]
+
+
+class ReplayThread(loadcellThread):
+    '''
+    Sends the samples of a Recording as if they were read from a load cell.
+    speed is a factor of the original timing, or REPLAY_FASTEST. With loop
+    set the recording starts over at the end until the thread is stopped.
+    '''
+    replay = True
+
+    def __init__(self, rx_queue, recording, recorder=None, name=None, clock_anchor=None,
+                 trigger=None, event_queue=None, filter=None, publisher=None, shared=None,
+                 stats=None, speed=1.0, loop=False, block=REPLAY_BLOCK):
+        if speed < 0:
+            raise ValueError("The replay speed can not be negative.")
+        loadcellThread.__init__(self, rx_queue, recording, recorder, name or recording.name,
+                                clock_anchor, trigger, event_queue, filter, publisher, shared, stats)
+        self.recording = recording
+        self.speed = speed
+        self.loop = loop
+        self.block = block
+        # Samples sent so far and whether the end of the recording was reached
+        self.replayed = 0
+        self.finished = False
+
+    def describe(self):
+        if self.speed == REPLAY_FASTEST:
+            return "as fast as possible"
+        if self.speed == 1:
+            return "at the original timing"
+        return "at {:g} times the original speed".format(self.speed)
+
+    def run(self):
+        times = self.recording.times
+        values = self.recording.values
+        count = len(times)
+        if count == 0:
+            logger.info("{} has no samples to replay.".format(self.recording.port))
+            self.finished = True
+            return
+        logger.info("Replaying {} samples of {} {}.".format(count, self.name, self.describe()))
+        first = float(times[0])
+        # A loop starts over one sample period after the last sample
+        period = float(np.median(np.diff(times[:1000]))) if count > 1 else 0.0
+        span = float(times[-1]) - first + period
+        speed = self.speed
+        start = began = self.clock.now()
+        # Where the recording starts on the time base of the live readers
+        offset = self.clock.wall(start) - first
+        position = 0
+        while self.runSignal:
+            if position >= count:
+                if not self.loop:
+                    self.finished = True
+                    break
+                position = 0
+                offset += span
+                if speed != REPLAY_FASTEST:
+                    start += span / speed
+            if speed == REPLAY_FASTEST:
+                end = min(position + self.block, count)
+            else:
+                due = first + (self.clock.now() - start) * speed
+                end = min(int(np.searchsorted(times, due, 'right')), position + self.block)
+                if end <= position:
+                    # Nothing is due yet. Sleep until the next sample is.
+                    wait = (float(times[position]) - due) / speed
+                    time.sleep(min(max(wait, REPLAY_INTERVAL), REPLAY_WAIT))
+                    continue
+            block_values = np.array(values[position:end], dtype=np.float64)
+            self.deliver(times[position:end] + offset, block_values)
+            sent = end - position
+            self.replayed += sent
+            self.lines_read += sent
+            self.bytes_read += sent * RECORD_SIZE
+            position = end
+            if speed != REPLAY_FASTEST and sent < self.block:
+                # Caught up, so let the next samples come due
+                time.sleep(REPLAY_INTERVAL)
+        elapsed = max(self.clock.now() - began, 1e-9)
+        logger.info("Replayed {} samples of {} in {:.3f} s ({:.0f} samples/s).".format(
+            self.replayed, self.name, elapsed, self.replayed / elapsed))
@@ -0,0 +1,331 @@
+"""
+Connecting to iLoad Pro load cells and reading their samples. This is the
+acquisition core shared by the GUI and the headless recorder, so it has no
+Qt or matplotlib dependencies.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+import threading
+import traceback
+import time
+import serial
+
+from LoadStarSimulator import SimulatedLoadCell, is_simulator_url
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def start_load_cell(ser):
+    '''
+    Put an open load cell port into streaming mode. Returns the
+    identification sentence of the device, or an empty string if nothing
+    answered.
+    '''
+    ser.write("CT0\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    ser.readline()
+    time.sleep(.1)
+    ser.write("SS1\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    test_sentence = ser.readline().decode('ascii','ignore').strip()
+    if len(test_sentence) == 0:
+        return test_sentence
+    logger.info("Connected to {}".format(test_sentence))
+    #ser.write("CPS 32\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    #ser.readline()
+    ser.write("CSS 5\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    ser.readline()
+    ser.write("CLA 1\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    ser.readline()
+    ser.write("O0W0\r".encode('ascii')) # see http://www.loadstarsensors.com/assets/manuals/html/iload_commmand_set.html
+    return test_sentence
+
+
+def open_load_cell(comport, baud, timeout=2):
+    '''
+    Open a port and start the load cell on it streaming. Returns the open 
+    serial port, or None if no load cell answered. Errors opening the port
+    are raised as serial.SerialException. A sim:// URL opens a simulated
+    load cell (see LoadStarSimulator).
+    '''
+    logger.debug("Trying to connect load_cell on {}.".format(comport))
+    if is_simulator_url(comport):
+        ser = SimulatedLoadCell(comport, baudrate=int(baud), timeout=timeout)
+    else:
+        ser = serial.serial_for_url(comport, baudrate=int(baud), timeout=timeout)
+    try:
+        identity = start_load_cell(ser)
+    except:
+        ser.close()
+        raise
+    if not identity:
+        logger.debug("Could not find load cell connection on {}".format(comport))
+        ser.close()
+        return None
+    logger.info("Successful load cell connection on {}".format(comport))
+    return ser
+
+
+class LineSplitter(object):
+    '''
+    Splits an arbitrary sequence of byte chunks into complete lines. A line
+    that is cut off at the end of a read is held back until the rest of it
+    arrives with the next one.
+    '''
+    def __init__(self, terminator=b'\n'):
+        self.terminator = terminator
+        self.partial = b''
+
+    def feed(self, data):
+        ''' Returns a list of the complete lines in data, without terminators. '''
+        if not data:
+            return []
+        lines = (self.partial + data).split(self.terminator)
+        self.partial = lines.pop()
+        return lines
+
+    def reset(self):
+        self.partial = b''
+
+
+def parse_loads(lines, scale=1000.0):
+    '''
+    Convert a batch of raw load cell lines to an array of loads. The first
+    character of each line is not part of the number and the raw counts are
+    divided by scale. Lines that are not numbers are dropped.
+    Returns (values, number of lines that failed to parse).
+    '''
+    payloads = [line[1:] for line in lines]
+    try:
+        # One pass over the whole batch if every line is well formed
+        values = np.array(payloads, dtype=np.float64)
+    except ValueError:
+        good = []
+        for payload in payloads:
+            try:
+                good.append(float(payload))
+            except ValueError:
+                pass
+        values = np.array(good, dtype=np.float64)
+    return values / scale, len(payloads) - len(values)
+
+
+class SampleClock(object):
+    '''
+    Assigns timestamps to batches of samples based on when the batches
+    arrived.
+
+    The monotonic clock is anchored to wall time once, so timestamps never
+    jump when the system clock is adjusted. The sample period of the device
+    is estimated with an exponentially weighted linear fit of arrival time
+    against the running sample count. Samples within a batch are spaced by
+    that period and continue on from the previous batch. The difference
+    between where this puts a batch and where the fit says it should be is
+    slewed out a little with every batch, so the clock follows drift of the
+    device oscillator without jumping. If a batch arrives much later than the
+    period predicts (the device stopped sending or data was lost) a gap is
+    counted and the timestamps restart from the arrival time.
+
+    Clocks that are given the same anchor, a (wall time, monotonic time)
+    pair, put their samples on the same time base.
+    '''
+    def __init__(self, nominal_period=None, forgetting=0.99, gain=0.1, 
+                 gap_threshold=0.5, clock=time.monotonic, anchor=None):
+        self.clock = clock
+        if anchor is None:
+            anchor = (time.time(), clock())
+        self.wall_anchor, self.mono_anchor = anchor
+        self.nominal_period = nominal_period
+        self.forgetting = forgetting
+        self.gain = gain
+        self.gap_threshold = gap_threshold
+        self.gaps = 0
+        self.reset()
+
+    def reset(self):
+        ''' Start over with a new fit, for example after a reconnect. '''
+        self.period = self.nominal_period
+        self.samples = 0
+        self.last_stamp = None
+        self.last_arrival = self.clock()
+        self.restart_fit()
+
+    def restart_fit(self):
+        self.weight = 0.0
+        self.mean_n = 0.0
+        self.mean_t = 0.0
+        self.var_n = 0.0
+        self.cov_nt = 0.0
+        self.fit_points = 0
+
+    def now(self):
+        ''' The current reading of the monotonic clock. '''
+        return self.clock()
+
+    def wall(self, mono):
+        ''' Convert a monotonic clock reading (or array of them) to Unix time. '''
+        return self.wall_anchor + (mono - self.mono_anchor)
+
+    def update_fit(self, n, t):
+        ''' Add the point (sample count, arrival time) to the weighted fit. '''
+        self.weight = self.forgetting * self.weight + 1
+        dn = n - self.mean_n
+        dt = t - self.mean_t
+        self.mean_n += dn / self.weight
+        self.mean_t += dt / self.weight
+        self.var_n = self.forgetting * self.var_n + dn * (n - self.mean_n)
+        self.cov_nt = self.forgetting * self.cov_nt + dn * (t - self.mean_t)
+        self.fit_points += 1
+        if self.fit_points >= 3 and self.var_n > 0 and self.cov_nt > 0:
+            self.period = self.cov_nt / self.var_n
+
+    def stamp(self, count, arrival=None):
+        '''
+        Timestamps (Unix time) for a batch of count samples whose last sample
+        arrived at the monotonic time arrival (default: now).
+        '''
+        if arrival is None:
+            arrival = self.clock()
+        if count <= 0:
+            return np.empty(0)
+        self.samples += count
+        self.update_fit(self.samples, arrival)
+        steps = np.arange(1, count + 1)
+
+        if self.period is None or self.last_stamp is None:
+            if self.period is None:
+                # No estimate yet, so spread the batch since the last arrival
+                step = (arrival - self.last_arrival) / count
+            else:
+                step = self.period
+            stamps = arrival - step * (count - steps)
+        else:
+            expected = self.last_stamp + self.period * count
+            if arrival - expected > self.gap_threshold:
+                self.gaps += 1
+                logger.debug("Gap of {:.3f} s in the sample stream.".format(arrival - expected))
+                self.restart_fit()
+                self.update_fit(self.samples, arrival)
+                stamps = arrival - self.period * (count - steps)
+            else:
+                fit = self.mean_t + self.period * (self.samples - self.mean_n)
+                step = self.period - self.gain * (expected - fit) / count
+                step = max(step, 0.5 * self.period)
+                if self.last_stamp + step * count > arrival:
+                    # A sample can not have been taken after it arrived
+                    step = max(arrival - self.last_stamp, 0) / count
+                stamps = self.last_stamp + step * steps
+
+        self.last_stamp = stamps[-1]
+        self.last_arrival = arrival
+        return self.wall(stamps)
+
+
+class loadcellThread(threading.Thread):
+    '''This thread is designed to receive messages from a load_cell,
+       using the MicroPyload_cell https://github.com/inmcm/micropyload_cell
+    '''
+    # Whether the samples come from a recording (see LoadStarReplay)
+    replay = False
+
+    def __init__(self, rx_queue, serial_port, recorder=None, name="Load", clock_anchor=None,
+                 trigger=None, event_queue=None, filter=None, publisher=None, shared=None,
+                 stats=None):
+        threading.Thread.__init__(self)
+        self.rx_queue = rx_queue
+        self.ser = serial_port
+        self.recorder = recorder
+        # A FilterChain (see LoadStarFilter). The filtered loads are handed
+        # over next to the raw ones, which are what gets recorded.
+        self.filter = filter
+        # The RollingStats of the load, updated here so they see every
+        # sample, even those dropped on the way to the display
+        self.stats = stats
+        # A Publisher that serves the samples to other programs, and a
+        # SharedRing that holds the newest of them in shared memory
+        self.publisher = publisher
+        self.shared = shared
+        # A TriggerEngine that sees every sample, and where its events go
+        self.trigger = trigger
+        self.event_queue = event_queue
+        self.name = name
+        self.runSignal = True
+        self.message = None
+        self.splitter = LineSplitter()
+        self.clock = SampleClock(anchor=clock_anchor)
+
+        # Counters for the throughput display. Only this thread writes them.
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.parse_failures = 0
+        self.rate_time = time.time()
+        self.rate_bytes = 0
+        self.rate_lines = 0
+        
+        logger.debug("Started load_cellThread on {}".format(self.ser.port))
+
+    def run(self):
+        self.clock.reset()
+        while self.runSignal:
+            try:
+                # Take everything the driver has buffered. When nothing is
+                # waiting this blocks for one byte (up to the port timeout).
+                data = self.ser.read(max(self.ser.in_waiting, 1))
+            except:
+                logger.debug("Error within load_cell Read Thread.")
+                logger.debug(traceback.format_exc())
+                break
+            arrival = self.clock.now()
+            if not data:
+                continue
+            self.bytes_read += len(data)
+            lines = self.splitter.feed(data)
+            if not lines:
+                continue
+            values, failures = parse_loads(lines)
+            self.lines_read += len(lines)
+            self.parse_failures += failures
+            if len(values):
+                self.deliver(self.clock.stamp(len(values), arrival), values)
+            
+        logger.debug("load_cell Receive Thread is finished.")
+
+    def deliver(self, times, values):
+        ''' Pass a block of stamped samples through the filter and on to everyone who takes them. '''
+        stage = self.filter
+        filtered = stage.process(values) if stage is not None else None
+        stats = self.stats
+        if stats is not None:
+            stats.update(times, values)
+        self.rx_queue.put((self.name, times, values, filtered))
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(times, values)
+        publisher = self.publisher
+        if publisher is not None:
+            publisher.publish(self.name, times, values)
+        shared = self.shared
+        if shared is not None:
+            shared.write(times, values)
+        trigger = self.trigger
+        if trigger is not None:
+            for event in trigger.process(times, values):
+                self.event_queue.put(event)
+
+    def throughput(self):
+        ''' Returns (bytes/s, lines/s) since the last call. '''
+        now = time.time()
+        elapsed = max(now - self.rate_time, 1e-9)
+        bytes_read = self.bytes_read
+        lines_read = self.lines_read
+        rates = ((bytes_read - self.rate_bytes) / elapsed, 
+                 (lines_read - self.rate_lines) / elapsed)
+        self.rate_time = now
+        self.rate_bytes = bytes_read
+        self.rate_lines = lines_read
+        return rates
@@ -0,0 +1,749 @@
+"""
+Recorded session files for the LoadStar logger.
+
+A session file starts with a fixed size header (magic, version, creation time
+and a JSON metadata block) followed by an append-only array of fixed-width
+records, each a little-endian float64 Unix timestamp and a float64 load.
+Because every record has the same size, sample i is always at
+HEADER_SIZE + i * RECORD_SIZE, a file cut short by a crash only loses its
+last partial record, and the samples can be memory-mapped as a numpy array.
+
+Next to the data file is an index file (the same name plus ".idx") with one
+entry per span of samples made durable at once (see SessionRecorder): the
+first sample index, the number of samples, a CRC32 of the span's bytes and
+the first and last timestamps.
+
+The session also carries a pyramid of summary levels, one file per level
+(the same name plus ".p1", ".p2", ...). Each bucket of level 1 summarizes 
+PYRAMID_FANOUT samples and each bucket of level k summarizes PYRAMID_FANOUT 
+buckets of level k-1 with the first and last time, minimum, maximum, mean 
+and count. The pyramid is written along with the data and rebuilt from the
+data when it is missing or out of date.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+import threading
+import queue
+import struct
+import json
+import csv
+import time
+import zlib
+import os
+import traceback
+
+from LoadStarData import visible_range, minmax_indices
+
+import logging
+logger = logging.getLogger(__name__)
+
+SESSION_MAGIC = b'LSTRSES1'
+SESSION_VERSION = 1
+SESSION_EXTENSION = ".lsr"
+HEADER_SIZE = 4096
+HEADER_FORMAT = '<8sHHId'
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('value', '<f8')])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+INDEX_MAGIC = b'LSTRIDX1'
+INDEX_EXTENSION = ".idx"
+INDEX_ENTRY_FORMAT = '<QIIdd'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+INDEX_SPAN_BYTES = 2**20 # data bytes after which an index entry is written before the sync
+
+PYRAMID_MAGIC = b'LSTRPYR1'
+PYRAMID_HEADER_FORMAT = '<8sII'
+PYRAMID_HEADER_SIZE = struct.calcsize(PYRAMID_HEADER_FORMAT)
+PYRAMID_FANOUT = 16
+PYRAMID_MAX_LEVELS = 10
+PYRAMID_TEMPORARY = ".tmp" # added to the level files while they are rebuilt
+PYRAMID_DTYPE = np.dtype([('t_first', '<f8'), ('t_last', '<f8'), 
+                          ('min', '<f8'), ('max', '<f8'), 
+                          ('mean', '<f8'), ('count', '<f8')])
+
+
+# Session files a SessionRecorder of this process is writing, by absolute path
+recording_paths = set()
+
+
+class SessionFormatError(Exception):
+    pass
+
+
+def make_header(metadata, created=None):
+    ''' The HEADER_SIZE bytes that start a session file. '''
+    if created is None:
+        created = time.time()
+    fixed = struct.pack(HEADER_FORMAT, SESSION_MAGIC, SESSION_VERSION,
+                        RECORD_SIZE, HEADER_SIZE, created)
+    meta = json.dumps(metadata).encode('utf8')
+    if len(fixed) + len(meta) > HEADER_SIZE:
+        raise ValueError("Session metadata is too large for the header.")
+    return fixed + meta + b'\0' * (HEADER_SIZE - len(fixed) - len(meta))
+
+
+def read_header(file_obj):
+    ''' Returns (created time, metadata dictionary) from an open session file. '''
+    file_obj.seek(0)
+    header = file_obj.read(HEADER_SIZE)
+    fixed_size = struct.calcsize(HEADER_FORMAT)
+    if len(header) < fixed_size:
+        raise SessionFormatError("File is too short to be a session file.")
+    magic, version, record_size, header_size, created = struct.unpack(
+        HEADER_FORMAT, header[:fixed_size])
+    if magic != SESSION_MAGIC:
+        raise SessionFormatError("File is not a LoadStar session file.")
+    if version > SESSION_VERSION or record_size != RECORD_SIZE or header_size != HEADER_SIZE:
+        raise SessionFormatError("Unsupported session file version {}.".format(version))
+    meta = header[fixed_size:].rstrip(b'\0')
+    metadata = json.loads(meta.decode('utf8')) if meta else {}
+    return created, metadata
+
+
+def index_path(path):
+    return path + INDEX_EXTENSION
+
+
+def read_index(path):
+    ''' The index entries of a session as a list of (first, count, crc, t_first, t_last). '''
+    try:
+        with open(index_path(path), 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        return []
+    if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return []
+    data = data[len(INDEX_MAGIC):]
+    complete = len(data) - len(data) % INDEX_ENTRY_SIZE
+    return list(struct.iter_unpack(INDEX_ENTRY_FORMAT, data[:complete]))
+
+
+def recover_session(path):
+    '''
+    Make a session file consistent after a crash. A trailing partial record
+    is cut off, index entries for samples that are not in the file are
+    dropped, and samples that made it to disk without an index entry get
+    one. Returns the number of complete samples in the file.
+    '''
+    with open(path, 'r+b') as data_file:
+        read_header(data_file)
+        size = os.fstat(data_file.fileno()).st_size
+        samples = (size - HEADER_SIZE) // RECORD_SIZE
+        if HEADER_SIZE + samples * RECORD_SIZE != size:
+            logger.info("Cutting off a partial record at the end of {}".format(path))
+            data_file.truncate(HEADER_SIZE + samples * RECORD_SIZE)
+
+        entries = [entry for entry in read_index(path) if entry[0] + entry[1] <= samples]
+        indexed = entries[-1][0] + entries[-1][1] if entries else 0
+        if indexed < samples:
+            data_file.seek(HEADER_SIZE + indexed * RECORD_SIZE)
+            chunk = data_file.read((samples - indexed) * RECORD_SIZE)
+            records = np.frombuffer(chunk, dtype=RECORD_DTYPE)
+            entries.append((indexed, len(records), zlib.crc32(chunk) & 0xffffffff,
+                            records['time'][0], records['time'][-1]))
+            logger.info("Recovered {} unindexed samples in {}".format(len(records), path))
+
+    with open(index_path(path), 'wb') as index_file:
+        index_file.write(INDEX_MAGIC)
+        for entry in entries:
+            index_file.write(struct.pack(INDEX_ENTRY_FORMAT, *entry))
+    return samples
+
+
+def pyramid_path(path, level):
+    return "{}.p{}".format(path, level)
+
+
+def reduce_buckets(buckets, fanout):
+    ''' Combine each run of fanout buckets into one. len(buckets) must be a multiple of fanout. '''
+    groups = buckets.reshape(-1, fanout)
+    reduced = np.empty(len(groups), dtype=PYRAMID_DTYPE)
+    reduced['t_first'] = groups['t_first'][:, 0]
+    reduced['t_last'] = groups['t_last'][:, -1]
+    reduced['min'] = groups['min'].min(axis=1)
+    reduced['max'] = groups['max'].max(axis=1)
+    reduced['count'] = groups['count'].sum(axis=1)
+    reduced['mean'] = (groups['mean'] * groups['count']).sum(axis=1) / reduced['count']
+    return reduced
+
+
+def samples_as_buckets(times, values):
+    ''' Single sample buckets, so raw samples can be handled like pyramid levels. '''
+    buckets = np.empty(len(times), dtype=PYRAMID_DTYPE)
+    buckets['t_first'] = times
+    buckets['t_last'] = times
+    buckets['min'] = values
+    buckets['max'] = values
+    buckets['mean'] = values
+    buckets['count'] = 1
+    return buckets
+
+
+class PyramidBuilder(object):
+    '''
+    Builds the summary pyramid of a session incrementally. Samples are fed
+    in with append() as they are written; complete buckets go to the level
+    files and the incomplete remainder of each level is held until more data
+    arrives. The level files are always started from scratch, under the
+    name plus suffix if one is given (see commit). With in_memory set the
+    buckets are kept in memory instead of files (see levels).
+    '''
+    def __init__(self, path, fanout=PYRAMID_FANOUT, max_levels=PYRAMID_MAX_LEVELS,
+                 suffix="", in_memory=False):
+        self.path = path
+        self.fanout = fanout
+        self.max_levels = max_levels
+        self.suffix = suffix
+        self.in_memory = in_memory
+        # pending[0] holds raw samples, pending[k] holds buckets of level k
+        self.pending = [samples_as_buckets(np.empty(0), np.empty(0))] * (max_levels + 1)
+        self.files = {}
+        # Lists of the bucket arrays of each level, when in memory
+        self.memory = {}
+
+    def append(self, times, values):
+        self.add_buckets(0, samples_as_buckets(times, values))
+
+    def add_buckets(self, level, buckets):
+        if level > 0 and self.in_memory:
+            self.memory.setdefault(level, []).append(buckets)
+        elif level > 0:
+            level_file = self.files.get(level)
+            if level_file is None:
+                level_file = open(pyramid_path(self.path, level) + self.suffix, 'wb')
+                level_file.write(struct.pack(PYRAMID_HEADER_FORMAT, PYRAMID_MAGIC, 
+                                             self.fanout, level))
+                self.files[level] = level_file
+            level_file.write(buckets.tobytes())
+        if level == self.max_levels:
+            return
+        pending = np.concatenate((self.pending[level], buckets))
+        complete = len(pending) - len(pending) % self.fanout
+        self.pending[level] = pending[complete:]
+        if complete:
+            self.add_buckets(level + 1, reduce_buckets(pending[:complete], self.fanout))
+
+    def rebuild(self, records, chunk_size=1 << 20):
+        ''' Build the pyramid from existing records, a chunk at a time. '''
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            self.append(chunk['time'], chunk['value'])
+
+    def flush(self, sync=False):
+        for level_file in self.files.values():
+            level_file.flush()
+            if sync:
+                os.fsync(level_file.fileno())
+
+    def close(self):
+        for level_file in self.files.values():
+            level_file.close()
+        self.files = {}
+
+    def commit(self):
+        '''
+        Close the level files written under a suffix and rename them to
+        their real names, removing level files above the ones that were
+        built. Raises OSError if a file can not be replaced, for example
+        because another program has it open on Windows.
+        '''
+        levels = sorted(self.files)
+        self.close()
+        for level in levels:
+            os.replace(pyramid_path(self.path, level) + self.suffix, pyramid_path(self.path, level))
+        level = len(levels) + 1
+        while os.path.exists(pyramid_path(self.path, level)):
+            os.remove(pyramid_path(self.path, level))
+            level += 1
+
+    def discard(self):
+        ''' Close and remove the level files written under a suffix. '''
+        levels = sorted(self.files)
+        self.close()
+        for level in levels:
+            try:
+                os.remove(pyramid_path(self.path, level) + self.suffix)
+            except OSError:
+                pass
+
+    def levels(self):
+        ''' The pyramid built in memory, in the form read_pyramid returns. '''
+        levels = [None]
+        for level in sorted(self.memory):
+            levels.append(np.concatenate(self.memory[level]))
+        return levels
+
+
+def read_pyramid(path, length):
+    '''
+    Memory map the pyramid levels of a session with length samples. Returns
+    a list where entry k is the array of level k buckets (entry 0 is None),
+    or None if the pyramid is missing or does not match the data.
+    '''
+    levels = [None]
+    level = 1
+    while os.path.exists(pyramid_path(path, level)):
+        level_path = pyramid_path(path, level)
+        with open(level_path, 'rb') as level_file:
+            header = level_file.read(PYRAMID_HEADER_SIZE)
+            size = os.fstat(level_file.fileno()).st_size
+        if len(header) < PYRAMID_HEADER_SIZE:
+            # Just started by a recorder that has not flushed it yet
+            return None
+        magic, fanout, file_level = struct.unpack(PYRAMID_HEADER_FORMAT, header)
+        count = (size - PYRAMID_HEADER_SIZE) // PYRAMID_DTYPE.itemsize
+        if magic != PYRAMID_MAGIC or fanout != PYRAMID_FANOUT or file_level != level:
+            return None
+        if count != length // PYRAMID_FANOUT ** level:
+            return None
+        if count == 0:
+            break
+        levels.append(np.memmap(level_path, dtype=PYRAMID_DTYPE, mode='r',
+                                offset=PYRAMID_HEADER_SIZE, shape=(count,)))
+        level += 1
+    if length >= PYRAMID_FANOUT and len(levels) == 1:
+        return None
+    return levels
+
+
+class SessionReader(object):
+    '''
+    Read access to a recorded session through a read-only memory map. 
+    Nothing is read up front: the times and values are strided views into 
+    the map, so the operating system only pages in the parts of the file that
+    are actually looked at.
+
+    Wide windows are drawn from the coarsest pyramid level that still has at
+    least one bucket per pixel, so the cost of a view does not depend on how
+    long the recording is. A missing or stale pyramid is rebuilt on open.
+    '''
+    def __init__(self, path, build_pyramid=True):
+        self.path = path
+        with open(path, 'rb') as data_file:
+            self.created, self.metadata = read_header(data_file)
+            size = os.fstat(data_file.fileno()).st_size
+        self.length = max(size - HEADER_SIZE, 0) // RECORD_SIZE
+        if self.length > 0:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                                     offset=HEADER_SIZE, shape=(self.length,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.levels = read_pyramid(path, self.length)
+        if self.levels is None and build_pyramid:
+            self.levels = self.build_pyramid()
+        # Without a pyramid, windows with up to this many samples are reduced 
+        # exactly and larger ones are sampled with a stride.
+        self.exact_limit = 2000000
+        self.window_key = None
+        self.window_result = None
+
+    def build_pyramid(self):
+        '''
+        Rebuild a missing or stale pyramid. The level files are written under
+        temporary names and renamed into place, so a recorder appending to
+        them (the session may still be recorded, even by another program) is
+        never cut short. If this program is recording the session, or the
+        files can not be replaced, the pyramid is only kept in memory.
+        '''
+        path = self.path
+        if os.path.abspath(path) not in recording_paths:
+            logger.info("Building the summary pyramid for {}".format(path))
+            builder = PyramidBuilder(path, suffix=PYRAMID_TEMPORARY)
+            try:
+                builder.rebuild(self.records)
+                builder.commit()
+                return read_pyramid(path, self.length)
+            except OSError:
+                logger.debug(traceback.format_exc())
+                builder.discard()
+        logger.info("Summarizing {} in memory while it is recorded".format(path))
+        builder = PyramidBuilder(path, in_memory=True)
+        builder.rebuild(self.records)
+        return builder.levels()
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def times(self):
+        return self.records['time']
+
+    @property
+    def values(self):
+        return self.records['value']
+
+    def time_range(self):
+        if self.length == 0:
+            return None
+        return float(self.records[0]['time']), float(self.records[-1]['time'])
+
+    def window(self, t0, t1, pixels):
+        '''
+        The samples to plot between the Unix times t0 and t1 on an axis that
+        is pixels wide, as (times, values) arrays.
+        '''
+        key = (t0, t1, pixels)
+        if key == self.window_key:
+            return self.window_result
+        if self.length == 0 or t1 <= t0:
+            times = np.empty(0)
+            values = np.empty(0)
+        else:
+            i0, i1 = visible_range(self.times, t0, t1)
+            records = self.records[i0:i1]
+            if i1 - i0 <= 4 * pixels:
+                times = np.array(records['time'])
+                values = np.array(records['value'])
+            elif self.levels is not None and i1 - i0 > pixels * PYRAMID_FANOUT:
+                level = int(np.log(float(i1 - i0) / pixels) / np.log(PYRAMID_FANOUT))
+                level = min(level, len(self.levels) - 1)
+                buckets = self.gather(level, t0, t1)
+                # Each bucket becomes its minimum and maximum
+                times = np.column_stack((buckets['t_first'], buckets['t_last'])).ravel()
+                values = np.column_stack((buckets['min'], buckets['max'])).ravel()
+                kept, _ = minmax_indices(times, values, t0, t1, pixels)
+                times = times[kept]
+                values = values[kept]
+            elif i1 - i0 <= self.exact_limit:
+                kept, _ = minmax_indices(records['time'], records['value'], t0, t1, pixels)
+                times = records['time'][kept]
+                values = records['value'][kept]
+            else:
+                stride = (i1 - i0) // (4 * pixels)
+                records = records[::stride]
+                times = np.array(records['time'])
+                values = np.array(records['value'])
+        self.window_key = key
+        self.window_result = (times, values)
+        return self.window_result
+
+    def gather(self, level, t0, t1):
+        '''
+        The buckets of a pyramid level that cover [t0, t1]. If the window
+        reaches past the last complete bucket of the level, the rest is
+        filled in from the finer levels and finally the raw samples.
+        '''
+        buckets = self.levels[level]
+        j0, j1 = visible_range(buckets['t_first'], t0, t1)
+        pieces = [buckets[j0:j1]]
+        if j1 == len(buckets):
+            covered = len(buckets) * PYRAMID_FANOUT ** level
+            for finer in range(level - 1, 0, -1):
+                pieces.append(self.levels[finer][covered // PYRAMID_FANOUT ** finer:])
+                covered = len(self.levels[finer]) * PYRAMID_FANOUT ** finer
+            tail = self.records[covered:]
+            pieces.append(samples_as_buckets(tail['time'], tail['value']))
+        return np.concatenate(pieces)
+
+    def value_range(self):
+        ''' The (minimum, maximum) of all values, from the coarsest summary available. '''
+        if self.length == 0:
+            return None
+        if self.levels is not None and len(self.levels) > 1:
+            buckets = self.gather(len(self.levels) - 1, -np.inf, np.inf)
+            return float(buckets['min'].min()), float(buckets['max'].max())
+        values = self.values
+        return float(values.min()), float(values.max())
+
+    def close(self):
+        # The map is closed when the last view of it goes away
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.levels = None
+        self.length = 0
+        self.window_key = None
+
+
+CSV_TIME_FORMATS = ("iso", "epoch", "elapsed")
+CSV_EPOCH_HEADING = "Unix Time"
+CSV_ELAPSED_HEADING = "Elapsed Seconds from "
+
+
+def import_csv(path):
+    '''
+    Read a CSV file written by GraphDialog.export_data. The file has one or
+    more blocks separated by blank lines. Each block starts with a heading
+    row naming the time format and the label of the series, followed by
+    rows of time and value. The time is local date and time under a "Time"
+    heading, Unix time under "Unix Time", or seconds from the local date and
+    time given in an "Elapsed Seconds from <date>" heading.
+    Returns a list of (label, Unix times, values).
+    '''
+    series = []
+    block = None
+    with open(path, 'r', newline='') as csv_file:
+        for row in csv.reader(csv_file):
+            if len(row) < 2 or not row[0]:
+                continue
+            if (row[0] in ("Time", CSV_EPOCH_HEADING) or 
+                row[0].startswith(CSV_ELAPSED_HEADING)):
+                block = (row[0], row[1], [], [])
+                series.append(block)
+            elif block is not None:
+                block[2].append(row[0])
+                block[3].append(row[1])
+    result = []
+    for heading, label, stamps, values in series:
+        if heading == "Time":
+            times = local_strings_to_epoch(stamps)
+        elif heading == CSV_EPOCH_HEADING:
+            times = np.array(stamps, dtype=np.float64)
+        else:
+            start = local_strings_to_epoch([heading[len(CSV_ELAPSED_HEADING):]])[0]
+            times = start + np.array(stamps, dtype=np.float64)
+        result.append((label, times, np.array(values, dtype=np.float64)))
+    return result
+
+
+def local_strings_to_epoch(stamps):
+    '''
+    Convert local "YYYY-MM-DD HH:MM:SS.ffffff" strings to Unix times. The
+    parsing is vectorized by numpy, which treats them as UTC, and the local
+    UTC offset is taken off afterwards.
+    '''
+    if not stamps:
+        return np.empty(0)
+    naive = np.array(stamps, dtype='datetime64[us]').astype(np.int64) / 1e6
+    offsets = [time.localtime(naive[i] - time.localtime(naive[i]).tm_gmtoff).tm_gmtoff 
+               for i in (0, -1)]
+    if offsets[0] == offsets[1]:
+        return naive - offsets[0]
+    # The file spans a daylight saving change, so go row by row
+    return np.array([time.mktime(time.strptime(stamp.split('.')[0], "%Y-%m-%d %H:%M:%S")) + 
+                     (float("0." + stamp.split('.')[1]) if '.' in stamp else 0)
+                     for stamp in stamps])
+
+
+def epoch_to_local_strings(times):
+    ''' The inverse of local_strings_to_epoch, as a list of strings. '''
+    if len(times) == 0:
+        return []
+    offsets = [time.localtime(times[i]).tm_gmtoff for i in (0, -1)]
+    if offsets[0] == offsets[1]:
+        local = np.round((np.asarray(times) + offsets[0]) * 1e6).astype(np.int64)
+        stamps = np.datetime_as_string(local.astype('datetime64[us]'), unit='us')
+        return [stamp.replace('T', ' ') for stamp in stamps.tolist()]
+    return [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + 
+            "{:.6f}".format(t % 1)[1:] for t in times]
+
+
+class CSVExporter(threading.Thread):
+    '''
+    Writes series of samples to a CSV file on its own thread, chunk_size
+    rows at a time, so memory use does not depend on the length of the
+    series. The file is written under a temporary name and only renamed
+    when it is complete; cancel() stops the export and removes it.
+
+    series is a list of (label, times, values) where times are Unix times.
+    time_format is one of CSV_TIME_FORMATS: local date and time ("iso"), Unix
+    time ("epoch") or seconds since the first sample ("elapsed").
+    '''
+    def __init__(self, path, series, time_format="iso", chunk_size=100000):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        if time_format not in CSV_TIME_FORMATS:
+            raise ValueError("Unknown time format {}".format(time_format))
+        self.path = path
+        self.series = series
+        self.time_format = time_format
+        self.chunk_size = chunk_size
+        self.total = sum(len(times) for label, times, values in series)
+        self.written = 0
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def heading(self, times):
+        if self.time_format == "epoch":
+            return CSV_EPOCH_HEADING
+        if self.time_format == "elapsed":
+            start = epoch_to_local_strings(times[:1])
+            return CSV_ELAPSED_HEADING + (start[0] if start else "")
+        return "Time"
+
+    def format_times(self, times, start):
+        if self.time_format == "epoch":
+            return ["{:.6f}".format(t) for t in times.tolist()]
+        if self.time_format == "elapsed":
+            return ["{:.6f}".format(t) for t in (times - start).tolist()]
+        return epoch_to_local_strings(times)
+
+    def run(self):
+        temp_path = self.path + ".part"
+        try:
+            with open(temp_path, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                for label, times, values in self.series:
+                    writer.writerow([self.heading(times), label])
+                    start = times[0] if len(times) else 0
+                    for first in range(0, len(times), self.chunk_size):
+                        if self.cancelled:
+                            break
+                        chunk_times = np.asarray(times[first:first + self.chunk_size])
+                        chunk_values = np.asarray(values[first:first + self.chunk_size])
+                        writer.writerows(zip(self.format_times(chunk_times, start), 
+                                             chunk_values.tolist()))
+                        self.written += len(chunk_times)
+                    writer.writerows([[], []])
+            if self.cancelled:
+                os.remove(temp_path)
+                logger.info("Export to {} was cancelled.".format(self.path))
+            else:
+                os.replace(temp_path, self.path)
+                logger.info("Exported {} samples to {}".format(self.written, self.path))
+        except Exception as e:
+            self.error = e
+            logger.debug("Error within the CSV export thread.")
+            logger.debug(traceback.format_exc())
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+class SessionRecorder(threading.Thread):
+    '''
+    Appends samples to a session file on its own thread. write() only puts
+    the chunk on a queue, so a slow disk never holds up the serial reader or
+    the GUI. The worker merges whatever chunks are waiting into one write,
+    and flushes and fsyncs the data, index and pyramid files every 
+    fsync_interval seconds. The index gets one entry for the samples written
+    since the last sync, or for each INDEX_SPAN_BYTES of them, so it stays
+    small however often samples come in. If the file already exists it is
+    recovered and appended to.
+    '''
+    def __init__(self, path, metadata=None, fsync_interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.metadata = metadata if metadata is not None else {}
+        self.fsync_interval = fsync_interval
+        self.write_queue = queue.Queue()
+        self.samples_written = 0
+        self.bytes_written = 0
+        self.error = None
+        self.data_file = None
+        self.index_file = None
+        self.pyramid = None
+        # [first, count, crc, t_first, t_last] of the samples not indexed yet
+        self.index_entry = None
+        self.stop_marker = object()
+
+    def write(self, times, values):
+        ''' Queue a chunk of samples for writing. Safe to call from any thread. '''
+        if len(times):
+            self.write_queue.put((times, values))
+
+    def close(self, timeout=None):
+        ''' Write out everything queued so far and close the files. '''
+        self.write_queue.put(self.stop_marker)
+        if self.is_alive():
+            self.join(timeout)
+
+    def open_files(self):
+        recording_paths.add(os.path.abspath(self.path))
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self.samples_written = recover_session(self.path)
+            self.pyramid = PyramidBuilder(self.path)
+            with open(self.path, 'rb') as data_file:
+                read_header(data_file)
+            if self.samples_written:
+                self.pyramid.rebuild(np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', 
+                                               offset=HEADER_SIZE, 
+                                               shape=(self.samples_written,)))
+            self.data_file = open(self.path, 'ab')
+            self.index_file = open(index_path(self.path), 'ab')
+        else:
+            self.data_file = open(self.path, 'wb')
+            self.data_file.write(make_header(self.metadata))
+            self.index_file = open(index_path(self.path), 'wb')
+            self.index_file.write(INDEX_MAGIC)
+            self.pyramid = PyramidBuilder(self.path)
+        logger.info("Recording samples to {}".format(self.path))
+
+    def write_index_entry(self):
+        entry = self.index_entry
+        if entry is not None:
+            self.index_file.write(struct.pack(INDEX_ENTRY_FORMAT, entry[0], entry[1],
+                                              entry[2] & 0xffffffff, entry[3], entry[4]))
+            self.index_entry = None
+
+    def sync(self):
+        self.write_index_entry()
+        for file_obj in (self.data_file, self.index_file):
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        self.pyramid.flush(sync=True)
+
+    def write_chunks(self, chunks):
+        times = np.concatenate([chunk[0] for chunk in chunks])
+        values = np.concatenate([chunk[1] for chunk in chunks])
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+        records['time'] = times
+        records['value'] = values
+        data = records.tobytes()
+        self.data_file.write(data)
+        entry = self.index_entry
+        if entry is None:
+            self.index_entry = [self.samples_written, len(records), zlib.crc32(data),
+                                times[0], times[-1]]
+        else:
+            entry[1] += len(records)
+            entry[2] = zlib.crc32(data, entry[2])
+            entry[4] = times[-1]
+        if self.index_entry[1] * RECORD_SIZE >= INDEX_SPAN_BYTES:
+            self.write_index_entry()
+        self.samples_written += len(records)
+        self.bytes_written += len(data)
+        self.pyramid.append(times, values)
+
+    def run(self):
+        last_sync = time.time()
+        stopping = False
+        try:
+            while not stopping:
+                try:
+                    item = self.write_queue.get(timeout=self.fsync_interval)
+                except queue.Empty:
+                    item = None
+                chunks = []
+                while item is not None:
+                    if item is self.stop_marker:
+                        stopping = True
+                    else:
+                        chunks.append(item)
+                    try:
+                        item = self.write_queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                if chunks:
+                    if self.data_file is None:
+                        self.open_files()
+                    self.write_chunks(chunks)
+                now = time.time()
+                if self.data_file is not None and (stopping or now - last_sync >= self.fsync_interval):
+                    self.sync()
+                    last_sync = now
+        except Exception as e:
+            self.error = e
+            logger.debug("Error within the session recorder thread.")
+            logger.debug(traceback.format_exc())
+        finally:
+            for file_obj in (self.data_file, self.index_file):
+                if file_obj is not None:
+                    file_obj.close()
+            if self.pyramid is not None:
+                self.pyramid.close()
+            recording_paths.discard(os.path.abspath(self.path))
+        logger.debug("Session recorder for {} is finished.".format(self.path))
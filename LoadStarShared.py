@@ -0,0 +1,262 @@
+"""
+The live samples in shared memory, so analysis scripts in other processes
+can read them as they come in, without copying, files or sockets.
+
+Each load cell gets a ring of the newest samples in a shared memory block
+named after the device (see shared_name). The reader thread of the logger
+writes it; any number of other processes attach by name and get the
+newest samples as numpy views:
+
+    from LoadStarShared import SharedRing
+    ring = SharedRing.attach("loadstar_Load_1")
+    times, values, start = ring.latest(1000)
+    ...use them...
+    if not ring.valid(start):
+        ...they were overwritten while in use, read again...
+
+Layout of the block: a header of eight little-endian int64
+    0  magic            the bytes b"LSTRN01\\0"
+    1  version          1
+    2  capacity         samples in the ring
+    3  sequence         even when idle, odd while the writer is working
+    4  written          samples written so far, all complete
+    5  reserved         samples the writer has started on (written when idle)
+    6  writer pid
+    7  unused
+followed by 2 * capacity float64 Unix times and 2 * capacity float64 loads.
+Sample k is stored at k % capacity and again at k % capacity + capacity, so
+the newest samples always form one contiguous slice.
+
+The writer never waits for readers. Readers use the sequence like a
+seqlock to get a consistent written count, and the samples of a slice
+starting at sample start are intact as long as reserved - capacity <= start.
+This relies on the stores of the writer becoming visible in order, as they
+do on x86 processors.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+import threading
+import argparse
+import time
+import sys
+import os
+import re
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python before 3.8
+    shared_memory = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+SHARED_MAGIC = int.from_bytes(b"LSTRN01\0", "little")
+SHARED_VERSION = 1
+SHARED_CAPACITY = 1 << 20 # samples, 32 MB per load cell
+HEADER_FIELDS = 8
+MAGIC, VERSION, CAPACITY, SEQUENCE, WRITTEN, RESERVED, WRITER, UNUSED = range(HEADER_FIELDS)
+
+
+def shared_name(device_name):
+    ''' The name of the shared memory block of a load cell. '''
+    return "loadstar_" + re.sub(r"[^A-Za-z0-9_]+", "_", device_name).strip("_")
+
+
+class SharedRing(object):
+    '''
+    A ring of the newest samples of one load cell in shared memory. Use
+    create() in the process that writes and attach() in those that read.
+    '''
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        self.name = memory.name
+        # Keeps close() from pulling the memory out from under a write
+        self.lock = threading.Lock()
+        self.closed = False
+        self.header = np.ndarray(HEADER_FIELDS, "<i8", memory.buf)
+        if self.header[MAGIC] != SHARED_MAGIC or self.header[VERSION] != SHARED_VERSION:
+            raise ValueError("{} is not a version {} LoadStar ring.".format(self.name, SHARED_VERSION))
+        self.capacity = int(self.header[CAPACITY])
+        offset = 8 * HEADER_FIELDS
+        self.times = np.ndarray(2 * self.capacity, "<f8", memory.buf, offset)
+        self.values = np.ndarray(2 * self.capacity, "<f8", memory.buf, offset + 16 * self.capacity)
+
+    @classmethod
+    def create(cls, name, capacity=SHARED_CAPACITY):
+        '''
+        Make a new ring called name. A block left behind under the same name
+        by a program that did not exit cleanly is replaced.
+        '''
+        if shared_memory is None:
+            raise RuntimeError("Shared memory needs Python 3.8 or newer.")
+        size = 8 * HEADER_FIELDS + 32 * capacity
+        try:
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            logger.warning("Replacing the shared memory block {}.".format(name))
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray(HEADER_FIELDS, "<i8", memory.buf)
+        header[:] = 0
+        header[CAPACITY] = capacity
+        header[VERSION] = SHARED_VERSION
+        header[WRITER] = os.getpid()
+        # The magic goes in last, so nobody attaches to a half made ring
+        header[MAGIC] = SHARED_MAGIC
+        del header
+        logger.info("Sharing samples in memory as {}.".format(name))
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name):
+        ''' Open the ring called name that another process created. '''
+        if shared_memory is None:
+            raise RuntimeError("Shared memory needs Python 3.8 or newer.")
+        try:
+            memory = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 every process that opens a block tracks it
+            # and removes it when it exits, so stop that for readers. The
+            # writer's own process shares the registration, so keep it there.
+            memory = shared_memory.SharedMemory(name)
+            writer = int(np.ndarray(HEADER_FIELDS, "<i8", memory.buf)[WRITER])
+            if writer != os.getpid():
+                try:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(memory._name, "shared_memory")
+                except (ImportError, AttributeError, KeyError):
+                    pass
+        return cls(memory, False)
+
+    def write(self, times, values):
+        ''' Add a block of samples, oldest first. Only the creating process may write. '''
+        count = len(times)
+        if count == 0:
+            return
+        capacity = self.capacity
+        if count > capacity:
+            times = times[-capacity:]
+            values = values[-capacity:]
+            skipped = count - capacity
+            count = capacity
+        else:
+            skipped = 0
+        with self.lock:
+            if self.closed:
+                return
+            header = self.header
+            start = int(header[WRITTEN]) + skipped
+            header[SEQUENCE] += 1
+            header[RESERVED] = start + count
+            position = start % capacity
+            # Both copies of every sample: the block itself and its mirror
+            first = min(count, capacity - position)
+            for ring, block in ((self.times, times), (self.values, values)):
+                ring[position:position + count] = block
+                ring[position + capacity:position + capacity + first] = block[:first]
+                ring[:count - first] = block[first:]
+            header[WRITTEN] = start + count
+            header[SEQUENCE] += 1
+
+    @property
+    def written(self):
+        ''' How many samples were written so far, read consistently with the sequence. '''
+        header = self.header
+        deadline = None
+        while True:
+            sequence = int(header[SEQUENCE])
+            if sequence & 1:
+                # Writes take microseconds, so a writer that stays in one
+                # has died in the middle of it
+                if deadline is None:
+                    deadline = time.monotonic() + 1.0
+                elif time.monotonic() > deadline:
+                    raise RuntimeError("The writer of {} stopped in the middle of a write.".format(self.name))
+                time.sleep(0)
+                continue
+            written = int(header[WRITTEN])
+            if int(header[SEQUENCE]) == sequence:
+                return written
+
+    def latest(self, count):
+        '''
+        Views of the times and values of the newest count samples (fewer if
+        there are not that many yet) and the number of the first of them.
+        '''
+        end = self.written
+        count = min(count, end, self.capacity)
+        start = end - count
+        position = start % self.capacity
+        return (self.times[position:position + count],
+                self.values[position:position + count],
+                start)
+
+    def since(self, start):
+        '''
+        Views of the samples from number start to the newest, the number of
+        the first one returned, which is later than start if the ones in
+        between were already overwritten, and the number to ask for next.
+        '''
+        end = self.written
+        first = max(start, end - self.capacity)
+        times, values, first = self.latest(end - first)
+        return times, values, first, first + len(times)
+
+    def valid(self, start):
+        ''' Whether the samples from number start on have not been overwritten yet. '''
+        return int(self.header[RESERVED]) - self.capacity <= start
+
+    def close(self):
+        '''
+        Let go of the block. The creating process also removes it. Views
+        from latest() or since() must not be used afterwards.
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.times = self.values = self.header = None
+            self.memory.close()
+        if self.owner:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def main(argv=None):
+    ''' Follow a ring and print the statistics of its newest samples once a second. '''
+    parser = argparse.ArgumentParser(prog="loadstar-shared",
+                                     description="Watch the samples a LoadStar Logger shares in memory.")
+    parser.add_argument("name", help="Name of the shared memory block, e.g. loadstar_Load_1.")
+    parser.add_argument("--samples", type=int, default=1000, help="Newest samples to summarize.")
+    args = parser.parse_args(argv)
+    ring = SharedRing.attach(args.name)
+    try:
+        while True:
+            times, values, start = ring.latest(args.samples)
+            if len(values):
+                summary = "{} samples to {:.3f}: mean {:.3f}, min {:.3f}, max {:.3f} lb".format(
+                    len(values), times[-1], values.mean(), values.min(), values.max())
+                if ring.valid(start):
+                    print(summary)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+A simulated iLoad Pro load cell, so the logger can be run, tested and
+stressed without hardware.
+
+The simulator is a serial port object that answers the commands the logger
+sends (CT0, SS1, CSS, CLA and O0W0) and then streams synthetic load lines
+in real time. Anything that opens ports with open_load_cell accepts a
+simulator URL in place of a port name, for example in load_cell_setting.txt
+or on the command line of the recorder:
+
+    sim://
+    sim://?rate=1000&waveform=sine&amplitude=20&frequency=0.5&noise=0.05
+    sim://?rate=20000&spikes=0.001&malformed=0.0005&disconnect=30&seed=1
+
+Options:
+    rate        samples per second (default 100)
+    waveform    sine, square, sawtooth or constant (default sine)
+    amplitude   peak load of the waveform in lb (default 10)
+    frequency   of the waveform in Hz (default 0.2)
+    offset      load added to the waveform in lb (default 0)
+    noise       standard deviation of added Gaussian noise in lb (default 0)
+    spikes      probability that a sample is a spike (default 0)
+    spike       size of the spikes in lb (default 100)
+    malformed   probability that a line is garbled (default 0)
+    disconnect  seconds of streaming before the device drops off (default never)
+    buffer      bytes the driver buffers before old data is lost (default 1048576)
+    seed        seed for the random parts, for repeatable runs
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import urllib.parse
+import numpy as np
+import threading
+import time
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+import logging
+logger = logging.getLogger(__name__)
+
+SIMULATOR_SCHEME = "sim"
+SIMULATOR_URL = "sim://"
+SIMULATOR_IDENTITY = "iLoad Pro Simulator SN SIM0001"
+WAVEFORMS = ("sine", "square", "sawtooth", "constant")
+
+# Lines a misbehaving device or a noisy cable could produce
+MALFORMED_LINES = (b" \r\n", b" 12a45\r\n", b"\x00\x7f\r\n", b" -\r\n", b" 1.2.3\r\n")
+
+
+def is_simulator_url(port):
+    return str(port).lower().startswith(SIMULATOR_SCHEME + "://")
+
+
+class SimulatedLoadCell(SerialBase):
+    '''
+    A serial port with a simulated iLoad Pro on the other end. The options
+    are given in the port URL (see the module documentation). Samples are
+    produced at the configured rate as time passes, whether or not they are
+    read, and are lost once more than the buffer size is waiting, like on a
+    real port.
+    '''
+    DEFAULTS = {"rate": 100.0,
+                "waveform": "sine",
+                "amplitude": 10.0,
+                "frequency": 0.2,
+                "offset": 0.0,
+                "noise": 0.0,
+                "spikes": 0.0,
+                "spike": 100.0,
+                "malformed": 0.0,
+                "disconnect": None,
+                "buffer": 1 << 20,
+                "seed": None}
+
+    def __init__(self, *args, **kwargs):
+        self.options = dict(self.DEFAULTS)
+        self.lock = threading.Lock()
+        self.output = bytearray()
+        self.command = bytearray()
+        self.streaming = False
+        self.stream_start = 0.0
+        self.produced = 0
+        # Bytes per line of the lines made so far, for the samples skipped
+        # without making them (None until the first lines are made)
+        self.line_width = None
+        self.disconnected = False
+        # Counters for checking the reader
+        self.samples_sent = 0
+        self.malformed_sent = 0
+        self.bytes_lost = 0
+        super(SimulatedLoadCell, self).__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.from_url(self._port)
+        self.random = np.random.RandomState(self.options["seed"])
+        self.is_open = True
+        logger.debug("Opened simulated load cell {}".format(self._port))
+
+    def close(self):
+        self.is_open = False
+        super(SimulatedLoadCell, self).close()
+
+    def _reconfigure_port(self):
+        # The simulator runs at any baud rate
+        pass
+
+    def from_url(self, url):
+        ''' Read the options from a sim:// URL. '''
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != SIMULATOR_SCHEME:
+            raise SerialException("Expected a simulator URL like {}?rate=100, not {!r}".format(
+                SIMULATOR_URL, url))
+        try:
+            for option, values in urllib.parse.parse_qs(parts.query, True).items():
+                if option not in self.DEFAULTS:
+                    raise ValueError("unknown option {!r}".format(option))
+                if option == "waveform":
+                    if values[0] not in WAVEFORMS:
+                        raise ValueError("unknown waveform {!r}".format(values[0]))
+                    self.options[option] = values[0]
+                elif option in ("seed", "buffer"):
+                    self.options[option] = int(values[0])
+                else:
+                    self.options[option] = float(values[0])
+        except ValueError as e:
+            raise SerialException("Bad simulator URL {!r}: {}".format(url, e))
+        if self.options["rate"] <= 0:
+            raise SerialException("The simulator rate must be positive.")
+
+    def check_open(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        if self.disconnected:
+            raise SerialException("The simulated load cell was disconnected.")
+
+    def loads(self, start, count):
+        ''' The loads in lb of count samples from sample number start on. '''
+        options = self.options
+        t = np.arange(start, start + count) / options["rate"]
+        phase = options["frequency"] * t
+        waveform = options["waveform"]
+        if waveform == "sine":
+            loads = np.sin(2 * np.pi * phase)
+        elif waveform == "square":
+            loads = np.where(phase % 1 < 0.5, 1.0, -1.0)
+        elif waveform == "sawtooth":
+            loads = 2 * (phase % 1) - 1
+        else:
+            loads = np.zeros(count)
+        loads = options["offset"] + options["amplitude"] * loads
+        if options["noise"]:
+            loads += self.random.normal(0, options["noise"], count)
+        if options["spikes"]:
+            hits = np.flatnonzero(self.random.random_sample(count) < options["spikes"])
+            loads[hits] += options["spike"] * self.random.choice((-1, 1), len(hits))
+        return loads
+
+    def lines(self, loads):
+        ''' Format loads as the device does: a space and the load in thousandths. '''
+        counts = np.rint(loads * 1000).astype(np.int64).tolist()
+        lines = [b" %d\r\n" % count for count in counts]
+        if self.options["malformed"]:
+            bad = np.flatnonzero(self.random.random_sample(len(lines)) < self.options["malformed"])
+            for index in bad.tolist():
+                lines[index] = MALFORMED_LINES[self.random.randint(len(MALFORMED_LINES))]
+            self.malformed_sent += len(bad)
+        return b"".join(lines)
+
+    def produce(self):
+        ''' Add the samples that are due by now to the output. Call with the lock held. '''
+        if not self.streaming or self.disconnected:
+            return
+        options = self.options
+        elapsed = time.monotonic() - self.stream_start
+        if options["disconnect"] is not None and elapsed >= options["disconnect"]:
+            logger.debug("Simulated load cell {} disconnected.".format(self._port))
+            self.disconnected = True
+            return
+        due = int(elapsed * options["rate"])
+        count = due - self.produced
+        if count <= 0:
+            return
+        # Samples that would not fit in the buffer anyway are skipped. Their
+        # lines are not made, so they count with the width of the others.
+        width = self.line_width
+        if width is None:
+            width = len(b" %d\r\n" % -int(round((abs(options["offset"]) + abs(options["amplitude"])) * 1000)))
+        limit = max(int(options["buffer"] // width), 1)
+        if count > limit:
+            self.bytes_lost += int(round(width * (count - limit)))
+            self.produced += count - limit
+            count = limit
+        data = self.lines(self.loads(self.produced, count))
+        self.line_width = len(data) / count
+        self.output += data
+        self.produced += count
+        self.samples_sent += count
+        overflow = len(self.output) - options["buffer"]
+        if overflow > 0:
+            del self.output[:overflow]
+            self.bytes_lost += overflow
+
+    def respond(self, command):
+        ''' Act on one command from the host. Call with the lock held. '''
+        command = command.strip().upper()
+        if not command:
+            return
+        if command == b"CT0":
+            self.streaming = False
+            self.output.clear()
+            self.output += b"A\r\n"
+        elif command == b"SS1":
+            self.output += SIMULATOR_IDENTITY.encode("ascii") + b"\r\n"
+        elif command.startswith(b"CSS") or command.startswith(b"CLA"):
+            self.output += b"A\r\n"
+        elif command == b"O0W0":
+            self.streaming = True
+            self.stream_start = time.monotonic()
+            self.produced = 0
+        else:
+            self.output += b"?\r\n"
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.check_open()
+            self.produce()
+            return len(self.output)
+
+    def read(self, size=1):
+        '''
+        Read up to size bytes, waiting at most the timeout for all of them
+        to arrive, like a real port.
+        '''
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while True:
+            with self.lock:
+                self.check_open()
+                self.produce()
+                if len(self.output) >= size:
+                    break
+                if self.streaming:
+                    wait = (size - len(self.output)) / (4 * self.options["rate"])
+                else:
+                    wait = 0.01
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            time.sleep(max(min(wait, 0.01 if deadline is None else deadline - now), 1e-4))
+        with self.lock:
+            data = bytes(self.output[:size])
+            del self.output[:size]
+        return data
+
+    def write(self, data):
+        with self.lock:
+            self.check_open()
+            self.produce()
+            self.command += data
+            while b"\r" in self.command:
+                command, _, rest = bytes(self.command).partition(b"\r")
+                self.command = bytearray(rest)
+                self.respond(command)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.check_open()
+            self.output.clear()
+
+    def reset_output_buffer(self):
+        self.check_open()
+
+    def flush(self):
+        pass
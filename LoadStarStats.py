@@ -0,0 +1,241 @@
+"""
+Streaming statistics of the load: rolling mean, standard deviation, minimum,
+maximum and rate of change over time windows, and the peaks of the session.
+They are updated from each block of new samples at a constant cost per
+sample, without looking at the history again.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+from collections import deque
+import numpy as np
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def moments(t, v):
+    ''' (count, mean t, mean v, M2 t, M2 v, co-moment tv) of the samples. '''
+    n = len(v)
+    if n == 0:
+        return (0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    mean_t = t.mean()
+    mean_v = v.mean()
+    dt = t - mean_t
+    dv = v - mean_v
+    return (n, mean_t, mean_v, float(dt.dot(dt)), float(dv.dot(dv)), float(dt.dot(dv)))
+
+
+def merge_moments(a, b):
+    ''' The moments of two sets of samples together (Chan et al. / Welford). '''
+    na, nb = a[0], b[0]
+    if na == 0:
+        return b
+    if nb == 0:
+        return a
+    n = na + nb
+    dt = b[1] - a[1]
+    dv = b[2] - a[2]
+    f = na * nb / n
+    return (n, a[1] + dt * nb / n, a[2] + dv * nb / n,
+            a[3] + b[3] + dt * dt * f, a[4] + b[4] + dv * dv * f, a[5] + b[5] + dt * dv * f)
+
+
+def remove_moments(total, part):
+    ''' The moments of total without the samples of part, which it contains. '''
+    n, nb = total[0], part[0]
+    if nb == 0:
+        return total
+    na = n - nb
+    if na <= 0:
+        return (0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    mean_t = (n * total[1] - nb * part[1]) / na
+    mean_v = (n * total[2] - nb * part[2]) / na
+    dt = part[1] - mean_t
+    dv = part[2] - mean_v
+    f = na * nb / n
+    return (na, mean_t, mean_v,
+            max(total[3] - part[3] - dt * dt * f, 0.0),
+            max(total[4] - part[4] - dv * dv * f, 0.0),
+            total[5] - part[5] - dt * dv * f)
+
+
+def extreme_candidates(t, v, greater):
+    '''
+    The samples of a block that can still become the maximum (or with
+    greater False, the minimum) of a window that moves forward in time:
+    those not followed by a larger (smaller) value in the same block.
+    '''
+    if greater:
+        later = np.maximum.accumulate(v[::-1])[::-1]
+    else:
+        later = np.minimum.accumulate(v[::-1])[::-1]
+    keep = np.empty(len(v), dtype=bool)
+    keep[-1] = True
+    if greater:
+        keep[:-1] = v[:-1] > later[1:]
+    else:
+        keep[:-1] = v[:-1] < later[1:]
+    return zip(t[keep].tolist(), v[keep].tolist())
+
+
+class RollingWindow(object):
+    '''
+    Statistics of the samples of the last seconds.
+
+    The mean, variance and the slope of a least squares line (the rate of
+    change) come from running moments. Blocks are merged into them when
+    they arrive and taken out again when they expire. The minimum and
+    maximum are kept in monotonic deques. Every sample enters and leaves
+    once, so the cost per sample is constant no matter how long the window.
+    '''
+    def __init__(self, seconds, origin=0.0):
+        self.seconds = seconds
+        self.origin = origin
+        self.reset()
+
+    def reset(self):
+        self.blocks = deque()
+        self.moments = moments(np.empty(0), np.empty(0))
+        self.maxima = deque()
+        self.minima = deque()
+        # Samples merged in and out since the moments were last recomputed
+        self.churn = 0
+
+    def update(self, times, values):
+        ''' Add a block of samples, oldest first, and expire what is too old. '''
+        if len(values) == 0:
+            return
+        t = times - self.origin
+        block = (t, values, moments(t, values))
+        self.blocks.append(block)
+        self.moments = merge_moments(self.moments, block[2])
+        for sample in extreme_candidates(t, values, True):
+            while self.maxima and self.maxima[-1][1] <= sample[1]:
+                self.maxima.pop()
+            self.maxima.append(sample)
+        for sample in extreme_candidates(t, values, False):
+            while self.minima and self.minima[-1][1] >= sample[1]:
+                self.minima.pop()
+            self.minima.append(sample)
+        self.churn += len(values)
+        self.expire(t[-1] - self.seconds)
+
+    def expire(self, cutoff):
+        while self.blocks and self.blocks[0][0][-1] <= cutoff:
+            block = self.blocks.popleft()
+            self.moments = remove_moments(self.moments, block[2])
+            self.churn += len(block[1])
+        if self.blocks and self.blocks[0][0][0] <= cutoff:
+            t, v = self.blocks[0][:2]
+            start = int(np.searchsorted(t, cutoff, 'right'))
+            kept = (t[start:], v[start:], moments(t[start:], v[start:]))
+            self.blocks[0] = kept
+            self.moments = remove_moments(self.moments, moments(t[:start], v[:start]))
+            self.churn += start
+        for extremes in (self.maxima, self.minima):
+            while extremes and extremes[0][0] <= cutoff:
+                extremes.popleft()
+        count = self.moments[0]
+        if self.churn > 4 * count + 1024:
+            # Taking samples out again slowly loses precision, so start over
+            # from the blocks once in a while (amortized constant cost).
+            self.moments = moments(np.empty(0), np.empty(0))
+            for block in self.blocks:
+                self.moments = merge_moments(self.moments, block[2])
+            self.churn = 0
+
+    @property
+    def count(self):
+        return self.moments[0]
+
+    @property
+    def mean(self):
+        return self.moments[2] if self.count else None
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return (self.moments[4] / (self.count - 1)) ** 0.5
+
+    @property
+    def max(self):
+        return self.maxima[0][1] if self.maxima else None
+
+    @property
+    def min(self):
+        return self.minima[0][1] if self.minima else None
+
+    @property
+    def slope(self):
+        ''' Rate of change in units per second, from a least squares line. '''
+        if self.count < 2 or self.moments[3] <= 0:
+            return None
+        return self.moments[5] / self.moments[3]
+
+
+class RollingStats(object):
+    '''
+    The statistics of one load cell: the latest sample, a RollingWindow for
+    each of the window lengths in seconds, and the highest and lowest load
+    of the session with when they happened. The reader thread updates them
+    while the display reads them, so readers hold lock while they look.
+    '''
+    def __init__(self, windows=(1.0, 10.0, 60.0)):
+        self.window_lengths = tuple(windows)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.windows = None
+            self.count = 0
+            self.current = None
+            self.current_time = None
+            self.peak = None
+            self.peak_time = None
+            self.valley = None
+            self.valley_time = None
+
+    def update(self, times, values):
+        ''' Add a block of samples, oldest first. times are Unix times. '''
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        with self.lock:
+            if self.windows is None:
+                # Times are kept relative to the first sample for precision
+                self.windows = [RollingWindow(seconds, times[0]) for seconds in self.window_lengths]
+            for window in self.windows:
+                window.update(times, values)
+            self.count += len(values)
+            self.current = float(values[-1])
+            self.current_time = float(times[-1])
+            index = int(np.argmax(values))
+            if self.peak is None or values[index] > self.peak:
+                self.peak = float(values[index])
+                self.peak_time = float(times[index])
+            index = int(np.argmin(values))
+            if self.valley is None or values[index] < self.valley:
+                self.valley = float(values[index])
+                self.valley_time = float(times[index])
+
+    def window(self, seconds):
+        ''' The RollingWindow of the given length, or None before the first sample. '''
+        if self.windows is None:
+            return None
+        return self.windows[self.window_lengths.index(seconds)]
+
+    @property
+    def rate(self):
+        ''' Rate of change over the shortest window, in units per second. '''
+        if self.windows is None:
+            return None
+        return self.windows[0].slope
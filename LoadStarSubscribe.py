@@ -0,0 +1,120 @@
+"""
+A reference client for the samples served by a LoadStar Publisher (see
+LoadStarPublish for the frame layout). It prints name,unix_time,load rows
+like the recorder and reports lost samples on stderr.
+
+    python LoadStarSubscribe.py tcp://127.0.0.1:5750
+    python LoadStarSubscribe.py udp://192.168.1.20:5750 --duration 10
+
+Other Python programs can use subscribe() to get the frames.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import argparse
+import socket
+import time
+import sys
+
+from LoadStarPublish import parse_address, decode_frame, SUBSCRIPTION_SECONDS
+
+
+def subscribe(url, timeout=1.0):
+    '''
+    Connect to the publisher at url and yield the Frames it sends. None is
+    yielded whenever nothing arrived for timeout seconds, so the caller can
+    stop.
+    '''
+    protocol, host, port = parse_address(url)
+    if protocol == "tcp":
+        sock = socket.create_connection((host, port))
+        sock.settimeout(timeout)
+        data = bytearray()
+        try:
+            while True:
+                try:
+                    received = sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not received:
+                    return
+                data += received
+                offset = 0
+                while True:
+                    frame, offset = decode_frame(data, offset)
+                    if frame is None:
+                        break
+                    yield frame
+                del data[:offset]
+        finally:
+            sock.close()
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(timeout)
+        subscribed = None
+        try:
+            while True:
+                if subscribed is None or time.monotonic() - subscribed > SUBSCRIPTION_SECONDS / 3:
+                    sock.sendto(b"subscribe", (host, port))
+                    subscribed = time.monotonic()
+                try:
+                    datagram = sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                frame, offset = decode_frame(datagram)
+                if frame is not None:
+                    yield frame
+        finally:
+            try:
+                sock.sendto(b"unsubscribe", (host, port))
+            except OSError:
+                pass
+            sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="loadstar-subscribe",
+                                     description="Print the samples served by the LoadStar Logger.")
+    parser.add_argument("url", nargs="?", default="tcp://127.0.0.1:5750",
+                        help="tcp://HOST:PORT or udp://HOST:PORT of the publisher.")
+    parser.add_argument("--duration", type=float, default=None, metavar="SECONDS",
+                        help="Stop after this many seconds.")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    expected = {}
+    samples = 0
+    lost = 0
+    out = sys.stdout
+    try:
+        for frame in subscribe(args.url):
+            if args.duration is not None and time.monotonic() - start >= args.duration:
+                break
+            if frame is None:
+                continue
+            following = expected.get(frame.name)
+            if following is not None and frame.sequence != following:
+                lost += frame.sequence - following
+                sys.stderr.write("{}: {} samples lost\n".format(frame.name, frame.sequence - following))
+            expected[frame.name] = frame.sequence + len(frame.times)
+            samples += len(frame.times)
+            out.write("".join("{},{:.6f},{}\n".format(frame.name, t, v)
+                              for t, v in zip(frame.times.tolist(), frame.values.tolist())))
+            out.flush()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    except ConnectionRefusedError:
+        sys.stderr.write("Nothing is publishing on {}\n".format(args.url))
+        return 1
+    sys.stderr.write("Received {} samples, {} lost.\n".format(samples, lost))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Triggered capture of short load events, such as impacts or breakaway.
+
+A TriggerEngine watches the samples of one load cell as they are read. When
+its trigger fires it keeps the samples from a set time before the trigger
+(out of a fixed size ring of recent samples) to a set time after it as one
+EventRecord. Triggers are evaluated on whole blocks of samples with numpy,
+so they keep up with the fastest devices.
+
+    Copyright (C) 2018  Jeremy Daily, The University of Tulsa
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. See LICENSE for details.
+"""
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+TRIGGER_KINDS = ("threshold", "slope", "delta")
+TRIGGER_DIRECTIONS = ("rising", "falling")
+
+
+class SampleRing(object):
+    ''' The most recent capacity samples, in two preallocated arrays. '''
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.end = 0 # total number of samples ever appended
+
+    def __len__(self):
+        return min(self.end, self.capacity)
+
+    def append(self, times, values):
+        count = len(times)
+        if count >= self.capacity:
+            times = times[-self.capacity:]
+            values = values[-self.capacity:]
+            self.end += count - self.capacity
+            count = self.capacity
+        start = self.end % self.capacity
+        first = min(count, self.capacity - start)
+        self.times[start:start + first] = times[:first]
+        self.values[start:start + first] = values[:first]
+        self.times[:count - first] = times[first:]
+        self.values[:count - first] = values[first:]
+        self.end += count
+
+    def since(self, t0):
+        '''
+        Copies of the samples at or after time t0, oldest first. Only the
+        samples in that window are searched and copied: the ring holds them
+        in two runs, the older from start to the end of the arrays and the
+        newer from the front of the arrays up to start.
+        '''
+        length = len(self)
+        start = self.end % self.capacity
+        if length < self.capacity or start == 0:
+            first = int(np.searchsorted(self.times[:length], t0, 'left'))
+            return self.times[first:length].copy(), self.values[first:length].copy()
+        if self.times[-1] < t0:
+            # The window lies within the newer run
+            first = int(np.searchsorted(self.times[:start], t0, 'left'))
+            return self.times[first:start].copy(), self.values[first:start].copy()
+        first = start + int(np.searchsorted(self.times[start:], t0, 'left'))
+        return (np.concatenate((self.times[first:], self.times[:start])),
+                np.concatenate((self.values[first:], self.values[:start])))
+
+
+class Trigger(object):
+    '''
+    When to capture an event. The signal that is compared with level is
+        threshold  the load itself
+        slope      the rate of change between samples (load per second)
+        delta      the change of the load over the last window seconds
+    A rising trigger fires when the signal reaches level, a falling one when
+    it drops to level. It is armed again only once the signal has gone back
+    past level by the hysteresis, so noise around the level does not fire it
+    over and over.
+    '''
+    def __init__(self, kind="threshold", level=100.0, direction="rising",
+                 hysteresis=1.0, window=0.1):
+        if kind not in TRIGGER_KINDS:
+            raise ValueError("Unknown trigger kind {}".format(kind))
+        if direction not in TRIGGER_DIRECTIONS:
+            raise ValueError("Unknown trigger direction {}".format(direction))
+        self.kind = kind
+        self.level = level
+        self.direction = direction
+        self.hysteresis = abs(hysteresis)
+        self.window = window
+
+    def describe(self):
+        units = {"threshold": "lb", "slope": "lb/s", "delta": "lb in {:g} s".format(self.window)}
+        return "{} {} {:g} {}".format(self.direction.capitalize(), self.kind, self.level, units[self.kind])
+
+
+class EventRecord(object):
+    ''' The samples around one firing of a trigger. '''
+    def __init__(self, name, number, trigger, trigger_time, times, values):
+        self.name = name
+        self.number = number
+        self.trigger = trigger
+        self.trigger_time = trigger_time
+        self.times = times
+        self.values = values
+        index = int(np.argmax(np.abs(values))) if len(values) else None
+        self.peak = float(values[index]) if index is not None else None
+        self.peak_time = float(times[index]) if index is not None else None
+
+    @property
+    def title(self):
+        return "{} Event {}".format(self.name, self.number)
+
+
+class TriggerEngine(object):
+    '''
+    Evaluates a Trigger on the blocks of samples of one load cell and
+    returns the finished EventRecords. pre_seconds of samples before the
+    trigger are kept as long as they fit in the ring of ring_size samples.
+    While an event is being captured the trigger does not fire again.
+    '''
+    def __init__(self, trigger, pre_seconds=0.5, post_seconds=2.0, name="Load", ring_size=65536):
+        self.trigger = trigger
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.name = name
+        self.ring = SampleRing(ring_size)
+        self.armed = True
+        self.last = None # (time, value) of the previous sample
+        self.capture = None # [trigger time, end time, list of time blocks, list of value blocks]
+        self.events = 0
+
+    def signal(self, times, values):
+        ''' The signal the trigger compares with its level, for each sample. '''
+        trigger = self.trigger
+        if trigger.kind == "threshold":
+            signal = values.copy()
+        elif trigger.kind == "slope":
+            if self.last is None:
+                previous_t = np.r_[np.nan, times[:-1]]
+                previous_v = np.r_[np.nan, values[:-1]]
+            else:
+                previous_t = np.r_[self.last[0], times[:-1]]
+                previous_v = np.r_[self.last[1], values[:-1]]
+            steps = times - previous_t
+            # Samples with the same timestamp have no meaningful slope
+            steps[steps <= 0] = np.nan
+            signal = (values - previous_v) / steps
+        else:
+            history_t, history_v = self.ring.since(times[0] - trigger.window)
+            all_t = np.concatenate((history_t, times))
+            all_v = np.concatenate((history_v, values))
+            reference = np.searchsorted(all_t, times - trigger.window, 'left')
+            signal = values - all_v[reference]
+        if trigger.direction == "falling":
+            signal = -signal
+        return signal
+
+    def process(self, times, values):
+        ''' Feed a block of samples, oldest first. Returns the events finished by it. '''
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        count = len(times)
+        if count == 0:
+            return []
+        trigger = self.trigger
+        signal = self.signal(times, values)
+        level = trigger.level if trigger.direction == "rising" else -trigger.level
+        # Indices where the signal fires an armed trigger, and where it re-arms it
+        fires = np.flatnonzero(signal >= level)
+        rearms = np.flatnonzero(signal <= level - trigger.hysteresis)
+
+        finished = []
+        position = 0
+        while position < count:
+            if self.capture is not None:
+                end = int(np.searchsorted(times, self.capture[1], 'right'))
+                self.capture[2].append(times[position:end])
+                self.capture[3].append(values[position:end])
+                self.follow(fires, rearms, position, end)
+                position = end
+                if end < count:
+                    finished.append(self.finish())
+                continue
+            index = self.next_fire(fires, rearms, position, count)
+            if index is None:
+                break
+            trigger_time = times[index]
+            pre_t, pre_v = self.ring.since(trigger_time - self.pre_seconds)
+            first = int(np.searchsorted(times, trigger_time - self.pre_seconds, 'left'))
+            self.capture = [trigger_time, trigger_time + self.post_seconds,
+                            [pre_t, times[first:index]], [pre_v, values[first:index]]]
+            position = index
+
+        self.ring.append(times, values)
+        self.last = (times[-1], values[-1])
+        return finished
+
+    def next_fire(self, fires, rearms, start, stop):
+        '''
+        Run the armed state through the samples start to stop. Returns the
+        index where the trigger fired (and disarms it), or None.
+        '''
+        position = start
+        while True:
+            if self.armed:
+                k = int(np.searchsorted(fires, position, 'left'))
+                if k == len(fires) or fires[k] >= stop:
+                    return None
+                self.armed = False
+                return int(fires[k])
+            k = int(np.searchsorted(rearms, position, 'left'))
+            if k == len(rearms) or rearms[k] >= stop:
+                return None
+            self.armed = True
+            position = int(rearms[k])
+
+    def follow(self, fires, rearms, start, stop):
+        ''' Keep the armed state up to date while capturing, without firing. '''
+        position = start
+        while position < stop:
+            index = self.next_fire(fires, rearms, position, stop)
+            if index is None:
+                return
+            position = index + 1
+
+    def finish(self):
+        ''' Close the event being captured and return its record. '''
+        trigger_time, end, time_blocks, value_blocks = self.capture
+        self.capture = None
+        self.events += 1
+        event = EventRecord(self.name, self.events, self.trigger, trigger_time,
+                            np.concatenate(time_blocks), np.concatenate(value_blocks))
+        logger.info("Captured {} ({}) with {} samples.".format(
+            event.title, self.trigger.describe(), len(event.times)))
+        return event
@@ -0,0 +1,251 @@
+"""
+Benchmark the acquisition, plotting and export pipeline of the LoadStar
+Logger without a load cell or a display.
+
+Synthetic load lines (made by the simulated load cell) are fed to the reader
+thread as fast as it takes them, and synthetic histories of increasing
+length are pushed through the plotting and export code of the GUI on the
+offscreen Qt platform. Each measurement runs in a fresh interpreter so the
+peak memory use of one history length does not hide that of the next.
+
+Measured:
+    reader          lines/s and bytes/s through loadcellThread
+    add_data        converting a whole history for plotting
+    tick            one LoadStarLogger.update_plot with new samples (median, p95, max)
+    redraw_interval the time between redraws the RedrawScheduler picks for those ticks
+    full_draw       a complete redraw of the graph canvas
+    export          CSV export rows/s (of at most --export-limit samples)
+    peak_rss_mb     peak resident memory of the process
+
+Examples:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --sizes 1e3 1e5 1e7 --output pipeline.json
+
+Compare the JSON of two runs to catch regressions.
+"""
+import argparse
+import subprocess
+import statistics
+import platform
+import tempfile
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RATE = 1000.0 # samples per second of the synthetic histories
+TICK = 0.25 # seconds between plot updates, as in the GUI
+
+
+def peak_rss_mb():
+    ''' The peak resident memory of this process in MB, or None if unknown. '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def synthetic_lines(count):
+    ''' count load lines as the device sends them. '''
+    from LoadStarSimulator import SimulatedLoadCell
+    sim = SimulatedLoadCell("sim://?noise=0.05&seed=1")
+    return sim.lines(sim.loads(0, count))
+
+
+class BlobPort(object):
+    '''
+    Hands out a block of bytes like a serial port whose driver always has up
+    to chunk bytes waiting, and reports a lost connection when it is empty.
+    '''
+    def __init__(self, data, chunk=4096):
+        self.data = data
+        self.chunk = chunk
+        self.position = 0
+        self.port = "benchmark"
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.position)
+
+    def read(self, size=1):
+        if self.position >= len(self.data):
+            import serial
+            raise serial.SerialException("End of benchmark data.")
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+
+class RingOnlyReader(object):
+    ''' Stands in for a loadcellThread; update_plot only takes the blocks from its ring. '''
+    def __init__(self, name):
+        from LoadStarData import BlockRing
+        self.name = name
+        self.rx_queue = BlockRing()
+
+    def is_alive(self):
+        return True
+
+
+def benchmark_reader(lines):
+    from LoadStarSerial import loadcellThread
+    from LoadStarData import BlockRing
+    data = synthetic_lines(lines)
+    thread = loadcellThread(BlockRing(), BlobPort(data))
+    start = time.perf_counter()
+    thread.start()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    return {"lines": thread.lines_read,
+            "seconds": elapsed,
+            "lines_per_s": thread.lines_read / elapsed,
+            "bytes_per_s": thread.bytes_read / elapsed,
+            "parse_failures": thread.parse_failures,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def benchmark_history(samples, ticks, export_limit):
+    import numpy as np
+    from PyQt5.QtWidgets import QApplication
+    import LoadStarDisplay
+    from LoadStarData import SampleBuffer
+    from LoadStarStats import RollingStats
+    from LoadStarSession import CSVExporter
+    from LoadStarRedraw import RedrawScheduler
+
+    app = QApplication(sys.argv[:1])
+    window = LoadStarDisplay.LoadStarLogger(setup_dialog=False)
+    graph = window.init_graph()
+    graph.resize(1000, 700)
+    app.processEvents()
+
+    end = time.time()
+    times = end - np.arange(samples, 0, -1) / RATE
+    values = 10 * np.sin(times) + np.random.RandomState(1).normal(0, 0.05, samples)
+    history = SampleBuffer(samples)
+    history.append(times, values)
+    window.load_histories["Bench"] = history
+    window.filtered_histories["Bench"] = SampleBuffer()
+    window.load_stats["Bench"] = RollingStats()
+    reader = RingOnlyReader("Bench")
+    window.retired_threads.append(reader)
+    # Redraw on every tick, however long the last one took
+    window.redraw = RedrawScheduler(budget=float("inf"), fastest=0.0)
+    result = {"samples": samples}
+
+    start = time.perf_counter()
+    graph.add_data(history, marker='.', label="Bench")
+    result["add_data_s"] = time.perf_counter() - start
+    graph.plot()
+    app.processEvents()
+
+    chunk = int(RATE * TICK)
+    durations = []
+    for tick in range(ticks):
+        new_times = end + (tick * chunk + np.arange(1, chunk + 1)) / RATE
+        reader.rx_queue.put(("Bench", new_times, 10 * np.sin(new_times), None))
+        start = time.perf_counter()
+        window.update_plot()
+        durations.append(time.perf_counter() - start)
+        app.processEvents()
+    durations.sort()
+    result["tick_median_s"] = statistics.median(durations)
+    result["tick_p95_s"] = durations[min(int(0.95 * len(durations)), len(durations) - 1)]
+    result["tick_max_s"] = durations[-1]
+    scheduler = RedrawScheduler()
+    for duration in durations:
+        scheduler.observe(duration)
+    result["redraw_interval_s"] = scheduler.interval
+
+    draws = []
+    for repeat in range(5):
+        start = time.perf_counter()
+        graph.canvas.draw()
+        draws.append(time.perf_counter() - start)
+    result["full_draw_s"] = statistics.median(draws)
+
+    count = min(len(history), export_limit)
+    with tempfile.TemporaryDirectory() as directory:
+        exporter = CSVExporter(os.path.join(directory, "export.csv"),
+                               [("Bench", history.times[-count:], history.values[-count:])])
+        start = time.perf_counter()
+        exporter.run()
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(exporter.path)
+    result["export_rows"] = count
+    result["export_rows_per_s"] = count / elapsed
+    result["export_mb_per_s"] = size / elapsed / 2**20
+    result["peak_rss_mb"] = peak_rss_mb()
+    for recorder in window.recorders.values():
+        recorder.close()
+    return result
+
+
+def run_child(arguments):
+    ''' Run this script with the arguments in a fresh interpreter and return its JSON. '''
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    with tempfile.TemporaryDirectory() as directory:
+        # An empty working directory, so no load cells are searched for
+        output = subprocess.run([sys.executable, os.path.abspath(__file__)] + arguments,
+                                cwd=directory, env=environment, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True,
+                                check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e3, 1e4, 1e5, 1e6, 1e7],
+                        help="History lengths in samples.")
+    parser.add_argument("--ticks", type=int, default=40, help="Plot updates timed per history.")
+    parser.add_argument("--lines", type=float, default=2e6, help="Lines fed to the reader.")
+    parser.add_argument("--export-limit", type=float, default=1e6,
+                        help="Most samples exported per history.")
+    parser.add_argument("--output", metavar="FILE", help="Write the results to this JSON file.")
+    parser.add_argument("--reader-once", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--history-once", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.reader_once:
+        print(json.dumps(benchmark_reader(int(args.lines))))
+        return 0
+    if args.history_once:
+        print(json.dumps(benchmark_history(int(args.history_once), args.ticks,
+                                           int(args.export_limit))))
+        return 0
+
+    import numpy
+    import matplotlib
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "platform": platform.platform(),
+               "python": platform.python_version(),
+               "numpy": numpy.__version__,
+               "matplotlib": matplotlib.__version__}
+    results["reader"] = run_child(["--reader-once", "--lines", str(args.lines)])
+    print("reader: {lines_per_s:,.0f} lines/s, {bytes_per_s:,.0f} bytes/s".format(**results["reader"]))
+
+    results["history"] = []
+    for size in args.sizes:
+        result = run_child(["--history-once", str(size), "--ticks", str(args.ticks),
+                            "--export-limit", str(args.export_limit)])
+        results["history"].append(result)
+        print("{samples:>10,d} samples: add_data {add_data_s:8.4f} s, tick median {tick_median_s:7.4f} s, "
+              "p95 {tick_p95_s:7.4f} s, full draw {full_draw_s:7.4f} s, "
+              "redraw every {redraw_interval_s:6.3f} s, "
+              "export {export_rows_per_s:10,.0f} rows/s, peak RSS {peak_rss_mb:7.1f} MB".format(**result))
+
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
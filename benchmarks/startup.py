@@ -0,0 +1,93 @@
+"""
+Measure how long the LoadStar Logger takes to start.
+
+Every run starts a fresh interpreter, since most of the startup time is
+spent importing modules and a warm interpreter would hide that. Each run
+reports the time until the main window is shown and until the graph window
+has been drawn. The load cell search runs as usual but the port selection
+dialog is not shown, so the measurement does not wait for anybody.
+
+Examples:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --output startup.json
+
+Without a display, set QT_QPA_PLATFORM=offscreen.
+"""
+import argparse
+import subprocess
+import statistics
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_once():
+    ''' Start the program in this interpreter and print the timings as JSON. '''
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    import LoadStarDisplay
+    imported = time.perf_counter()
+
+    app = QApplication(sys.argv[:1])
+    window = LoadStarDisplay.LoadStarLogger(setup_dialog=False)
+    # Paint the window now; the event loop would import the graph first
+    window.repaint()
+    shown = time.perf_counter()
+    timings = {}
+
+    def check():
+        graph = window.voltage_graph
+        if graph is None or not graph.isVisible():
+            return
+        graph.canvas.draw()
+        timer.stop()
+        timings.update({"import": imported - start,
+                        "window_shown": shown - start,
+                        "graph_shown": time.perf_counter() - start})
+        app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(check)
+    timer.start(1)
+    app.exec_()
+    print(json.dumps(timings))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh starts to time.")
+    parser.add_argument("--output", metavar="FILE", help="Also write the results to this JSON file.")
+    parser.add_argument("--once", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.once:
+        measure_once()
+        return 0
+
+    runs = []
+    for run in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--once"],
+                                cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, check=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        timings["process"] = time.perf_counter() - start
+        runs.append(timings)
+
+    results = {"runs": runs,
+               "median": {key: statistics.median(run[key] for run in runs) for key in runs[0]},
+               "python": sys.version.split()[0]}
+    for key, value in results["median"].items():
+        print("{:>14}: {:7.1f} ms".format(key, 1000 * value))
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())